@@ -1,40 +1,17 @@
 import streamlit as st
-import pandas as pd
 import hashlib
-from datetime import datetime, timedelta
+from datetime import datetime
 import sys
 import os
 
-# Ajustar el path para importaciones
-current_dir = os.path.dirname(os.path.abspath(__file__))
-parent_dir = os.path.dirname(current_dir)
-sys.path.insert(0, current_dir)
-sys.path.insert(0, parent_dir)
-
-# Intentar diferentes rutas de importación
-try:
-    from lib.auth import login_form, has_permission, register_user
-    from lib.sp_wrappers import kpis
-    from lib.db import query
-except ImportError:
-    try:
-        from app.lib.auth import login_form, has_permission, register_user
-        from app.lib.sp_wrappers import kpis
-        from app.lib.db import query
-    except ImportError:
-        try:
-            import lib.auth as auth
-            import lib.sp_wrappers as sp
-            import lib.db as db
-            login_form = auth.login_form
-            has_permission = auth.has_permission
-            register_user = getattr(auth, 'register_user', None)
-            kpis = sp.kpis
-            query = db.query
-        except ImportError as e:
-            st.error(f"Error importando módulos: {e}")
-            st.error("Verifica que los archivos lib/auth.py, lib/sp_wrappers.py y lib/db.py existan")
-            st.stop()
+# Raíz del repo en sys.path: Home y páginas importan siempre como app.lib.* (una sola
+# copia de cada módulo, y por lo tanto un solo pool y una sola caché por proceso)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from app.lib.auth import login_form, has_permission
+from app.lib.db import query, execute, cached_query
 
 st.set_page_config(page_title="Gym Manager", page_icon="🏋️", layout="wide")
 
@@ -84,7 +61,7 @@ def registro_form():
                     password_hash = hashlib.sha256(password.encode()).hexdigest()
                     
                     # Registrar nuevo usuario
-                    query("""
+                    execute("""
                         INSERT INTO auth_user (email, password_hash, rol, sede_id, created_at)
                         VALUES (%s, %s, %s, %s, %s)
                     """, (
@@ -117,81 +94,41 @@ if st.session_state.get("user"):
     # === KPIs PRINCIPALES ===
     st.header("📊 Resumen Ejecutivo")
     
-    try:
-        data = kpis()
-        d = data[0] if data else {}
-        socios = d.get("socios", "—")
-        activas = d.get("membresias_activas", "—")
-        accesos_hoy = d.get("accesos_hoy", "—")
-    except Exception:
-        try:
-            socios = query("SELECT COUNT(*) c FROM socio")[0]["c"]
-            activas = query("SELECT COUNT(*) c FROM membresia WHERE estado='activa' AND fecha_fin>=CURRENT_DATE")[0]["c"]
-            accesos_hoy = query("SELECT COUNT(*) c FROM acceso WHERE fecha_entrada::date=CURRENT_DATE")[0]["c"]
-        except:
-            socios, activas, accesos_hoy = "—", "—", "—"
-
-    # KPIs adicionales
-    try:
-        # Aforo actual por sede
-        aforo_data = query("""
-            SELECT s.nombre, sp_aforo_actual(s.id) as aforo_actual
-            FROM sede s ORDER BY s.nombre
-        """)
-        
-        # Ventas del día
-        ventas_hoy = query("""
-            SELECT COALESCE(SUM(total), 0)::numeric(10,2) as total
-            FROM venta WHERE fecha::date = CURRENT_DATE
-        """)[0]["total"] if query("SELECT COUNT(*) c FROM venta WHERE fecha::date = CURRENT_DATE")[0]["c"] > 0 else 0
-
-        # Próximas clases (hoy)
-        clases_hoy = query("""
-            SELECT COUNT(*) c FROM clase 
-            WHERE fecha_hora::date = CURRENT_DATE AND estado = 'programada'
-        """)[0]["c"]
-
-        # Membresías que vencen en 7 días
-        vencimientos = query("""
-            SELECT COUNT(*) c FROM membresia 
-            WHERE estado = 'activa' AND fecha_fin BETWEEN CURRENT_DATE AND CURRENT_DATE + 7
-        """)[0]["c"]
+    sedes = cached_query("SELECT id, nombre FROM sede ORDER BY nombre")
+    sede = st.selectbox("Sede", [None] + sedes,
+                        format_func=lambda x: "Todas" if x is None else x["nombre"])
 
+    # Todo el resumen en una llamada (fila total + una por sede). Va al primario:
+    # al cambiar el día sp_dashboard refresca kpi_snapshot.
+    try:
+        rows = query("SELECT * FROM sp_dashboard(%s)", (sede["id"] if sede else None,), readonly=False)
     except Exception as e:
-        st.error(f"Error obteniendo datos adicionales: {e}")
-        aforo_data = []
-        ventas_hoy = 0
-        clases_hoy = 0
-        vencimientos = 0
+        st.error(f"Error obteniendo el resumen: {e}")
+        st.stop()
+    total, por_sede = rows[0], rows[1:]
 
-    # Mostrar KPIs en columnas
     col1, col2, col3, col4, col5 = st.columns(5)
-    
-    with col1:
-        st.metric("👥 Socios Totales", socios)
-    with col2:
-        st.metric("💳 Membresías Activas", activas)
-    with col3:
-        st.metric("🚪 Accesos Hoy", accesos_hoy)
-    with col4:
-        st.metric("💰 Ventas Hoy", f"S/. {ventas_hoy}")
-    with col5:
-        st.metric("📅 Clases Hoy", clases_hoy)
+    col1.metric("👥 Socios Totales", total["socios"])
+    col2.metric("💳 Membresías Activas", total["membresias_activas"])
+    col3.metric("🚪 Accesos Hoy", total["accesos_hoy"])
+    col4.metric("💰 Ventas Hoy", f"S/. {total['ventas_hoy']}")
+    col5.metric("📅 Clases Hoy", total["clases_hoy"])
 
     # === ALERTAS ===
-    if vencimientos > 0:
-        st.warning(f"⚠️ {vencimientos} membresías vencen en los próximos 7 días")
+    if total["vencen_7d"] > 0:
+        st.warning(f"⚠️ {total['vencen_7d']} membresías vencen en los próximos 7 días")
 
     # === AFORO POR SEDE ===
-    if aforo_data:
+    if por_sede:
         st.subheader("🏢 Aforo Actual por Sede")
-        aforo_cols = st.columns(len(aforo_data))
-        for i, sede_info in enumerate(aforo_data):
+        aforo_cols = st.columns(len(por_sede))
+        for i, sede_info in enumerate(por_sede):
             with aforo_cols[i]:
                 st.metric(
-                    f"📍 {sede_info['nombre']}", 
+                    f"📍 {sede_info['sede']}",
                     f"{sede_info['aforo_actual']} personas",
-                    help="Personas actualmente en la sede"
+                    help=f"Personas actualmente en la sede · {sede_info['accesos_hoy']} accesos y "
+                         f"{sede_info['clases_hoy']} clases hoy"
                 )
 
     st.divider()
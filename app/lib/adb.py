@@ -0,0 +1,189 @@
+# app/lib/adb.py
+"""
+Variante asíncrona de db.py para cargar paneles en paralelo.
+
+Streamlit ejecuta cada página en un hilo síncrono, así que las corrutinas corren
+en un event loop propio (un hilo por proceso) con su AsyncConnectionPool.
+Desde la página:
+
+    for nombre, filas, error in adb.run_panels({"kpis": adb.aquery(...), "aforo": adb.aquery(...)}):
+        ...  # se pinta cada panel en cuanto termina su consulta
+
+La página y la sesión se capturan en el hilo que llama (el loop no las ve).
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, AsyncExitStack
+
+import psycopg
+from psycopg.rows import tuple_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+from . import db, metrics
+from .cache import result_cache, socio_tags, SP_WRITES, SOCIO_GUC
+
+_loop = None
+_loop_lock = threading.Lock()
+_apools = {}  # rol -> AsyncConnectionPool, o la tarea que lo abre (solo se tocan desde el loop)
+
+# (página, session_id) de quien lanzó la corrutina
+_ctx = contextvars.ContextVar("adb_ctx", default=("-", None))
+
+def _get_loop():
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                # Selector explícito: psycopg async no funciona con el Proactor de Windows
+                loop = asyncio.SelectorEventLoop()
+                threading.Thread(target=loop.run_forever, name="gym-adb", daemon=True).start()
+                _loop = loop
+                atexit.register(close)
+    return _loop
+
+async def _open_pool(role):
+    kwargs = {k: v for k, v in db._conn_kwargs(role).items() if k != "cursor_factory"}
+    timeout = float(os.getenv("PGREPLICA_TIMEOUT", "2")) if role == "replica" else float(os.getenv("PGPOOL_TIMEOUT", "10"))
+    pool = AsyncConnectionPool(
+        kwargs=kwargs,
+        min_size=1,
+        max_size=int(os.getenv("PGAPOOL_MAX", "5")),
+        timeout=timeout,
+        max_lifetime=float(os.getenv("PGPOOL_MAX_LIFETIME", "1800")),
+        max_idle=float(os.getenv("PGPOOL_MAX_IDLE", "300")),
+        check=AsyncConnectionPool.check_connection,
+        name=f"gym-async-{role}",
+        open=False,
+    )
+    await pool.open()
+    return pool
+
+async def _pool(role) -> AsyncConnectionPool:
+    pool = _apools.get(role)
+    if isinstance(pool, AsyncConnectionPool):
+        return pool
+    # mientras se abre se guarda la tarea, para que dos corrutinas no abran dos pools
+    task = pool or _apools.setdefault(role, asyncio.ensure_future(_open_pool(role)))
+    try:
+        pool = await task
+    except BaseException:
+        # si falló no se deja guardado el error: la próxima llamada vuelve a intentar
+        if _apools.get(role) is task:
+            del _apools[role]
+        raise
+    _apools[role] = pool
+    return pool
+
+@asynccontextmanager
+async def _aconn(readonly, sid):
+    """Igual que db.get_conn(): réplica si corresponde y primario como respaldo."""
+    async with AsyncExitStack() as stack:
+        conn = None
+        if readonly and db._use_replica(sid):
+            try:
+                conn = await stack.enter_async_context((await _pool("replica")).connection())
+            except (psycopg.OperationalError, PoolTimeout):
+                db._replica_down_until = time.monotonic() + db.REPLICA_RETRY_SECONDS
+                metrics.log.warning("Réplica no disponible; leyendo del primario")
+        if conn is None:
+            conn = await stack.enter_async_context((await _pool("primary")).connection())
+        yield conn
+
+async def _run(sql, params, readonly, fetch):
+    """Ejecuta una sentencia en una conexión del pool async y la registra en metrics."""
+    page, sid = _ctx.get()
+    async with _aconn(readonly, sid) as conn:
+        t0 = time.perf_counter()
+        result, rows, nbytes = await fetch(conn, sql, params or ())
+        ms = (time.perf_counter() - t0) * 1000
+    if metrics.record(sql, ms, rows, nbytes, page):
+        metrics.record_slow(sql, ms, page, None)
+    return result
+
+async def _fetch_dicts(conn, sql, params):
+    cur = await conn.execute(sql, params)
+    rows = await cur.fetchall() if cur.description else []
+    return rows, cur.rowcount, db._result_bytes(cur)
+
+async def _fetch_df(conn, sql, params):
+    from psycopg.types.numeric import FloatLoader
+
+    async with conn.cursor(row_factory=tuple_row) as cur:
+        cur.adapters.register_loader("numeric", FloatLoader)
+        await cur.execute(sql, params)
+        rows = await cur.fetchall()
+        return db._to_df(cur.description or [], rows), len(rows), db._result_bytes(cur)
+
+async def aquery(sql, params=None, readonly=True):
+    """Como db.query() pero awaitable."""
+    return await _run(sql, params, readonly, _fetch_dicts)
+
+async def aquery_df(sql, params=None, readonly=True):
+    """Como db.query_df() pero awaitable."""
+    return await _run(sql, params, readonly, _fetch_df)
+
+async def _fetch_escritura(conn, sql, params):
+    """Como _fetch_dicts, y además los socios que anotaron los triggers (antes del commit)."""
+    rows, n, nbytes = await _fetch_dicts(conn, sql, params)
+    cur = await conn.execute("SELECT current_setting(%s, true) AS v", (SOCIO_GUC,))
+    return (rows, socio_tags((await cur.fetchone())["v"])), n, nbytes
+
+async def acall_sp(sp_name, params=(), readonly=False):
+    """Como db.call_sp(); con readonly=False hace commit e invalida la caché de lo que escribe el SP."""
+    placeholders = ",".join(["%s"] * len(params))
+    sql = f"SELECT * FROM {sp_name}({placeholders})"
+    if readonly:
+        return await _run(sql, params, readonly, _fetch_dicts)
+    rows, socios = await _run(sql, params, readonly, _fetch_escritura)
+    db._mark_write(_ctx.get()[1])
+    result_cache.invalidate(set(SP_WRITES.get(sp_name, ())) | socios)
+    return rows
+
+# -------------------------------------------
+# Puente con el hilo de la página
+# -------------------------------------------
+def _submit(coro, ctx) -> concurrent.futures.Future:
+    async def wrapped():
+        _ctx.set(ctx)
+        return await coro
+    return asyncio.run_coroutine_threadsafe(wrapped(), _get_loop())
+
+def _caller_ctx():
+    return (metrics.caller_page(), db._session_id())
+
+def run(coro):
+    """Ejecuta una corrutina en el loop de fondo y espera su resultado."""
+    return _submit(coro, _caller_ctx()).result()
+
+def run_panels(coros: dict):
+    """
+    Lanza todas las corrutinas a la vez y va devolviendo (nombre, resultado, error)
+    en el orden en que terminan; el error es None si la consulta salió bien.
+    """
+    ctx = _caller_ctx()
+    futs = {_submit(c, ctx): name for name, c in coros.items()}
+    for f in concurrent.futures.as_completed(futs):
+        err = f.exception()
+        yield futs[f], (None if err else f.result()), err
+
+def close():
+    if _loop is None:
+        return
+    async def _close():
+        for pool in list(_apools.values()):
+            try:
+                if not isinstance(pool, AsyncConnectionPool):
+                    pool = await pool
+                await pool.close()
+            except Exception:
+                pass
+        _apools.clear()
+    try:
+        asyncio.run_coroutine_threadsafe(_close(), _loop).result(timeout=5)
+    except Exception:
+        pass
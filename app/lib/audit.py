@@ -0,0 +1,221 @@
+# app/lib/audit.py
+"""
+Auditoría en segundo plano.
+
+record() solo encola el evento; un hilo escritor lo vuelca a `auditoria` con COPY
+cada AUDIT_FLUSH_MS o cada AUDIT_BATCH eventos. Si la cola está llena la petición
+espera un momento (backpressure) y, si sigue llena, el evento va al archivo de
+respaldo. Lo mismo pasa con un lote que no se pudo escribir (BD caída): queda en
+AUDIT_SPILL (JSON por línea) y se reintenta en el siguiente volcado exitoso.
+Si el COPY falla por los datos (no por la conexión) se reintenta fila por fila;
+las filas que igual fallan van a AUDIT_SPILL + ".rejected" para no trabar la cola.
+El archivo lo comparten todos los procesos del host: escribir y reenviar se hace
+con un lock de archivo (flock), así dos workers no reenvían ni pierden lo mismo.
+"""
+import atexit
+from contextlib import contextmanager
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg
+
+try:
+    import fcntl
+except ImportError:  # Windows (solo desarrollo): basta el lock entre hilos
+    fcntl = None
+
+from .db import get_conn, get_pool
+
+log = logging.getLogger("gym.audit")
+
+QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+FLUSH_MS = float(os.getenv("AUDIT_FLUSH_MS", "500"))
+BATCH = int(os.getenv("AUDIT_BATCH", "500"))
+PUT_TIMEOUT = 0.05  # segundos que una petición espera si la cola está llena
+SPILL_PATH = os.getenv("AUDIT_SPILL", os.path.join(tempfile.gettempdir(), "gym_audit_spill.jsonl"))
+REJECTED_PATH = SPILL_PATH + ".rejected"
+
+COLUMNS = ("usuario_id", "accion", "entidad", "entidad_id", "detalle", "ts")
+_COPY_SQL = f"COPY auditoria ({', '.join(COLUMNS)}) FROM STDIN"
+_INSERT_SQL = f"INSERT INTO auditoria ({', '.join(COLUMNS)}) VALUES ({', '.join(['%s'] * len(COLUMNS))})"
+# errores del contenido de una fila: reintentar no sirve, a diferencia de una caída de la BD
+_ROW_ERRORS = (psycopg.DataError, psycopg.IntegrityError)
+
+_q = queue.Queue(maxsize=QUEUE_MAX)
+_STOP = object()
+_thread = None
+_thread_lock = threading.Lock()
+_spill_lock = threading.Lock()
+_reject_lock = threading.Lock()  # aparte: _replay() rechaza filas con el archivo de respaldo tomado
+_stats = {"written": 0, "spilled": 0, "replayed": 0, "errors": 0, "rejected": 0}
+_stats_lock = threading.Lock()
+
+def _count(**n):
+    # lo actualizan el hilo escritor y las peticiones (al desbordar la cola)
+    with _stats_lock:
+        for k, v in n.items():
+            _stats[k] += v
+
+def record(accion: str, entidad: str, entidad_id=None, detalle: dict | None = None, usuario_id=None):
+    """Encola un evento de auditoría. No lanza ni espera a la BD."""
+    ev = (usuario_id, accion, entidad, entidad_id,
+          json.dumps(detalle, ensure_ascii=False, default=str) if detalle is not None else None,
+          datetime.now(timezone.utc))
+    _ensure_writer()
+    try:
+        _q.put(ev, timeout=PUT_TIMEOUT)
+    except queue.Full:
+        _spill([ev])
+
+def stats() -> dict:
+    with _stats_lock:
+        s = dict(_stats)
+    return dict(s, queued=_q.qsize(), spill_pending=_spill_pending())
+
+def flush(timeout=5.0):
+    """Vacía la cola y detiene el escritor (se llama al salir del proceso)."""
+    global _thread
+    with _thread_lock:
+        t, _thread = _thread, None
+    if t is None:
+        return
+    try:
+        _q.put(_STOP, timeout=timeout)
+    except queue.Full:
+        pass
+    t.join(timeout)
+
+# -------------------------------------------
+# Escritor
+# -------------------------------------------
+def _ensure_writer():
+    global _thread
+    if _thread is None:
+        with _thread_lock:
+            if _thread is None:
+                # el pool debe existir antes: atexit corre en orden inverso y flush() lo necesita
+                get_pool()
+                atexit.register(flush)
+                _thread = threading.Thread(target=_run, name="gym-audit", daemon=True)
+                _thread.start()
+
+def _run():
+    stop = False
+    while not stop:
+        batch = []
+        ev = _q.get()
+        deadline = time.monotonic() + FLUSH_MS / 1000
+        while True:
+            if ev is _STOP:
+                stop = True
+            else:
+                batch.append(ev)
+            if stop or len(batch) >= BATCH:
+                break
+            try:
+                ev = _q.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+        if batch:
+            _write(batch)
+
+def _copy(rows):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            with cur.copy(_COPY_SQL) as cp:
+                for r in rows:
+                    cp.write_row(r)
+
+def _insert_rows(rows) -> list:
+    """Inserta fila por fila (cada una en su savepoint); devuelve [(fila, error)] de las que fallan."""
+    rejected = []
+    with get_conn() as conn:
+        with conn.transaction(), conn.cursor() as cur:
+            for r in rows:
+                try:
+                    with conn.transaction():
+                        cur.execute(_INSERT_SQL, r)
+                except _ROW_ERRORS as e:
+                    rejected.append((r, e))
+    return rejected
+
+def _reject(rejected):
+    with _reject_lock:
+        with open(REJECTED_PATH, "a", encoding="utf-8") as fh:
+            for r, e in rejected:
+                log.error("Evento de auditoría rechazado (%s): %r", e, r)
+                fh.write(json.dumps(dict(zip(COLUMNS, r), error=str(e)), ensure_ascii=False, default=str) + "\n")
+    _count(rejected=len(rejected))
+
+def _store(rows) -> int:
+    """COPY de `rows`; si una fila tiene datos inválidos, fila por fila. Devuelve cuántas se escribieron."""
+    try:
+        _copy(rows)
+        return len(rows)
+    except _ROW_ERRORS as e:
+        log.warning("COPY de auditoría rechazado (%s); se reintenta fila por fila", e)
+    rejected = _insert_rows(rows)
+    if rejected:
+        _reject(rejected)
+    return len(rows) - len(rejected)
+
+def _write(batch):
+    try:
+        n = _store(batch)
+    except Exception as e:
+        _count(errors=1)
+        log.warning("No se pudo escribir auditoría (%s); %d eventos a %s", e, len(batch), SPILL_PATH)
+        _spill(batch)
+        return
+    _count(written=n)
+    if _spill_pending():
+        _replay()
+
+def _spill_pending() -> bool:
+    try:
+        return os.path.getsize(SPILL_PATH) > 0
+    except OSError:
+        return False
+
+@contextmanager
+def _spill_file():
+    """Archivo de respaldo abierto y bloqueado para este hilo y este proceso."""
+    with _spill_lock:
+        with open(SPILL_PATH, "a+", encoding="utf-8") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield fh
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+def _spill(events):
+    with _spill_file() as fh:
+        for ev in events:
+            fh.write(json.dumps(dict(zip(COLUMNS, ev)), ensure_ascii=False, default=str) + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+    _count(spilled=len(events))
+
+def _replay():
+    """Reenvía lo acumulado en el archivo de respaldo; si falla, el archivo queda intacto."""
+    with _spill_file() as fh:
+        fh.seek(0)
+        rows = [tuple(json.loads(line)[c] for c in COLUMNS) for line in fh if line.strip()]
+        if not rows:
+            return
+        try:
+            n = _store(rows)
+        except Exception as e:
+            log.warning("Reintento de auditoría pendiente falló (%s)", e)
+            return
+        # se vacía (no se borra) bajo el lock: otro proceso puede estar esperando para escribir
+        fh.truncate(0)
+    _count(replayed=n, written=n)
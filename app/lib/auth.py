@@ -1,8 +1,13 @@
 # app/lib/auth.py
 import hashlib
-import json
+import os
+import threading
+import time
 import streamlit as st
-from .db import query
+from . import notify
+from . import audit as audit_log
+from .cache import CHANNEL
+from .db import query, query_batch, execute, call_sp
 
 # -------------------------------------------
 # Fallback local (por si aún no migras a tablas RBAC)
@@ -42,80 +47,169 @@ FALLBACK_PERMISSIONS = {
 def _sha256(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
-def _load_roles_for_user(user_id: int) -> list[str]:
-    """Devuelve roles del usuario desde tabla user_role (si existe)."""
-    try:
-        rows = query("""
-            SELECT r.name
-            FROM user_role ur
-            JOIN role r ON r.id = ur.role_id
-            WHERE ur.user_id = %s
-            ORDER BY r.name
-        """, (user_id,))
-        return [r["name"] for r in rows]
-    except Exception:
-        # si aún no hay tablas RBAC, usa el campo 'rol' de app_user
-        u = st.session_state.get("user") or {}
-        return [str(u.get("rol") or "").lower()] if u.get("rol") else []
+# -------------------------------------------
+# Caché de permisos compilada (una por proceso, compartida por las sesiones)
+# -------------------------------------------
+# Tablas cuyo cambio (NOTIFY de fn_notificar_cambio) invalida la caché
+RBAC_TABLES = {"app_user", "role", "user_role", "permission", "role_permission", "user_permission"}
+PERM_CACHE_TTL = float(os.getenv("PERM_CACHE_TTL", "300"))
 
-def load_permissions(user_id: int) -> None:
+class PermissionCache:
     """
-    Carga y cachea permisos efectivos del usuario:
-      - Intenta vista v_user_permissions (roles + overrides)
-      - Si falla, usa FALLBACK_PERMISSIONS en base al rol de app_user
+    Cada permiso es un bit; por usuario se guarda (máscara, roles) leídos de una vez
+    para todos los usuarios (v_user_permissions + user_role). Si no hay tablas RBAC
+    se usan las máscaras de FALLBACK_PERMISSIONS por rol.
     """
-    try:
-        rows = query("SELECT perm FROM v_user_permissions WHERE user_id = %s", (user_id,))
-        st.session_state["permissions"] = {r["perm"] for r in rows}
-        st.session_state["roles"] = _load_roles_for_user(user_id)
-        # Si el usuario es 'admin' por tabla de roles, concede todo por conveniencia:
-        if "admin" in st.session_state.get("roles", []):
-            # opcional: podrías saltarte esto si ya asignas todo a admin en BD
-            pass
-    except Exception:
-        # Fallback: deriva permisos por el rol simple (campo app_user.rol)
-        u = st.session_state.get("user") or {}
-        role = str(u.get("rol") or "").lower()
-        perms = {p for p, roles in FALLBACK_PERMISSIONS.items() if role in roles or role == "admin"}
-        st.session_state["permissions"] = perms
-        st.session_state["roles"] = [role] if role else []
 
-def has_permission(perm: str) -> bool:
-    """True si el usuario tiene el permiso. Usa cache en session_state."""
-    perms = st.session_state.get("permissions")
-    if perms is None:
-        u = st.session_state.get("user")
-        if not u:
-            return False
-        load_permissions(u["id"])
-        perms = st.session_state.get("permissions", set())
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._bits = {}         # perm -> bit
+        self._users = None      # user_id -> (máscara, roles)
+        self._rbac = True
+        self._loaded_at = 0.0
+        self._gen = 0           # sube en cada invalidación
+        self._primed = {}       # user_id -> (máscara, roles, instante) de logins recientes
+        self._listening = False
+        self._fallback = {}     # rol -> máscara
+        for perm, roles in FALLBACK_PERMISSIONS.items():
+            for r in roles:
+                self._fallback[r] = self._fallback.get(r, 0) | self.bit(perm)
+        self._fallback["admin"] = self.mask(FALLBACK_PERMISSIONS)
+
+    def bit(self, perm: str) -> int:
+        b = self._bits.get(perm)
+        if b is None:
+            with self._lock:
+                b = self._bits.setdefault(perm, 1 << len(self._bits))
+        return b
+
+    def mask(self, perms) -> int:
+        m = 0
+        for p in perms:
+            m |= self.bit(p)
+        return m
+
+    def user(self, user_id) -> tuple[int, tuple] | None:
+        """(máscara, roles) del usuario; None si no hay tablas RBAC (usar fallback)."""
+        users = self._users
+        if users is None or time.monotonic() - self._loaded_at > self.ttl:
+            p = self._primed.get(user_id)
+            if p is not None and time.monotonic() - p[2] < self.ttl:
+                return p[:2]
+            with self._load_lock:  # una sola recarga aunque lleguen varias sesiones
+                users = self._users
+                if users is None or time.monotonic() - self._loaded_at > self.ttl:
+                    users = self._load()
+        if not self._rbac:
+            return None
+        return users.get(user_id, (0, ()))
+
+    def prime(self, user_id, perms, roles):
+        """Guarda lo que devolvió sp_login para no releer hasta la próxima carga completa."""
+        with self._lock:
+            self._primed[user_id] = (self.mask(perms), tuple(roles or ()), time.monotonic())
+
+    def fallback(self, role: str) -> int:
+        return self._fallback.get(role, 0)
+
+    def invalidate(self):
+        with self._lock:
+            self._gen += 1
+            self._users = None
+            self._primed.clear()
+
+    def _load(self):
+        if not self._listening:
+            self._listening = True
+            notify.subscribe(CHANNEL, self._on_notify)
+        gen = self._gen
+        users = {}
+        try:
+            perms, roles = query_batch([
+                "SELECT user_id, perm FROM v_user_permissions",
+                "SELECT ur.user_id, r.name FROM user_role ur JOIN role r ON r.id = ur.role_id ORDER BY r.name",
+            ])
+            rbac = True
+        except Exception:
+            perms, roles, rbac = [], [], False
+        masks, names = {}, {}
+        for r in perms:
+            masks[r["user_id"]] = masks.get(r["user_id"], 0) | self.bit(r["perm"])
+        for r in roles:
+            names.setdefault(r["user_id"], []).append(r["name"])
+        for uid in masks.keys() | names.keys():
+            users[uid] = (masks.get(uid, 0), tuple(names.get(uid, ())))
+        with self._lock:
+            # si hubo una invalidación mientras se leía, no se guarda (la próxima llamada recarga)
+            if gen == self._gen:
+                self._users, self._rbac, self._loaded_at = users, rbac, time.monotonic()
+                self._primed.clear()
+            else:
+                self._rbac = rbac
+        return users
+
+    def _on_notify(self, payload):
+        if payload is None or payload in RBAC_TABLES:
+            self.invalidate()
+
+perm_cache = PermissionCache(ttl=PERM_CACHE_TTL)
+
+def _effective(u: dict) -> tuple[int, tuple]:
+    """(máscara, roles) del usuario en sesión."""
+    ent = perm_cache.user(u.get("id"))
+    if ent is not None:
+        return ent
+    # Fallback: deriva permisos por el rol simple (campo app_user.rol)
+    role = str(u.get("rol") or "").lower()
+    return perm_cache.fallback(role), ((role,) if role else ())
+
+def _is_superuser(u: dict) -> bool:
     # Superusuario por campo 'rol' (compatibilidad)
-    u = st.session_state.get("user") or {}
-    if str(u.get("rol")).lower() == "admin":
+    return str(u.get("rol")).lower() == "admin"
+
+def load_permissions(user_id: int) -> None:
+    """Calienta la caché de permisos y deja los roles del usuario en session_state."""
+    u = dict(st.session_state.get("user") or {}, id=user_id)
+    st.session_state["roles"] = list(_effective(u)[1])
+
+def has_permission(perm: str) -> bool:
+    """True si el usuario tiene el permiso (un test de bit contra la caché del proceso)."""
+    u = st.session_state.get("user")
+    if not u:
+        return False
+    if _is_superuser(u):
         return True
-    return perm in perms
+    return bool(_effective(u)[0] & perm_cache.bit(perm))
 
 def has_any(perms_list: list[str]) -> bool:
-    return any(has_permission(p) for p in perms_list)
+    u = st.session_state.get("user")
+    if not u:
+        return False
+    return _is_superuser(u) or bool(_effective(u)[0] & perm_cache.mask(perms_list))
 
 def require_perm(*perms: str):
     """Bloquea si faltan TODOS los permisos requeridos (AND)."""
     require_login()
-    missing = [p for p in perms if not has_permission(p)]
-    if missing:
+    u = st.session_state["user"]
+    need = perm_cache.mask(perms)
+    if not _is_superuser(u) and (_effective(u)[0] & need) != need:
         st.error("No tienes permisos para esta acción.")
         st.stop()
 
 def require_any(*perms: str):
     """Bloquea si no tiene NINGUNO de los permisos (OR)."""
     require_login()
-    if not any(has_permission(p) for p in perms):
+    if not has_any(list(perms)):
         st.error("No tienes permisos suficientes.")
         st.stop()
 
 def has_role(role_name: str) -> bool:
-    roles = st.session_state.get("roles") or []
-    return role_name.lower() in [r.lower() for r in roles]
+    u = st.session_state.get("user")
+    if not u:
+        return False
+    return role_name.lower() in [r.lower() for r in _effective(u)[1]]
 
 def require_role(*roles):
     require_login()
@@ -136,6 +230,22 @@ def on_login_success(user: dict):
 # Login / sesión
 # -------------------------------------------
 def _db_login(email: str, password: str):
+    """
+    Valida con sp_login (bcrypt, migrando SHA-256 heredado) en una sola llamada
+    que además trae roles y permisos. Si el SP no existe aún, usa las consultas previas.
+    """
+    try:
+        rows = call_sp("sp_login", (email, password))
+    except Exception:
+        return _db_login_legacy(email, password)
+    r = rows[0] if rows else {}
+    if r.get("status") != "OK":
+        return None
+    if r["permisos"] is not None:
+        perm_cache.prime(r["user_id"], r["permisos"], r["roles"])
+    return {"id": r["user_id"], "email": r["email"], "rol": r["rol"], "sede_id": r["sede_id"]}
+
+def _db_login_legacy(email: str, password: str):
     """
     Valida con pgcrypto/crypt() en la BD (bcrypt). Si no está disponible,
     cae a comparar SHA-256 (compatibilidad con tu implementación previa).
@@ -216,15 +326,7 @@ def add_sede_scope(sql: str, params: list | tuple):
 # -------------------------------------------
 def audit(accion: str, entidad: str, entidad_id=None, detalle: dict | None = None):
     """
-    Inserta un registro en auditoria (ignora errores si la tabla no existe).
+    Registra un evento en auditoria sin esperar a la BD (lo escribe app/lib/audit.py en segundo plano).
     """
-    try:
-        u = st.session_state.get("user") or {}
-        uid = u.get("id")
-        payload = json.dumps(detalle, ensure_ascii=False) if detalle is not None else None
-        query("""
-            INSERT INTO auditoria (usuario_id, accion, entidad, entidad_id, detalle)
-            VALUES (%s, %s, %s, %s, %s::jsonb)
-        """, (uid, accion, entidad, entidad_id, payload))
-    except Exception:
-        pass
+    u = st.session_state.get("user") or {}
+    audit_log.record(accion, entidad, entidad_id, detalle, usuario_id=u.get("id"))
@@ -0,0 +1,165 @@
+# app/lib/cache.py
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from . import notify
+
+# Canal que publican los triggers fn_notificar_cambio (payload = nombre de la tabla)
+CHANNEL = "tabla_cambio"
+
+# Tablas que escribe cada SP (para invalidar en el acto sin esperar el NOTIFY).
+# Las reservas solo tocan clase.reservadas, que se lee sin caché: no invalidan "clase".
+SP_WRITES = {
+    "sp_alta_socio": ("socio",),
+    "sp_crear_membresia": ("membresia",),
+    "sp_registrar_pago": ("pago",),
+    "sp_publicar_clase": ("clase",),
+    "sp_reservar_clase": ("reserva",),
+    "sp_cancelar_reserva": ("reserva",),
+    "sp_promover_waitlist": ("reserva",),
+    "sp_checkin_clase": ("reserva",),
+    "sp_registrar_acceso": ("acceso",),
+    "sp_registrar_salida": ("acceso",),
+    "sp_registrar_acceso_lote": ("acceso",),
+    "sp_checkin_clase_lote": ("reserva",),
+    "sp_crear_membresia_lote": ("membresia",),
+    "sp_registrar_pago_lote": ("pago",),
+    "sp_reservar_clase_lote": ("reserva",),
+}
+
+# Tablas cuyas escrituras cambian el perfil de un socio (sp_socio_360). Los triggers
+# fn_notificar_socio anotan los ids tocados en la variable de transacción SOCIO_GUC
+# (",12,40" o ",*"); se lee antes del commit para invalidar 'socio:<id>' sin esperar el NOTIFY.
+SOCIO_TABLES = frozenset({"socio", "membresia", "pago", "acceso", "reserva", "venta", "clase"})
+SOCIO_GUC = "gym.socios"
+
+def socio_tags(valor) -> set[str]:
+    ids = {x for x in (valor or "").split(",") if x}
+    return {"socio:*"} if "*" in ids else {f"socio:{x}" for x in ids}
+
+_RE_READ = re.compile(r"\b(?:from|join)\s+([a-z_][\w.]*)", re.I)
+_RE_WRITE = re.compile(r"\b(?:insert\s+into|update|delete\s+from|truncate(?:\s+table)?|copy)\s+([a-z_][\w.]*)", re.I)
+
+def _names(regex, sql: str) -> set[str]:
+    return {m.split(".")[-1].lower() for m in regex.findall(sql)}
+
+def tables_read(sql: str) -> set[str]:
+    return _names(_RE_READ, sql)
+
+def tables_written(sql: str) -> set[str]:
+    return _names(_RE_WRITE, sql)
+
+class ResultCache:
+    """
+    Caché de resultados compartida por todas las sesiones del proceso:
+    TTL + LRU, con cada entrada etiquetada por las tablas que lee.
+    """
+
+    def __init__(self, max_entries=1000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expira, filas, tags)
+        self._by_tag = {}           # tag -> {keys}
+        self._gen = {}              # tag -> generación (sube con cada invalidación)
+        self._epoch = 0             # sube con clear()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def generations(self, tags) -> tuple:
+        """Foto de las generaciones de `tags`; se pasa a set() para no guardar lecturas viejas."""
+        with self._lock:
+            return (self._epoch,) + tuple(self._gen.get(t, 0) for t in tags)
+
+    def set(self, key, rows, tags, ttl=None, gens=None):
+        """
+        Guarda `rows`. Con `gens` (de generations(), tomada antes de leer) no guarda nada si
+        alguna etiqueta se invalidó mientras tanto: la lectura pudo ver datos previos al cambio.
+        """
+        with self._lock:
+            if gens is not None and gens != (self._epoch,) + tuple(self._gen.get(t, 0) for t in tags):
+                return
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), rows, frozenset(tags))
+            for t in tags:
+                self._by_tag.setdefault(t, set()).add(key)
+            while len(self._data) > self.max_entries:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        with self._lock:
+            for t in tags:
+                self._gen[t] = self._gen.get(t, 0) + 1
+                for key in self._by_tag.pop(t, ()):
+                    if key in self._data:
+                        self._drop(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_tag.clear()
+            self._gen.clear()
+            self._epoch += 1  # lo que se esté leyendo ahora tampoco debe guardarse
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "listener": notify.is_connected(),
+            }
+
+    def _drop(self, key):
+        _, _, tags = self._data.pop(key)
+        for t in tags:
+            keys = self._by_tag.get(t)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[t]
+
+result_cache = ResultCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1000")),
+    ttl=float(os.getenv("CACHE_TTL", "300")),
+)
+
+_listening = False
+
+def _on_notify(payload):
+    # payload None: el listener (re)conectó y pudo perder avisos
+    if payload is None:
+        result_cache.clear()
+    elif payload.startswith("socio:"):
+        # un aviso por sentencia con todos sus socios: 'socio:1,2,3'
+        result_cache.invalidate(socio_tags(payload[len("socio:"):]))
+    else:
+        result_cache.invalidate({payload})
+
+def ensure_listener():
+    """Suscribe la caché al canal de cambios (una vez por proceso)."""
+    global _listening
+    if not _listening:
+        _listening = True
+        notify.subscribe(CHANNEL, _on_notify)
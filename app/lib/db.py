@@ -1,52 +1,426 @@
-# app/lib/db.py
-import os
-from contextlib import contextmanager
-from dotenv import load_dotenv
-
-import psycopg
-from psycopg.rows import dict_row
-
-# Carga variables de .env (PGHOST, PGPORT, etc.)
-load_dotenv()
-
-def get_conn():
-    return psycopg.connect(
-        host=os.getenv("PGHOST"),
-        port=os.getenv("PGPORT"),
-        dbname=os.getenv("PGDATABASE"),
-        user=os.getenv("PGUSER"),
-        password=os.getenv("PGPASSWORD"),
-        row_factory=dict_row,  # resultados como diccionarios
-    )
-
-@contextmanager
-def db_cursor(commit=False):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            try:
-                yield cur
-                if commit:
-                    conn.commit()
-            except Exception:
-                conn.rollback()
-                raise
-
-def query(sql, params=None):
-    with db_cursor() as cur:
-        cur.execute(sql, params or ())
-        return cur.fetchall()
-
-def execute(sql, params=None):
-    with db_cursor(commit=True) as cur:
-        cur.execute(sql, params or ())
-        return cur.rowcount
-
-def call_sp(sp_name, params=(), commit=True):
-    placeholders = ",".join(["%s"]*len(params))
-    sql = f"SELECT * FROM {sp_name}({placeholders})" if params else f"SELECT * FROM {sp_name}()"
-    with db_cursor(commit=commit) as cur:
-        cur.execute(sql, params)
-        try:
-            return cur.fetchall()
-        except Exception:
-            return []
+# app/lib/db.py
+import os
+import atexit
+import itertools
+import threading
+import time
+import weakref
+from contextlib import contextmanager, ExitStack
+from dotenv import load_dotenv
+
+import psycopg
+from psycopg.rows import dict_row, tuple_row
+from psycopg_pool import ConnectionPool, PoolTimeout
+
+from . import metrics
+from .cache import (result_cache, ensure_listener, tables_read, tables_written, socio_tags,
+                    SP_WRITES, SOCIO_TABLES, SOCIO_GUC)
+
+# Carga variables de .env (PGHOST, PGPORT, etc.)
+load_dotenv()
+
+# -------------------------------------------
+# Pool de conexiones (uno por proceso, compartido entre sesiones de Streamlit)
+# -------------------------------------------
+_pools = {}
+_pool_lock = threading.Lock()
+
+# Réplica de lectura (opcional): si PGREPLICA_HOST no está definido todo va al primario
+REPLICA_RYW_SECONDS = float(os.getenv("PGREPLICA_RYW_SECONDS", "5"))
+REPLICA_RETRY_SECONDS = 30  # tras un fallo de la réplica, cuánto tiempo se evita
+_replica_down_until = 0.0
+_last_write = {}  # session_id -> instante (monotonic) del último write de esa sesión
+
+# Métricas propias del checkout (el pool no expone el tiempo por petición)
+_checkout = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+_checkout_lock = threading.Lock()
+
+# -------------------------------------------
+# Instrumentación: tiempo, filas y bytes por sentencia
+# -------------------------------------------
+_EXPLAINABLE = ("select", "with", "insert", "update", "delete", "values")
+
+def _sql_text(sql, cur) -> str:
+    if isinstance(sql, str):
+        return sql
+    if isinstance(sql, bytes):
+        return sql.decode("utf-8", "replace")
+    return sql.as_string(cur)
+
+def _result_bytes(cur) -> int:
+    """Bytes recibidos en el resultado; en resultados grandes se estima con una muestra."""
+    res = cur.pgresult
+    if not metrics.ENABLED or res is None or not res.ntuples:
+        return 0
+    sample = min(res.ntuples, 1000)
+    n = sum(len(res.get_value(r, c) or b"") for r in range(sample) for c in range(res.nfields))
+    return n if sample == res.ntuples else n * res.ntuples // sample
+
+def _explain(cur, sql, params) -> str | None:
+    """Plan (sin ANALYZE: no ejecuta la sentencia) dentro de un savepoint para no afectar la transacción."""
+    if not sql.lstrip().lower().startswith(_EXPLAINABLE):
+        return None
+    try:
+        with cur.connection.transaction():
+            c = psycopg.Cursor(cur.connection, row_factory=tuple_row)
+            c.execute("EXPLAIN " + sql, params)
+            return "\n".join(r[0] for r in c.fetchall())
+    except Exception as e:
+        return f"(sin plan: {e})"
+
+class InstrumentedCursor(psycopg.Cursor):
+    """
+    Cursor que registra cada execute() en metrics (y el EXPLAIN si es lenta).
+    También anota las tablas escritas para invalidar la caché al terminar.
+    """
+
+    written = frozenset()
+
+    def execute(self, query, params=None, **kwargs):
+        t0 = time.perf_counter()
+        super().execute(query, params, **kwargs)
+        ms = (time.perf_counter() - t0) * 1000
+        sql = _sql_text(query, self)
+        if not sql.strip():
+            return self  # chequeo de conexión del pool
+        # las tablas escritas invalidan la caché (un SELECT simple no escribe nada)
+        if not sql.lstrip()[:6].lower() == "select":
+            w = tables_written(sql)
+            if w:
+                self.written = self.written | w
+        if metrics.ENABLED:
+            page = metrics.caller_page()
+            if metrics.record(sql, ms, self.rowcount, _result_bytes(self), page):
+                metrics.record_slow(sql, ms, page, _explain(self, sql, params))
+        return self
+
+def _conn_kwargs(role="primary"):
+    # La réplica hereda del primario lo que no defina (PGREPLICA_PORT, PGREPLICA_USER, ...)
+    env = (lambda k: os.getenv(f"PGREPLICA_{k}") or os.getenv(f"PG{k}")) if role == "replica" else (lambda k: os.getenv(f"PG{k}"))
+    return {
+        "host": env("HOST"),
+        "port": env("PORT"),
+        "dbname": env("DATABASE"),
+        "user": env("USER"),
+        "password": env("PASSWORD"),
+        "row_factory": dict_row,  # resultados como diccionarios
+        "cursor_factory": InstrumentedCursor,
+    }
+
+def replica_enabled() -> bool:
+    return bool(os.getenv("PGREPLICA_HOST"))
+
+def get_pool(role="primary") -> ConnectionPool:
+    """Devuelve el pool del proceso ('primary' o 'replica'); lo crea en el primer uso."""
+    pool = _pools.get(role)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(role)
+            if pool is None:
+                # a la réplica se le espera poco: si no responde se lee del primario
+                if role == "replica":
+                    timeout = float(os.getenv("PGREPLICA_TIMEOUT", "2"))
+                else:
+                    timeout = float(os.getenv("PGPOOL_TIMEOUT", "10"))
+                pool = _pools[role] = ConnectionPool(
+                    kwargs=_conn_kwargs(role),
+                    min_size=int(os.getenv("PGPOOL_MIN", "1")),
+                    max_size=int(os.getenv("PGPOOL_MAX", "10")),
+                    timeout=timeout,
+                    max_lifetime=float(os.getenv("PGPOOL_MAX_LIFETIME", "1800")),
+                    max_idle=float(os.getenv("PGPOOL_MAX_IDLE", "300")),
+                    check=ConnectionPool.check_connection,  # descarta conexiones caídas al prestarlas
+                    name=f"gym-{role}",
+                    open=True,
+                )
+                if len(_pools) == 1:
+                    atexit.register(close_pool)
+    return pool
+
+def close_pool():
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+def pool_stats() -> dict:
+    """Estadísticas del pool primario (tamaño, esperas) + tiempo de checkout; la réplica va en 'replica'."""
+    stats = dict(_pools["primary"].get_stats()) if "primary" in _pools else {}
+    if "replica" in _pools:
+        stats["replica"] = dict(_pools["replica"].get_stats())
+    with _checkout_lock:
+        n = _checkout["count"]
+        stats["checkouts"] = n
+        stats["checkout_ms_avg"] = round(_checkout["total_ms"] / n, 2) if n else 0.0
+        stats["checkout_ms_max"] = round(_checkout["max_ms"], 2)
+    return stats
+
+# -------------------------------------------
+# Sentencias preparadas (rutas calientes: torniquete, reservas, caja)
+# -------------------------------------------
+# PGPREPARE=0 las desactiva (p. ej. detrás de pgbouncer en modo transaction)
+PREPARE_ENABLED = os.getenv("PGPREPARE", "1") != "0"
+_statements = {}                        # nombre -> sql
+_prepared = weakref.WeakKeyDictionary() # conexión -> {nombres ya preparados en ella}
+_prep_stats = {}                        # nombre -> {"prepares": n, "executions": n}
+_prep_lock = threading.Lock()
+
+def register_statement(name: str, sql: str):
+    """Registra una sentencia caliente: se prepara una vez por conexión del pool y luego se ejecuta por nombre."""
+    with _prep_lock:
+        _statements[name] = sql
+        _prep_stats.setdefault(name, {"prepares": 0, "executions": 0})
+
+def execute_prepared(cur, name: str, params=()):
+    """Ejecuta la sentencia registrada `name` en el cursor (y en su transacción)."""
+    conn = cur.connection
+    cur.execute(_statements[name], params, prepare=PREPARE_ENABLED)
+    with _prep_lock:
+        done = _prepared.setdefault(conn, set())
+        st = _prep_stats[name]
+        st["executions"] += 1
+        if PREPARE_ENABLED and name not in done:
+            done.add(name)
+            st["prepares"] += 1
+    return cur
+
+def prepared_stats() -> list[dict]:
+    """Por sentencia: veces que se preparó (una por conexión) y ejecuciones totales."""
+    with _prep_lock:
+        items = [(n, dict(st)) for n, st in _prep_stats.items()]
+    return [{
+        "nombre": n,
+        "prepares": st["prepares"],
+        "executions": st["executions"],
+        "reuso": round(1 - st["prepares"] / st["executions"], 3) if st["executions"] else 0.0,
+    } for n, st in sorted(items)]
+
+for _sp, _n in (("sp_aforo_actual", 1), ("sp_registrar_acceso", 2), ("sp_registrar_salida", 1), ("sp_reservar_clase", 2),
+                ("sp_checkin_clase", 1), ("sp_cancelar_reserva", 1)):
+    register_statement(_sp, f"SELECT * FROM {_sp}({','.join(['%s'] * _n)})")
+
+# -------------------------------------------
+# Ruteo de lecturas a la réplica
+# -------------------------------------------
+def _session_id():
+    """Id de la sesión de Streamlit actual (None fuera de un script)."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+        return ctx.session_id if ctx else None
+    except Exception:
+        return None
+
+def _mark_write(sid=None):
+    """Abre la ventana 'read your own writes': la sesión lee del primario unos segundos."""
+    sid = sid or _session_id()
+    if sid is None:
+        return
+    now = time.monotonic()
+    _last_write[sid] = now
+    if len(_last_write) > 1000:
+        for k, ts in list(_last_write.items()):
+            if now - ts > REPLICA_RYW_SECONDS:
+                _last_write.pop(k, None)
+
+def _use_replica(sid=None) -> bool:
+    if not replica_enabled() or time.monotonic() < _replica_down_until:
+        return False
+    ts = _last_write.get(sid or _session_id())
+    return ts is None or time.monotonic() - ts > REPLICA_RYW_SECONDS
+
+@contextmanager
+def _borrow(role):
+    t0 = time.perf_counter()
+    with get_pool(role).connection() as conn:
+        ms = (time.perf_counter() - t0) * 1000
+        with _checkout_lock:
+            _checkout["count"] += 1
+            _checkout["total_ms"] += ms
+            _checkout["max_ms"] = max(_checkout["max_ms"], ms)
+        yield conn
+
+@contextmanager
+def get_conn(readonly=False):
+    """
+    Presta una conexión del pool; al salir hace commit (o rollback si hubo error) y la devuelve.
+    Con readonly=True usa la réplica si está configurada (y cae al primario si no responde).
+    """
+    global _replica_down_until
+    with ExitStack() as stack:
+        conn = None
+        if readonly and _use_replica():
+            try:
+                conn = stack.enter_context(_borrow("replica"))
+            except (psycopg.OperationalError, PoolTimeout):
+                _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+                metrics.log.warning("Réplica no disponible; leyendo del primario")
+        if conn is None:
+            conn = stack.enter_context(_borrow("primary"))
+        yield conn
+
+def socios_escritos(cur) -> set[str]:
+    """Etiquetas 'socio:<id>' que anotaron los triggers en esta transacción (leer antes del commit)."""
+    cur.execute("SELECT current_setting(%s, true) AS v", (SOCIO_GUC,))
+    return socio_tags(cur.fetchone()["v"])
+
+@contextmanager
+def db_cursor(commit=False, readonly=False):
+    socios = set()
+    with get_conn(readonly=readonly and not commit) as conn:
+        with conn.cursor() as cur:
+            try:
+                yield cur
+                if commit:
+                    if cur.written & SOCIO_TABLES:
+                        socios = socios_escritos(cur)
+                    conn.commit()
+                    _mark_write()
+            except Exception:
+                conn.rollback()
+                raise
+    if cur.written or socios:
+        result_cache.invalidate(cur.written | socios)
+
+def query(sql, params=None, readonly=True):
+    """Lectura; por defecto puede ir a la réplica (readonly=False fuerza el primario)."""
+    with db_cursor(readonly=readonly) as cur:
+        cur.execute(sql, params or ())
+        return cur.fetchall()
+
+def cached_query(sql, params=None, ttl=None, tables=None):
+    """
+    Como query() pero con caché compartida entre sesiones (TTL + LRU, clave SQL+params).
+    Se invalida cuando se escriben las tablas que lee (`tables` o las de FROM/JOIN),
+    localmente o en otra instancia vía NOTIFY. Lee del primario para no cachear
+    datos atrasados de la réplica.
+    """
+    ensure_listener()
+    key = (sql, tuple(params or ()))
+    rows = result_cache.get(key)
+    if rows is None:
+        tags = tables or tables_read(sql)
+        gens = result_cache.generations(tags)  # si se invalida durante la lectura, no se guarda
+        rows = query(sql, params, readonly=False)
+        result_cache.set(key, rows, tags, ttl, gens=gens)
+    return list(rows)
+
+def cache_stats() -> dict:
+    return result_cache.stats()
+
+# OIDs de PostgreSQL -> tipo de columna en query_df()
+_OID_INT = {20, 21, 23, 26}        # int8, int2, int4, oid
+_OID_FLOAT = {700, 701, 1700}      # float4, float8, numeric
+_OID_DATETIME = {1082, 1114, 1184} # date, timestamp, timestamptz
+_OID_BOOL = {16}
+
+def _df_column(values, oid, np, pd):
+    if oid in _OID_INT:
+        return pd.array(values, dtype="Int64") if None in values else np.array(values, dtype=np.int64)
+    if oid in _OID_FLOAT:
+        return np.array(values, dtype=np.float64)  # NULL -> NaN
+    if oid in _OID_DATETIME:
+        return pd.to_datetime(list(values))
+    if oid in _OID_BOOL:
+        return pd.array(values, dtype="boolean") if None in values else np.array(values, dtype=bool)
+    return np.array(values, dtype=object)
+
+def query_df(sql, params=None, readonly=True):
+    """
+    Lectura directa a un DataFrame sin pasar por dicts: filas como tuplas y
+    numeric cargado como float (sin Decimal), luego una columna tipada por campo
+    (int64/Int64, float64, datetime64, bool, object).
+    """
+    from psycopg.types.numeric import FloatLoader
+
+    with get_conn(readonly=readonly) as conn:
+        with conn.cursor(row_factory=tuple_row) as cur:
+            cur.adapters.register_loader("numeric", FloatLoader)
+            cur.execute(sql, params or ())
+            return _to_df(cur.description or [], cur.fetchall())
+
+def _to_df(desc, rows):
+    """Arma el DataFrame de query_df() a partir de description + filas (tuplas)."""
+    import numpy as np
+    import pandas as pd
+
+    names = [d.name for d in desc]
+    columns = list(zip(*rows)) if rows else [()] * len(desc)
+    data = {d.name: _df_column(col, d.type_code, np, pd) for d, col in zip(desc, columns)}
+    return pd.DataFrame(data, columns=names)
+
+def query_batch(statements, readonly=True):
+    """
+    Ejecuta varias lecturas en un solo viaje de red (pipeline mode).
+    Recibe una lista de (sql, params) o sql sueltos y devuelve una lista
+    de resultados (lista de filas) en el mismo orden. En lugar del sql puede
+    ir el nombre de una sentencia registrada (register_statement).
+    Con readonly=False lee del primario aunque haya réplica.
+    """
+    stmts = [(s, None) if isinstance(s, str) else s for s in statements]
+    t0 = time.perf_counter()
+    with get_conn(readonly=readonly) as conn:
+        curs = []
+        with conn.pipeline():
+            for sql, params in stmts:
+                # cursor sin instrumentar: en pipeline el resultado llega después del execute
+                cur = psycopg.Cursor(conn)
+                if sql in _statements:
+                    execute_prepared(cur, sql, params or ())
+                else:
+                    cur.execute(sql, params or ())
+                curs.append(cur)
+        # al salir del bloque pipeline ya llegaron todos los resultados
+        results = [cur.fetchall() for cur in curs]
+        if metrics.ENABLED:
+            # el pipeline no da tiempos por sentencia: se reparte el total entre ellas
+            ms = (time.perf_counter() - t0) * 1000 / max(len(stmts), 1)
+            page = metrics.caller_page()
+            for (sql, _), cur, rows in zip(stmts, curs, results):
+                metrics.record(_statements.get(sql, sql), ms, len(rows), _result_bytes(cur), page)
+        for cur in curs:
+            cur.close()
+        return results
+
+_iter_ids = itertools.count(1)
+
+def query_iter(sql, params=None, fetch_size=None):
+    """
+    Recorre un resultado grande con un cursor del lado del servidor (named cursor):
+    trae `fetch_size` filas por viaje (PGFETCH_SIZE, 2000 por defecto) en lugar de
+    materializar todo en memoria. La conexión queda prestada hasta agotar el iterador.
+    """
+    size = int(fetch_size or os.getenv("PGFETCH_SIZE", "2000"))
+    page = metrics.caller_page()
+    t0 = time.perf_counter()
+    n = 0
+    with get_conn(readonly=True) as conn:
+        with conn.cursor(name=f"gym_iter_{next(_iter_ids)}") as cur:
+            cur.itersize = size
+            cur.execute(sql, params or ())
+            for row in cur:
+                n += 1
+                yield row
+    metrics.record(sql, (time.perf_counter() - t0) * 1000, n, 0, page)
+
+def execute(sql, params=None):
+    with db_cursor(commit=True) as cur:
+        cur.execute(sql, params or ())
+        return cur.rowcount
+
+def call_sp(sp_name, params=(), commit=True, readonly=False):
+    """Llama a un SP. Solo con readonly=True (y sin commit) puede ir a la réplica."""
+    placeholders = ",".join(["%s"]*len(params))
+    sql = f"SELECT * FROM {sp_name}({placeholders})" if params else f"SELECT * FROM {sp_name}()"
+    with db_cursor(commit=commit and not readonly, readonly=readonly) as cur:
+        if sp_name in _statements and len(params) == _statements[sp_name].count("%s"):
+            execute_prepared(cur, sp_name, params)
+        else:
+            cur.execute(sql, params)
+        try:
+            rows = cur.fetchall()
+        except Exception:
+            rows = []
+        # db_cursor invalida lo escrito al salir (y los perfiles de los socios tocados)
+        cur.written = cur.written | set(SP_WRITES.get(sp_name, ()))
+    return rows
@@ -0,0 +1,81 @@
+# app/lib/export.py
+import csv
+import importlib.util
+import io
+import os
+import tempfile
+import time
+from itertools import islice
+
+from .db import query_iter
+
+# Los archivos exportados se escriben en disco, no en memoria
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "gym_exports")
+EXPORT_MAX_AGE = 3600  # segundos que se conserva un export antes de borrarlo
+
+def _new_export_path(suffix: str) -> str:
+    """Crea la ruta del export y limpia los archivos viejos de exportaciones previas."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    limite = time.time() - EXPORT_MAX_AGE
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < limite:
+                os.remove(path)
+        except OSError:
+            pass
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=EXPORT_DIR)
+    os.close(fd)
+    return path
+
+def export_csv(sql, params=None, headers=None, fetch_size=None) -> str:
+    """
+    Vuelca el resultado de `sql` a un CSV en disco fila a fila (cursor del servidor),
+    con memoria acotada al tamaño del lote. Devuelve la ruta del archivo.
+    """
+    path = _new_export_path(".csv")
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        writer = None
+        if headers:
+            writer = csv.DictWriter(fh, fieldnames=headers, extrasaction="ignore")
+            writer.writeheader()
+        for row in query_iter(sql, params, fetch_size):
+            if writer is None:
+                writer = csv.DictWriter(fh, fieldnames=list(row.keys()), extrasaction="ignore")
+                writer.writeheader()
+            writer.writerow(row)
+    return path
+
+def parquet_available() -> bool:
+    """Parquet requiere pyarrow (opcional, no está en requirements.txt)."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+def export_parquet(sql, params=None, batch_rows=50_000, fetch_size=None) -> str:
+    """
+    Igual que export_csv pero en Parquet: cada lote de `batch_rows` filas se
+    escribe como un row group. Devuelve la ruta del archivo.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = _new_export_path(".parquet")
+    rows = query_iter(sql, params, fetch_size)
+    writer = None
+    try:
+        while True:
+            chunk = list(islice(rows, batch_rows))
+            if not chunk:
+                break
+            if writer is None:
+                schema = pa.Table.from_pylist(chunk).schema
+                # la precisión inferida del primer lote puede no alcanzar para los siguientes
+                schema = pa.schema([
+                    f.with_type(pa.decimal128(38, f.type.scale)) if pa.types.is_decimal(f.type) else f
+                    for f in schema
+                ])
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_pylist(chunk, schema=writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    return path
@@ -0,0 +1,122 @@
+# app/lib/importer.py
+"""
+Importación masiva de socios desde CSV.
+
+    python -m app.lib.importer socios.csv [--delimiter ";"] [--encoding latin-1] [--rechazados rechazados.csv]
+
+El archivo se envía tal cual con COPY a una tabla temporal, se depura con una
+sola sentencia (duplicados en el archivo y contra ux_socio_dni / ux_socio_email)
+y los sobrevivientes se insertan en bloque. Todo ocurre en una transacción.
+"""
+import argparse
+import csv
+import sys
+
+from psycopg import sql as psql
+
+from .db import db_cursor
+
+COLUMNAS = ("dni", "nombre", "email", "telefono")
+ENCODINGS = {"utf-8": "UTF8", "latin-1": "LATIN1"}  # python -> COPY ENCODING
+CHUNK = 1 << 20  # bytes por write() del COPY
+
+_CLASIFICAR = """
+CREATE TEMP TABLE stg_socio ON COMMIT DROP AS
+SELECT n.linea, n.dni, n.nombre, n.email, n.telefono,
+       CASE
+         WHEN n.nombre IS NULL THEN 'Nombre vacío'
+         WHEN d.id IS NOT NULL THEN 'DNI ya registrado'
+         WHEN e.id IS NOT NULL THEN 'Email ya registrado'
+         WHEN n.rn_dni > 1 THEN 'DNI repetido en el archivo'
+         WHEN n.rn_email > 1 THEN 'Email repetido en el archivo'
+       END AS motivo
+FROM (
+  SELECT s.*,
+         CASE WHEN s.dni IS NULL THEN 1 ELSE row_number() OVER (PARTITION BY s.dni ORDER BY s.linea) END AS rn_dni,
+         CASE WHEN s.email IS NULL THEN 1 ELSE row_number() OVER (PARTITION BY s.email ORDER BY s.linea) END AS rn_email
+  FROM (
+    SELECT linea,
+           NULLIF(btrim({dni}), '') AS dni,
+           NULLIF(btrim({nombre}), '') AS nombre,
+           NULLIF(btrim({email}), '') AS email,
+           NULLIF(btrim({telefono}), '') AS telefono
+    FROM stg_raw
+  ) s
+) n
+LEFT JOIN socio d ON d.dni = n.dni
+LEFT JOIN socio e ON e.email = n.email
+"""
+
+def importar_socios(fh, delimiter=",", encoding="utf-8") -> dict:
+    """
+    Importa socios desde un CSV (objeto archivo binario con cabecera; se requiere
+    la columna 'nombre', las columnas desconocidas se ignoran).
+    Devuelve {'total', 'insertados', 'rechazados': [{fila, dni, nombre, email, telefono, motivo}]}.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Codificación no soportada: {encoding}")
+    header = fh.readline().decode("utf-8-sig" if encoding == "utf-8" else encoding)
+    cols = [h.strip().lower() for h in next(csv.reader([header], delimiter=delimiter), [])]
+    if "nombre" not in cols:
+        raise ValueError("El archivo debe tener una columna 'nombre' en la cabecera")
+
+    raw = [f"c{i}" for i in range(len(cols))]
+    # columna de stg_raw que alimenta cada campo (NULL si el archivo no la trae)
+    fuente = {c: (psql.Identifier(raw[cols.index(c)]) if c in cols else psql.SQL("NULL::text")) for c in COLUMNAS}
+
+    with db_cursor(commit=True) as cur:
+        cur.execute(psql.SQL("CREATE TEMP TABLE stg_raw (linea BIGINT GENERATED ALWAYS AS IDENTITY, {}) ON COMMIT DROP").format(
+            psql.SQL(", ").join(psql.SQL("{} TEXT").format(psql.Identifier(c)) for c in raw)))
+        copy_sql = psql.SQL("COPY stg_raw ({}) FROM STDIN (FORMAT csv, DELIMITER {}, ENCODING {})").format(
+            psql.SQL(", ").join(map(psql.Identifier, raw)), psql.Literal(delimiter), psql.Literal(ENCODINGS[encoding]))
+        with cur.copy(copy_sql) as cp:
+            while chunk := fh.read(CHUNK):
+                cp.write(chunk)
+
+        cur.execute(psql.SQL(_CLASIFICAR).format(**fuente))
+        cur.execute("SELECT COUNT(*) AS total FROM stg_socio")
+        total = cur.fetchone()["total"]
+
+        cur.execute("""
+            INSERT INTO socio (dni, nombre, email, telefono)
+            SELECT dni, nombre, email, telefono FROM stg_socio
+            WHERE motivo IS NULL
+            ORDER BY linea
+            ON CONFLICT DO NOTHING
+        """)
+        insertados = cur.rowcount
+
+        # fila = número de registro en el archivo contando la cabecera
+        cur.execute("""
+            SELECT linea + 1 AS fila, dni, nombre, email, telefono, motivo
+            FROM stg_socio WHERE motivo IS NOT NULL
+            ORDER BY linea
+        """)
+        rechazados = cur.fetchall()
+
+    return {"total": total, "insertados": insertados, "rechazados": rechazados}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Importa socios desde un CSV")
+    ap.add_argument("archivo")
+    ap.add_argument("--delimiter", default=",")
+    ap.add_argument("--encoding", default="utf-8", choices=sorted(ENCODINGS))
+    ap.add_argument("--rechazados", help="CSV donde escribir las filas rechazadas")
+    args = ap.parse_args(argv)
+
+    with open(args.archivo, "rb") as fh:
+        res = importar_socios(fh, delimiter=args.delimiter, encoding=args.encoding)
+
+    omitidos = res["total"] - res["insertados"] - len(res["rechazados"])
+    print(f"Filas: {res['total']}  insertadas: {res['insertados']}  rechazadas: {len(res['rechazados'])}"
+          + (f"  omitidas por alta concurrente: {omitidos}" if omitidos else ""))
+    if args.rechazados and res["rechazados"]:
+        with open(args.rechazados, "w", encoding="utf-8", newline="") as out:
+            w = csv.DictWriter(out, fieldnames=list(res["rechazados"][0].keys()))
+            w.writeheader()
+            w.writerows(res["rechazados"])
+        print(f"Rechazos escritos en {args.rechazados}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# app/lib/importprof.py
+"""
+Costo de import de los puntos de entrada (Home y páginas), para medir el arranque en frío.
+
+    python -m app.lib.importprof                         # todas las páginas
+    python -m app.lib.importprof app/pages/4_Accesos_Aforo.py --top 15
+
+Por cada archivo toma sus imports de primer nivel (sin ejecutar la página), los importa
+en un proceso nuevo con `python -X importtime` y suma el tiempo propio por paquete.
+"""
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ENTRADAS = [os.path.join("app", "Home.py")] + sorted(
+    os.path.join("app", "pages", f) for f in os.listdir(os.path.join(ROOT, "app", "pages")) if f.endswith(".py"))
+
+_LINEA = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+def imports_de(path: str) -> list[str]:
+    """Módulos importados a nivel de módulo por el archivo (en orden, sin repetir)."""
+    with open(os.path.join(ROOT, path), encoding="utf-8") as fh:
+        tree = ast.parse(fh.read(), path)
+    mods = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            mods += [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            mods.append(node.module)
+    return list(dict.fromkeys(mods))
+
+def medir(modulos: list[str]) -> tuple[float, dict[str, float]]:
+    """Importa `modulos` en un intérprete limpio. Devuelve (ms totales, ms propios por paquete)."""
+    code = "\n".join(f"import {m}" for m in modulos)
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                         capture_output=True, text=True)
+    if res.returncode != 0:
+        raise RuntimeError(res.stderr.strip().splitlines()[-1])
+    total, por_paquete = 0, defaultdict(int)
+    for line in res.stderr.splitlines():
+        m = _LINEA.match(line)
+        if not m:
+            continue
+        propio, acumulado, sangria, nombre = int(m[1]), int(m[2]), m[3], m[4]
+        por_paquete[nombre.split(".")[0]] += propio
+        if not sangria:
+            total += acumulado
+    return total / 1000, {k: v / 1000 for k, v in por_paquete.items()}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Tiempo de import por punto de entrada")
+    ap.add_argument("archivos", nargs="*", help="Home/páginas a medir (por defecto todas)")
+    ap.add_argument("--top", type=int, default=10, help="paquetes más caros a listar por archivo")
+    args = ap.parse_args(argv)
+
+    for path in args.archivos or ENTRADAS:
+        try:
+            total, paquetes = medir(imports_de(path))
+        except RuntimeError as e:
+            print(f"{path}: error al importar ({e})")
+            continue
+        print(f"{path}: {total:.0f} ms")
+        for nombre, ms in sorted(paquetes.items(), key=lambda kv: -kv[1])[:args.top]:
+            print(f"    {ms:8.1f} ms  {nombre}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+# app/lib/jobs.py
+"""
+Tareas de mantenimiento para ejecutar desde cron.
+
+    python -m app.lib.jobs reconciliar-aforo [--solo-reportar]
+    python -m app.lib.jobs refrescar-kpis
+    python -m app.lib.jobs expirar-membresias
+
+reconciliar-aforo sale con código 1 si encontró deriva, para que el cron lo avise.
+"""
+import argparse
+import logging
+import sys
+
+from .db import call_sp
+
+log = logging.getLogger("gym.jobs")
+
+def reconciliar_aforo(corregir=True):
+    """Recalcula sede_aforo desde acceso. Devuelve solo las sedes con deriva."""
+    filas = call_sp("sp_reconciliar_aforo", (corregir,))
+    deriva = [f for f in filas if f["deriva"]]
+    for f in deriva:
+        log.warning("Aforo sede %s: contador %s, real %s (deriva %+d)%s", f["sede_id"], f["contador"],
+                    f["calculado"], f["deriva"], "" if corregir else " — sin corregir")
+    return deriva
+
+def refrescar_kpis():
+    """Recalcula kpi_snapshot desde cero (pasada la medianoche, para que no lo pague una petición)."""
+    return call_sp("sp_kpis_refrescar")[0]
+
+def expirar_membresias():
+    """Marca 'vencida' lo que terminó antes de hoy; devuelve {vencidas, socios}."""
+    return call_sp("sp_expirar_membresias")[0]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Tareas de mantenimiento del gimnasio")
+    sub = ap.add_subparsers(dest="tarea", required=True)
+    p = sub.add_parser("reconciliar-aforo", help="Recalcula los contadores de aforo y reporta la deriva")
+    p.add_argument("--solo-reportar", action="store_true", help="No corrige, solo informa")
+    sub.add_parser("refrescar-kpis", help="Recalcula la foto de KPIs del dashboard")
+    sub.add_parser("expirar-membresias", help="Pasa a 'vencida' las membresías terminadas")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    if args.tarea == "reconciliar-aforo":
+        deriva = reconciliar_aforo(corregir=not args.solo_reportar)
+        print(f"Sedes con deriva: {len(deriva)}")
+        return 1 if deriva else 0
+    if args.tarea == "refrescar-kpis":
+        k = refrescar_kpis()
+        print(f"KPIs al {k['dia']}: socios {k['socios']}, membresías activas {k['membresias_activas']}, "
+              f"accesos hoy {k['accesos_hoy']}")
+    if args.tarea == "expirar-membresias":
+        r = expirar_membresias()
+        print(f"Membresías vencidas: {r['vencidas']} ({r['socios']} socios)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
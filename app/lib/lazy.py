@@ -0,0 +1,42 @@
+# app/lib/lazy.py
+"""
+Imports diferidos para módulos pesados (pandas, plotly, pyarrow).
+
+    px = lazy_import("plotly.express")   # no cuesta nada aquí
+    px.line(...)                         # el import real ocurre en el primer acceso
+
+Usa importlib.util.LazyLoader: el módulo queda en sys.modules como proxy y se
+ejecuta al leer su primer atributo. Si ya estaba importado se devuelve tal cual.
+Un módulo que no existe falla en lazy_import() (se busca su spec), no más tarde.
+"""
+import importlib.util
+import sys
+import threading
+
+_lock = threading.Lock()
+
+def lazy_import(name: str):
+    with _lock:
+        if name in sys.modules:
+            return sys.modules[name]
+        # los paquetes padre se importan de verdad (p. ej. "plotly" para "plotly.express")
+        parent = name.rpartition(".")[0]
+        if parent:
+            importlib.import_module(parent)
+        spec = importlib.util.find_spec(name)
+        if spec is None:
+            raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+        loader = importlib.util.LazyLoader(spec.loader)
+        spec.loader = loader
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        loader.exec_module(module)
+        if parent:
+            setattr(sys.modules[parent], name.rpartition(".")[2], module)
+        return module
+
+def is_loaded(name: str) -> bool:
+    """True si el módulo ya se importó de verdad (no es un proxy pendiente)."""
+    mod = sys.modules.get(name)
+    # LazyLoader le pone una clase propia hasta el primer acceso y luego la cambia a module
+    return mod is not None and type(mod).__name__ != "_LazyModule"
@@ -0,0 +1,69 @@
+# app/lib/live.py
+"""
+Versiones por sede para paneles en vivo (aforo, accesos abiertos).
+
+Un solo LISTEN por proceso (notify.py) recibe 'acceso_cambio' y sube la versión de
+cada sede del payload. Los fragmentos de Streamlit se re-ejecutan cada pocos segundos,
+pero solo van a la BD si la versión de su sede cambió desde la última lectura de esa
+sesión: N recepciones abiertas = 1 listener, no N clientes consultando.
+
+Sin listener conectado la versión también avanza cada LIVE_FALLBACK_SECONDS,
+para que los paneles no se queden congelados.
+"""
+import itertools
+import os
+import threading
+import time
+
+from . import notify
+
+CHANNEL = "acceso_cambio"
+FALLBACK_SECONDS = float(os.getenv("LIVE_FALLBACK_SECONDS", "10"))
+
+_lock = threading.Lock()
+_versions = {}           # sede_id -> versión
+_epoch = 0               # sube con "*" o al reconectar (afecta a todas las sedes)
+_started = False
+_start_lock = threading.Lock()
+_seq = itertools.count(1)
+
+def _on_notify(payload):
+    global _epoch
+    with _lock:
+        if payload is None or payload == "*":
+            _epoch += 1
+            return
+        for s in payload.split(","):
+            if s.strip().isdigit():
+                _versions[int(s)] = next(_seq)
+
+def ensure_started():
+    global _started
+    if not _started:
+        with _start_lock:
+            if not _started:
+                notify.subscribe(CHANNEL, _on_notify)
+                _started = True
+
+def token(sede_id):
+    """Identifica el estado de la sede: si no cambió, lo ya leído sigue valiendo."""
+    ensure_started()
+    with _lock:
+        t = (_epoch, _versions.get(sede_id, 0))
+    if not notify.is_connected():
+        t += (int(time.monotonic() // FALLBACK_SECONDS),)
+    return t
+
+def load(state, key, sede_id, loader):
+    """
+    Devuelve loader() guardado en `state` (st.session_state) bajo `key`, y solo lo
+    vuelve a llamar si la sede cambió. El token se toma antes de leer: un cambio
+    que llegue durante la lectura fuerza otra en la siguiente pasada.
+    """
+    t = token(sede_id)
+    hit = state.get(key)
+    if hit is not None and hit[0] == t:
+        return hit[1]
+    data = loader()
+    state[key] = (t, data)
+    return data
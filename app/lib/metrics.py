@@ -0,0 +1,131 @@
+# app/lib/metrics.py
+import os
+import re
+import sys
+import threading
+import time
+import logging
+from collections import deque
+
+log = logging.getLogger("gym.db")
+
+# Umbral (ms) a partir del cual una sentencia se registra como lenta con su EXPLAIN
+SLOW_MS = float(os.getenv("DB_SLOW_MS", "500"))
+ENABLED = os.getenv("DB_METRICS", "1") != "0"
+
+# Límites superiores (ms) de cada cubeta del histograma; la última es "el resto"
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_lock = threading.Lock()
+_stats = {}
+_slow = deque(maxlen=50)
+
+# -------------------------------------------
+# Normalización de SQL (fingerprint)
+# -------------------------------------------
+_RE_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_PARAM = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_RE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_SPACE = re.compile(r"\s+")
+
+def fingerprint(sql: str) -> str:
+    """SQL sin literales ni parámetros: agrupa ejecuciones de la misma sentencia."""
+    s = _RE_COMMENT.sub(" ", sql)
+    s = _RE_STRING.sub("?", s)
+    s = _RE_PARAM.sub("?", s)
+    s = _RE_NUMBER.sub("?", s)
+    s = _RE_LIST.sub("(?...)", s)
+    return _RE_SPACE.sub(" ", s).strip()
+
+def caller_page() -> str:
+    """Nombre de la página de Streamlit que originó la llamada (p. ej. '10_Pagos')."""
+    f = sys._getframe(1)
+    while f is not None:
+        path = f.f_code.co_filename
+        if os.sep + "pages" + os.sep in path or path.endswith("Home.py"):
+            return os.path.splitext(os.path.basename(path))[0]
+        f = f.f_back
+    return "-"
+
+# -------------------------------------------
+# Registro y agregados
+# -------------------------------------------
+def record(sql: str, elapsed_ms: float, rows: int = 0, nbytes: int = 0, page: str | None = None) -> bool:
+    """Acumula una ejecución; devuelve True si supera el umbral de lentitud."""
+    if not ENABLED:
+        return False
+    fp = fingerprint(sql)
+    page = page or caller_page()
+    with _lock:
+        st = _stats.get(fp)
+        if st is None:
+            st = _stats[fp] = {
+                "sql": fp, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                "rows": 0, "bytes": 0, "pages": {}, "hist": [0] * (len(BUCKETS_MS) + 1),
+            }
+        st["count"] += 1
+        st["total_ms"] += elapsed_ms
+        st["max_ms"] = max(st["max_ms"], elapsed_ms)
+        st["rows"] += max(rows, 0)
+        st["bytes"] += nbytes
+        st["pages"][page] = st["pages"].get(page, 0) + 1
+        st["hist"][_bucket(elapsed_ms)] += 1
+    return elapsed_ms >= SLOW_MS
+
+def record_slow(sql: str, elapsed_ms: float, page: str, plan: str | None):
+    """Guarda y loguea una sentencia lenta con su plan."""
+    entry = {"ts": time.strftime("%Y-%m-%d %H:%M:%S"), "ms": round(elapsed_ms, 1),
+             "page": page, "sql": fingerprint(sql), "plan": plan or ""}
+    with _lock:
+        _slow.appendleft(entry)
+    log.warning("Consulta lenta (%.1f ms) en %s: %s\n%s", elapsed_ms, page, entry["sql"], entry["plan"])
+
+def _bucket(ms: float) -> int:
+    for i, limit in enumerate(BUCKETS_MS):
+        if ms <= limit:
+            return i
+    return len(BUCKETS_MS)
+
+def _percentile(hist: list[int], q: float) -> float:
+    """Aproxima el percentil con el límite superior de la cubeta que lo contiene."""
+    total = sum(hist)
+    if not total:
+        return 0.0
+    acc = 0
+    for i, n in enumerate(hist):
+        acc += n
+        if acc >= q * total:
+            return float(BUCKETS_MS[i]) if i < len(BUCKETS_MS) else float("inf")
+    return float("inf")
+
+def top(n: int = 20, by: str = "total_ms") -> list[dict]:
+    """Las N sentencias con mayor `by` (total_ms, mean_ms, p95_ms, count, rows, bytes)."""
+    with _lock:
+        items = [dict(s, pages=dict(s["pages"]), hist=list(s["hist"])) for s in _stats.values()]
+    out = []
+    for s in items:
+        out.append({
+            "sql": s["sql"],
+            "count": s["count"],
+            "total_ms": round(s["total_ms"], 1),
+            "mean_ms": round(s["total_ms"] / s["count"], 2),
+            "p50_ms": _percentile(s["hist"], 0.50),
+            "p95_ms": _percentile(s["hist"], 0.95),
+            "max_ms": round(s["max_ms"], 1),
+            "rows": s["rows"],
+            "bytes": s["bytes"],
+            "pages": ", ".join(f"{p} ({c})" for p, c in sorted(s["pages"].items(), key=lambda x: -x[1])),
+        })
+    out.sort(key=lambda r: r[by], reverse=True)
+    return out[:n]
+
+def slow_log() -> list[dict]:
+    with _lock:
+        return list(_slow)
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _slow.clear()
@@ -0,0 +1,67 @@
+# app/lib/notify.py
+import logging
+import threading
+import time
+
+import psycopg
+from psycopg import sql as psql
+
+log = logging.getLogger("gym.notify")
+
+# Un solo hilo LISTEN por proceso; reparte cada NOTIFY a los callbacks suscritos
+_subs = {}  # canal -> [callback(payload)]
+_lock = threading.Lock()
+_thread = None
+_connected = threading.Event()
+
+POLL_SECONDS = 5  # cada cuánto se revisan canales nuevos
+
+def subscribe(channel: str, callback) -> None:
+    """
+    Registra `callback(payload)` para el canal. Recibe payload=None cuando el
+    listener (re)conecta: lo notificado mientras no escuchaba se perdió.
+    """
+    global _thread
+    with _lock:
+        _subs.setdefault(channel, []).append(callback)
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="gym-notify", daemon=True)
+            _thread.start()
+
+def is_connected() -> bool:
+    return _connected.is_set()
+
+def _dispatch(channel, payload):
+    with _lock:
+        callbacks = list(_subs.get(channel, ()))
+    for cb in callbacks:
+        try:
+            cb(payload)
+        except Exception:
+            log.exception("Error procesando NOTIFY de %s", channel)
+
+def _run():
+    from .db import _conn_kwargs  # import tardío: db importa este módulo indirectamente
+
+    backoff = 1
+    while True:
+        try:
+            kwargs = {k: v for k, v in _conn_kwargs().items() if k not in ("row_factory", "cursor_factory")}
+            with psycopg.connect(autocommit=True, **kwargs) as conn:
+                listening = set()
+                while True:
+                    with _lock:
+                        nuevos = set(_subs) - listening
+                    for ch in nuevos:
+                        conn.execute(psql.SQL("LISTEN {}").format(psql.Identifier(ch)))
+                        listening.add(ch)
+                        _dispatch(ch, None)
+                    _connected.set()
+                    backoff = 1
+                    for n in conn.notifies(timeout=POLL_SECONDS):
+                        _dispatch(n.channel, n.payload)
+        except Exception as e:
+            _connected.clear()
+            log.warning("Listener LISTEN/NOTIFY desconectado (%s); reintento en %ss", e, backoff)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
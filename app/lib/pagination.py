@@ -0,0 +1,129 @@
+# app/lib/pagination.py
+"""
+Paginación por cursor (keyset) para los listados.
+
+En vez de OFFSET, cada página se pide "después de" la última fila vista:
+
+    SELECT * FROM (<consulta>) q WHERE (q.fecha, q.id) < (%s, %s) ORDER BY fecha DESC, id DESC LIMIT n+1
+
+Con un índice sobre las claves, la página 500 cuesta lo mismo que la primera. La fila
+n+1 solo sirve para saber si hay siguiente. El total es opcional y es una estimación
+del planner (EXPLAIN), no un COUNT(*), y se calcula una vez por filtro.
+
+Las claves no pueden ser NULL: la comparación (a, b) < (x, y) descarta esas filas.
+Hace falta un índice sobre las claves en ese orden (p. ej. pago(fecha DESC, id DESC)).
+
+    from app.lib.pagination import paginar
+    df = paginar("pagos", sql, params, claves=("fecha", "id"))
+"""
+import json
+
+import streamlit as st
+from psycopg import sql as psql
+
+from .db import query, query_df
+
+TAMANIOS = [25, 50, 100, 200]
+
+def _py(v):
+    """Valores de pandas/numpy -> tipos de Python que psycopg sabe enviar."""
+    if hasattr(v, "to_pydatetime"):
+        return v.to_pydatetime()
+    if hasattr(v, "item"):
+        return v.item()
+    return v
+
+def fetch_page(sql, params=(), claves=("id",), cursor=None, direccion="next", tamanio=50, desc=True, df=False):
+    """
+    Una página de `sql` (sin ORDER BY ni LIMIT) ordenada por `claves` (columnas de su salida;
+    la última debe ser única, normalmente id). `cursor` son los valores de las claves de la fila
+    límite: con direccion="next" trae las que siguen, con "prev" las anteriores.
+    Devuelve (filas, hay_anterior, hay_siguiente); filas es lista de dicts o DataFrame.
+    Las claves deben ser NOT NULL; un cursor con NULL lanza ValueError.
+    """
+    if cursor is not None and any(v is None for v in cursor):
+        raise ValueError(f"Clave de paginación NULL en {claves}: usa columnas NOT NULL")
+    cols = psql.SQL(", ").join(psql.Identifier("q", c) for c in claves)
+    hacia_atras = direccion == "prev" and cursor is not None
+    asc = desc == hacia_atras  # "prev" recorre al revés y luego se invierte
+    orden = psql.SQL(", ").join(
+        psql.SQL("{} {}").format(psql.Identifier("q", c), psql.SQL("ASC" if asc else "DESC")) for c in claves)
+    q = psql.SQL("SELECT * FROM ({}) q").format(psql.SQL(sql))
+    args = list(params)
+    if cursor is not None:
+        q += psql.SQL(" WHERE ({}) {} ({})").format(
+            cols, psql.SQL(">" if asc else "<"), psql.SQL(", ").join(psql.Placeholder() * len(claves)))
+        args += [_py(v) for v in cursor]
+    q += psql.SQL(" ORDER BY {} LIMIT %s").format(orden)
+    args.append(tamanio + 1)
+
+    rows = query_df(q, tuple(args)) if df else query(q, tuple(args))
+    mas = len(rows) > tamanio
+    rows = rows[:tamanio]
+    if hacia_atras:
+        rows = rows[::-1]
+        if df:
+            rows = rows.reset_index(drop=True)
+        return rows, mas, True
+    return rows, cursor is not None, mas
+
+def estimar_total(sql, params=()):
+    """Filas estimadas por el planner para `sql` (sin ejecutarla)."""
+    q = psql.SQL("EXPLAIN (FORMAT JSON) SELECT 1 FROM ({}) q").format(psql.SQL(sql))
+    plan = query(q, tuple(params))[0]["QUERY PLAN"]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def _claves_de(fila, claves):
+    return tuple(_py(fila[c]) for c in claves)
+
+def paginar(key, sql, params=(), claves=("id",), desc=True, df=True, estimar=True, tamanio=None):
+    """
+    Widget de Streamlit: muestra controles ◀/▶ y devuelve las filas de la página actual.
+    Vuelve a la primera página cuando cambian la consulta o sus parámetros.
+    """
+    estado_key = f"pg_{key}"
+    firma = (sql, repr(tuple(params)))
+    est = st.session_state.get(estado_key)
+    if est is None or est["firma"] != firma:
+        est = st.session_state[estado_key] = {"firma": firma, "cursor": None, "dir": "next", "pagina": 1,
+                                              "total": None}
+
+    if tamanio is None:
+        tamanio = st.session_state.get(f"{estado_key}_tam", TAMANIOS[1])
+
+    rows, hay_ant, hay_sig = fetch_page(sql, params, claves, est["cursor"], est["dir"], tamanio, desc, df)
+    if est["dir"] == "prev" and not hay_ant and len(rows) < tamanio:
+        # se llegó al principio con una página incompleta: mostrar la primera completa
+        est.update(cursor=None, dir="next", pagina=1)
+        rows, hay_ant, hay_sig = fetch_page(sql, params, claves, None, "next", tamanio, desc, df)
+
+    n = len(rows)
+    primera = _claves_de(rows.iloc[0] if df else rows[0], claves) if n else None
+    ultima = _claves_de(rows.iloc[-1] if df else rows[-1], claves) if n else None
+
+    def ir(cursor, direccion, delta):
+        est.update(cursor=cursor, dir=direccion, pagina=max(est["pagina"] + delta, 1))
+
+    def reiniciar():
+        est.update(cursor=None, dir="next", pagina=1)
+
+    c1, c2, c3, c4 = st.columns([1, 1, 3, 1])
+    c1.button("◀ Anterior", key=f"{estado_key}_prev", disabled=not hay_ant,
+              on_click=ir, args=(primera, "prev", -1))
+    c2.button("Siguiente ▶", key=f"{estado_key}_next", disabled=not hay_sig,
+              on_click=ir, args=(ultima, "next", 1))
+    total = ""
+    if estimar:
+        if est.get("total") is None:  # un EXPLAIN por filtro, no por rerun
+            try:
+                est["total"] = estimar_total(sql, params)
+            except Exception:
+                est["total"] = -1
+        if est["total"] >= 0:
+            total = f" · ~{est['total']:,} filas en total"
+    c3.caption(f"Página {est['pagina']}{total}")
+    c4.selectbox("Filas por página", TAMANIOS, key=f"{estado_key}_tam", on_change=reiniciar,
+                 index=TAMANIOS.index(tamanio) if tamanio in TAMANIOS else 1, label_visibility="collapsed")
+    return rows
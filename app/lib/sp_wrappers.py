@@ -1,32 +1,89 @@
-from .db import call_sp
-
-def alta_socio(dni, nombre, email, telefono):
-    return call_sp("sp_alta_socio", (dni, nombre, email, telefono))
-
-def crear_membresia(socio_id, plan_id, fecha_inicio):
-    return call_sp("sp_crear_membresia", (socio_id, plan_id, fecha_inicio))
-
-def registrar_pago(socio_id, concepto, monto, medio, ref_externa):
-    return call_sp("sp_registrar_pago", (socio_id, concepto, monto, medio, ref_externa))
-
-def publicar_clase(sede_id, nombre, fecha_hora, capacidad):
-    return call_sp("sp_publicar_clase", (sede_id, nombre, fecha_hora, capacidad))
-
-def reservar_clase(socio_id, clase_id):
-    return call_sp("sp_reservar_clase", (socio_id, clase_id))
-
-def checkin_clase(reserva_id):
-    return call_sp("sp_checkin_clase", (reserva_id,))
-
-def registrar_acceso(socio_id, sede_id):
-    return call_sp("sp_registrar_acceso", (socio_id, sede_id))
-
-def registrar_salida(acceso_id):
-    return call_sp("sp_registrar_salida", (acceso_id,))
-
-def aforo_actual(sede_id):
-    rows = call_sp("sp_aforo_actual", (sede_id,))
-    return rows[0]["sp_aforo_actual"] if rows else 0
-
-def kpis():
-    return call_sp("sp_kpis")
+import json
+from functools import partial
+
+from psycopg.types.json import Jsonb
+
+from .db import call_sp, cached_query, query
+
+def alta_socio(dni, nombre, email, telefono):
+    return call_sp("sp_alta_socio", (dni, nombre, email, telefono))
+
+def buscar_socio(q, limite=20):
+    """Socios ordenados por relevancia (DNI exacto primero, luego prefijos y full-text)."""
+    return call_sp("sp_buscar_socio", (q, limite), readonly=True)
+
+def crear_membresia(socio_id, plan_id, fecha_inicio):
+    return call_sp("sp_crear_membresia", (socio_id, plan_id, fecha_inicio))
+
+def registrar_pago(socio_id, concepto, monto, medio, ref_externa):
+    return call_sp("sp_registrar_pago", (socio_id, concepto, monto, medio, ref_externa))
+
+def publicar_clase(sede_id, nombre, fecha_hora, capacidad):
+    return call_sp("sp_publicar_clase", (sede_id, nombre, fecha_hora, capacidad))
+
+def reservar_clase(socio_id, clase_id):
+    return call_sp("sp_reservar_clase", (socio_id, clase_id))
+
+def cancelar_reserva(reserva_id):
+    return call_sp("sp_cancelar_reserva", (reserva_id,))
+
+def promover_waitlist(clase_id):
+    return call_sp("sp_promover_waitlist", (clase_id,))
+
+def checkin_clase(reserva_id):
+    return call_sp("sp_checkin_clase", (reserva_id,))
+
+def registrar_acceso(socio_id, sede_id):
+    return call_sp("sp_registrar_acceso", (socio_id, sede_id))
+
+def registrar_salida(acceso_id):
+    return call_sp("sp_registrar_salida", (acceso_id,))
+
+def aforo_actual(sede_id):
+    rows = call_sp("sp_aforo_actual", (sede_id,))
+    return rows[0]["sp_aforo_actual"] if rows else 0
+
+def kpis(sede_id=None):
+    return call_sp("sp_kpis", (sede_id,))
+
+def socio_360(socio_id, n=10):
+    """
+    Perfil del socio (dict de sp_socio_360) o None si no existe. Se cachea por socio bajo
+    'socio:<id>': esta instancia lo invalida al hacer commit de la escritura y las demás con
+    el NOTIFY de los triggers. No modificar el dict devuelto.
+    """
+    rows = cached_query("SELECT sp_socio_360(%s, %s) AS perfil", (socio_id, n),
+                        tables={f"socio:{socio_id}", "socio:*", "membresia_plan", "sede"})
+    return rows[0]["perfil"] if rows else None
+
+def socio_dentro(socio_id):
+    """Si el socio tiene un acceso abierto. Fuera de socio_360: cambia con cada salida."""
+    rows = query("""SELECT EXISTS (SELECT 1 FROM acceso WHERE socio_id = %s AND fecha_salida IS NULL
+                                  AND fecha_entrada >= now() - interval '90 days') AS dentro""",
+                 (socio_id,), readonly=False)
+    return rows[0]["dentro"]
+
+# -------------------------------------------
+# Lotes: una llamada y una transacción para N elementos.
+# Devuelven una fila por elemento, en el mismo orden (idx 1..n).
+# -------------------------------------------
+_dumps = partial(json.dumps, default=str)  # fechas y Decimal como texto
+
+def registrar_accesos(socio_ids, sede_id):
+    items = [{"socio_id": s, "sede_id": sede_id} for s in socio_ids]
+    return call_sp("sp_registrar_acceso_lote", (Jsonb(items, dumps=_dumps),))
+
+def checkin_clases(reserva_ids):
+    return call_sp("sp_checkin_clase_lote", (Jsonb(list(reserva_ids), dumps=_dumps),))
+
+def crear_membresias(items):
+    """items: [{'socio_id', 'plan_id', 'fecha_inicio'}]"""
+    return call_sp("sp_crear_membresia_lote", (Jsonb(items, dumps=_dumps),))
+
+def registrar_pagos(items):
+    """items: [{'socio_id', 'concepto', 'monto', 'medio', 'ref'}]"""
+    return call_sp("sp_registrar_pago_lote", (Jsonb(items, dumps=_dumps),))
+
+def reservar_clases(socio_ids, clase_id):
+    items = [{"socio_id": s, "clase_id": clase_id} for s in socio_ids]
+    return call_sp("sp_reservar_clase_lote", (Jsonb(items, dumps=_dumps),))
@@ -1,20 +1,85 @@
-import streamlit as st
-
-CSS = """
-<style>
-/* Tarjetas y botones */
-.block-card {background: #0f172a; border: 1px solid #1f2937; padding: 16px; border-radius: 16px; box-shadow: 0 2px 12px rgba(0,0,0,.15);}
-.badge {display:inline-block; padding:4px 10px; border-radius:999px; font-size:12px; background:#111827; border:1px solid #374151;}
-.badge.green{background:#064e3b;border-color:#065f46;color:#d1fae5}
-.badge.amber{background:#78350f;border-color:#92400e;color:#fde68a}
-.badge.red{background:#7f1d1d;border-color:#991b1b;color:#fecaca}
-.table-note {opacity:.8; font-size:12px; margin-top:6px}
-input, textarea, select { border-radius: 10px !important; }
-</style>
-"""
-
-def load_base_css():
-    st.markdown(CSS, unsafe_allow_html=True)
-
-def badge(text: str, color: str = ""):
-    st.markdown(f'<span class="badge {color}">{text}</span>', unsafe_allow_html=True)
+import os
+
+import streamlit as st
+
+from .db import cached_query
+
+CSS = """
+<style>
+/* Tarjetas y botones */
+.block-card {background: #0f172a; border: 1px solid #1f2937; padding: 16px; border-radius: 16px; box-shadow: 0 2px 12px rgba(0,0,0,.15);}
+.badge {display:inline-block; padding:4px 10px; border-radius:999px; font-size:12px; background:#111827; border:1px solid #374151;}
+.badge.green{background:#064e3b;border-color:#065f46;color:#d1fae5}
+.badge.amber{background:#78350f;border-color:#92400e;color:#fde68a}
+.badge.red{background:#7f1d1d;border-color:#991b1b;color:#fecaca}
+.table-note {opacity:.8; font-size:12px; margin-top:6px}
+input, textarea, select { border-radius: 10px !important; }
+</style>
+"""
+
+def load_base_css():
+    st.markdown(CSS, unsafe_allow_html=True)
+
+def badge(text: str, color: str = ""):
+    st.markdown(f'<span class="badge {color}">{text}</span>', unsafe_allow_html=True)
+
+def boton_descarga(state_key, firma, label, file_name, mime):
+    """
+    Botón de descarga para un export ya escrito en disco (session_state[state_key] = (firma, ruta)).
+    Streamlit carga el archivo entero en memoria para servirlo: solo se lee mientras el export está
+    pendiente; se descarta al descargarlo o si la firma (filtros, formato) ya no es la actual.
+    """
+    exp = st.session_state.get(state_key)
+    if not exp:
+        return
+    if exp[0] != firma or not os.path.exists(exp[1]):
+        st.session_state.pop(state_key, None)
+        return
+    with open(exp[1], "rb") as fh:
+        descargado = st.download_button(label, data=fh, file_name=file_name, mime=mime, key=f"{state_key}_dl")
+    if descargado:
+        # el navegador ya lo tiene (Streamlit guarda los bytes un rerun más)
+        st.session_state.pop(state_key, None)
+        try:
+            os.remove(exp[1])
+        except OSError:
+            pass
+
+# -------------------------------------------
+# Selector de socio con búsqueda en el servidor
+# -------------------------------------------
+def _fmt_socio(s):
+    return f"{s['id']} - {s['nombre']}" + (f" ({s['dni']})" if s.get("dni") else "")
+
+def _buscar_socios(q, limite):
+    # caché compartida por prefijo; se invalida al escribir en socio
+    rows = cached_query("SELECT id, nombre, dni FROM sp_buscar_socio(%s, %s)", (q, limite), tables={"socio"})
+    return [{"id": r["id"], "nombre": r["nombre"], "dni": r["dni"]} for r in rows]
+
+def socio_picker(label="Socio", key="socio", multiple=False, min_chars=2, limite=20):
+    """
+    Busca socios en la BD mientras se escribe (sp_buscar_socio) en vez de precargar la tabla.
+    El texto se envía al pulsar Enter o salir del campo, y no se consulta con menos de
+    `min_chars` caracteres. Devuelve el socio elegido ({id, nombre, dni}) o None;
+    con multiple=True, la lista de elegidos, que se conserva entre búsquedas.
+    """
+    q = " ".join(st.text_input(f"Buscar {label.lower()}", key=f"{key}_q",
+                               placeholder="DNI, nombre, email o teléfono").split())
+    hits = _buscar_socios(q, limite) if len(q) >= min_chars else []
+    if q and len(q) < min_chars:
+        st.caption(f"Escribe al menos {min_chars} caracteres.")
+    elif q and not hits:
+        st.caption("Sin resultados.")
+
+    if not multiple:
+        if not hits:
+            return None
+        return st.selectbox(label, hits, format_func=_fmt_socio, key=f"{key}_sel")
+
+    elegidos = st.session_state.setdefault(f"{key}_elegidos", [])
+    ids = {s["id"] for s in elegidos}
+    opciones = elegidos + [h for h in hits if h["id"] not in ids]
+    # al cambiar las opciones el widget se recrea con los elegidos como default
+    sel = st.multiselect(label, opciones, default=elegidos, format_func=_fmt_socio, key=f"{key}_multi")
+    st.session_state[f"{key}_elegidos"] = sel
+    return sel
@@ -1,11 +1,11 @@
 import streamlit as st
 from datetime import date, datetime, time, timedelta
-from io import StringIO
-import csv
 
-from app.lib.auth import require_perm, has_permission
-from app.lib.db import query, db_cursor
-from app.lib.ui import load_base_css
+from app.lib.auth import require_perm, has_permission, audit
+from app.lib.db import cached_query, db_cursor
+from app.lib.export import export_csv
+from app.lib.pagination import paginar
+from app.lib.ui import load_base_css, socio_picker, boton_descarga
 
 st.set_page_config(page_title="Pagos", page_icon="💳", layout="wide")
 load_base_css()
@@ -16,27 +16,6 @@ require_perm("payments_read")
 # ------------------ Helpers ------------------
 MEDIOS = ["Efectivo", "Tarjeta", "Transferencia", "Yape", "Plin", "POS", "Otro"]
 
-def to_csv(rows, headers):
-    sio = StringIO()
-    writer = csv.DictWriter(sio, fieldnames=headers)
-    writer.writeheader()
-    for r in rows:
-        writer.writerow({k: r.get(k) for k in headers})
-    return sio.getvalue()
-
-def auditoria(cur, accion, entidad, entidad_id=None, detalle=None):
-    """Audita si la tabla auditoria existe (opcional)."""
-    try:
-        u = st.session_state.get("user") or {}
-        uid = u.get("id")
-        cur.execute("""
-            INSERT INTO auditoria (usuario_id, accion, entidad, entidad_id, detalle)
-            VALUES (%s, %s, %s, %s, %s::jsonb)
-        """, (uid, accion, entidad, entidad_id, detalle))
-    except Exception:
-        # si no existe la tabla o falla, no romper el flujo
-        pass
-
 def generar_recibo_html(pago_data):
     """Genera HTML para el recibo de pago con nuevo diseño"""
     fecha_formato = pago_data['fecha'].strftime('%d/%m/%Y %H:%M') if isinstance(pago_data['fecha'], datetime) else pago_data['fecha']
@@ -427,65 +406,57 @@ with tab_nuevo:
             mostrar_recibo_interactivo(st.session_state['ultimo_pago'])
         else:
             # Formulario normal de pago
-            socios = query("SELECT id, nombre FROM socio ORDER BY nombre LIMIT 500")
-            if not socios:
-                st.warning("Primero crea un socio.")
-            else:
-                c1, c2 = st.columns([2, 1])
-                with c1:
-                    socio = st.selectbox("Socio", socios, format_func=lambda s: f"{s['nombre']} (#{s['id']})")
-                with c2:
-                    medio = st.selectbox("Medio de pago", MEDIOS, index=0)
+            c1, c2 = st.columns([2, 1])
+            with c1:
+                socio = socio_picker("Socio", key="pago_socio")
+            with c2:
+                medio = st.selectbox("Medio de pago", MEDIOS, index=0)
 
-                concepto = st.text_input("Concepto", placeholder="Mensualidad septiembre / Inscripción / Producto, etc.")
-                monto = st.number_input("Monto (S/)", min_value=0.10, step=1.00, value=50.00, format="%.2f")
-                ref = st.text_input("Referencia externa (opcional)", placeholder="N° operación, voucher, etc.")
+            concepto = st.text_input("Concepto", placeholder="Mensualidad septiembre / Inscripción / Producto, etc.")
+            monto = st.number_input("Monto (S/)", min_value=0.10, step=1.00, value=50.00, format="%.2f")
+            ref = st.text_input("Referencia externa (opcional)", placeholder="N° operación, voucher, etc.")
 
-                # Fecha/hora del pago
-                colf1, colf2 = st.columns(2)
-                with colf1:
-                    f_pago = st.date_input("Fecha de pago", value=date.today())
-                with colf2:
-                    t_pago = st.time_input("Hora", value=datetime.now().time().replace(microsecond=0))
+            # Fecha/hora del pago
+            colf1, colf2 = st.columns(2)
+            with colf1:
+                f_pago = st.date_input("Fecha de pago", value=date.today())
+            with colf2:
+                t_pago = st.time_input("Hora", value=datetime.now().time().replace(microsecond=0))
 
-                guardar = st.button("💾 Guardar pago", type="primary", disabled=(not concepto or monto <= 0))
+            guardar = st.button("💾 Guardar pago", type="primary", disabled=(socio is None or not concepto or monto <= 0))
 
-                if guardar:
-                    try:
-                        ts = datetime.combine(f_pago, t_pago)
-                        with db_cursor(commit=True) as cur:
-                            cur.execute("""
-                                INSERT INTO pago (socio_id, concepto, monto, medio, ref_externa, fecha)
-                                VALUES (%s, %s, %s, %s, %s, %s)
-                                RETURNING id
-                            """, (socio["id"], concepto.strip(), monto, medio, (ref or None), ts))
-                            pid = cur.fetchone()["id"]
-                            auditoria(cur,
-                                      accion="crear_pago",
-                                      entidad="pago",
-                                      entidad_id=pid,
-                                      detalle=f'{{"socio_id": {socio["id"]}, "monto": {monto}, "medio": "{medio}"}}')
+            if guardar:
+                try:
+                    ts = datetime.combine(f_pago, t_pago)
+                    with db_cursor(commit=True) as cur:
+                        cur.execute("""
+                            INSERT INTO pago (socio_id, concepto, monto, medio, ref_externa, fecha)
+                            VALUES (%s, %s, %s, %s, %s, %s)
+                            RETURNING id
+                        """, (socio["id"], concepto.strip(), monto, medio, (ref or None), ts))
+                        pid = cur.fetchone()["id"]
+                    audit("crear_pago", "pago", pid, {"socio_id": socio["id"], "monto": monto, "medio": medio})
                         
-                        # Preparar datos para el recibo
-                        pago_data = {
-                            'id': pid,
-                            'fecha': ts,
-                            'socio': socio['nombre'],
-                            'concepto': concepto.strip(),
-                            'medio': medio,
-                            'monto': monto,
-                            'ref_externa': ref if ref else None
-                        }
+                    # Preparar datos para el recibo
+                    pago_data = {
+                        'id': pid,
+                        'fecha': ts,
+                        'socio': socio['nombre'],
+                        'concepto': concepto.strip(),
+                        'medio': medio,
+                        'monto': monto,
+                        'ref_externa': ref if ref else None
+                    }
                         
-                        # Guardar en session state y activar vista de recibo
-                        st.session_state['ultimo_pago'] = pago_data
-                        st.session_state['mostrar_recibo'] = True
+                    # Guardar en session state y activar vista de recibo
+                    st.session_state['ultimo_pago'] = pago_data
+                    st.session_state['mostrar_recibo'] = True
                         
-                        # Rerun para mostrar el recibo
-                        st.rerun()
+                    # Rerun para mostrar el recibo
+                    st.rerun()
                         
-                    except Exception as e:
-                        st.error(f"No se pudo registrar el pago: {e}")
+                except Exception as e:
+                    st.error(f"No se pudo registrar el pago: {e}")
 
 # ================== LISTADO ==================
 with tab_listado:
@@ -500,11 +471,7 @@ with tab_listado:
     with c4:
         q_medio = st.selectbox("Medio", ["(Todos)"] + MEDIOS)
 
-    c5, c6 = st.columns(2)
-    with c5:
-        q_concepto = st.text_input("Concepto (contiene)")
-    with c6:
-        limite = st.selectbox("Límite", [50, 100, 200, 500, 1000], index=2)
+    q_concepto = st.text_input("Concepto (contiene)")
 
     # rango inclusive del día "hasta"
     start = datetime.combine(desde, time.min)
@@ -528,25 +495,30 @@ with tab_listado:
         sql += " AND p.medio = %s"
         params.append(q_medio)
 
-    sql += " ORDER BY p.fecha DESC, p.id DESC LIMIT %s"
-    params.append(limite)
+    export_sql, export_params = sql + " ORDER BY p.fecha DESC, p.id DESC", tuple(params)
 
     try:
-        rows = query(sql, tuple(params))
+        # Totales del periodo filtrado (todo el periodo, no solo la página); cacheado por filtro
+        # hasta que se escriba un pago o un socio
+        total = cached_query(f"SELECT COALESCE(SUM(monto), 0) AS total FROM ({sql}) t", tuple(params),
+                             tables={"pago", "socio"})[0]["total"]
+        st.metric("Total en el periodo (S/)", f"{total:,.2f}")
+        rows = paginar("pagos", sql, tuple(params), claves=("fecha", "id"), df=False)
     except Exception as e:
         st.error(f"Error consultando pagos: {e}")
         rows = []
 
-    # Totales del periodo filtrado
-    total = sum(r["monto"] for r in rows) if rows else 0
-    st.metric("Total en el periodo (S/)", f"{total:,.2f}")
-
     if rows:
         st.dataframe(rows, use_container_width=True)
 
-        # Exportar CSV
-        csv_data = to_csv(rows, headers=["id", "fecha", "socio", "concepto", "medio", "monto", "ref_externa"])
-        st.download_button("⬇️ Exportar CSV", data=csv_data, file_name="pagos.csv", mime="text/csv")
+        # Exportar CSV (todo el periodo filtrado, sin el límite de la tabla; se escribe por lotes en disco)
+        # El archivo queda asociado a los filtros con que se generó
+        if st.button("⬇️ Preparar CSV del periodo"):
+            st.session_state["export_pagos"] = (export_params, export_csv(
+                export_sql, export_params,
+                headers=["id", "fecha", "socio", "concepto", "medio", "monto", "ref_externa"]
+            ))
+        boton_descarga("export_pagos", export_params, "Descargar CSV", "pagos.csv", "text/csv")
 
         # Sección para regenerar recibos
         st.divider()
@@ -616,11 +588,7 @@ with tab_listado:
                             RETURNING id
                         """, (sel["id"], f"ANULACIÓN #{sel['id']}: {motivo or sel['concepto']}", sel["id"], f"reversa de #{sel['id']}"))
                         rid = cur.fetchone()["id"]
-                        auditoria(cur,
-                                  accion="reverso_pago",
-                                  entidad="pago",
-                                  entidad_id=rid,
-                                  detalle=f'{{"reversa_de": {sel["id"]}}}')
+                    audit("reverso_pago", "pago", rid, {"reversa_de": sel["id"]})
                     st.success(f"Pago reversado con asiento #{rid}")
                     st.rerun()
                 except Exception as e:
@@ -0,0 +1,85 @@
+import streamlit as st
+from app.lib.auth import require_role
+from app.lib.db import pool_stats, cache_stats, prepared_stats, PREPARE_ENABLED
+from app.lib import metrics, audit
+from app.lib.ui import load_base_css
+
+st.set_page_config(page_title="Rendimiento", page_icon="⏱️", layout="wide")
+load_base_css()
+st.title("⏱️ Rendimiento de la base de datos")
+require_role("admin")
+
+st.caption(f"Métricas de este proceso desde su arranque. Umbral de consulta lenta: {metrics.SLOW_MS:.0f} ms (DB_SLOW_MS).")
+
+# --- Pool de conexiones ---
+st.subheader("Pool de conexiones")
+ps = pool_stats()
+c1, c2, c3, c4, c5 = st.columns(5)
+c1.metric("Conexiones", f"{ps.get('pool_size', 0)} / {ps.get('pool_max', '—')}")
+c2.metric("Libres", ps.get("pool_available", 0))
+c3.metric("En espera", ps.get("requests_waiting", 0))
+c4.metric("Checkout prom. (ms)", ps.get("checkout_ms_avg", 0))
+c5.metric("Checkout máx. (ms)", ps.get("checkout_ms_max", 0))
+if "replica" in ps:
+    rp = ps["replica"]
+    st.caption(f"Réplica de lectura: {rp.get('pool_size', 0)} / {rp.get('pool_max', '—')} conexiones, "
+               f"{rp.get('pool_available', 0)} libres, {rp.get('requests_waiting', 0)} en espera.")
+
+# --- Caché de resultados ---
+st.subheader("Caché de resultados")
+cs = cache_stats()
+c1, c2, c3, c4, c5 = st.columns(5)
+c1.metric("Entradas", cs["entries"])
+c2.metric("Aciertos", cs["hits"])
+c3.metric("Fallos", cs["misses"])
+c4.metric("Tasa de acierto", f"{cs['hit_ratio']:.0%}")
+c5.metric("Invalidaciones", cs["invalidations"])
+if not cs["listener"]:
+    st.warning("El listener LISTEN/NOTIFY no está conectado: los cambios de otras instancias solo se reflejan al vencer el TTL.")
+
+# --- Auditoría en segundo plano ---
+au = audit.stats()
+st.caption(f"Auditoría: {au['queued']} en cola, {au['written']} escritos, {au['spilled']} enviados a disco, "
+           f"{au['errors']} volcados fallidos.")
+if au["rejected"]:
+    st.error(f"{au['rejected']} eventos de auditoría rechazados por la BD; quedaron en {audit.REJECTED_PATH}.")
+if au["spill_pending"]:
+    st.warning(f"Hay eventos de auditoría pendientes en {audit.SPILL_PATH}; se reenviarán en el próximo volcado exitoso.")
+
+# --- Sentencias preparadas ---
+st.subheader("Sentencias preparadas")
+if not PREPARE_ENABLED:
+    st.caption("Desactivadas (PGPREPARE=0): solo se cuentan ejecuciones.")
+st.dataframe(prepared_stats(), use_container_width=True, hide_index=True,
+             column_config={"reuso": st.column_config.NumberColumn("Reuso del plan", format="%.1%%")})
+
+# --- Top sentencias ---
+st.subheader("Sentencias más costosas")
+ORDEN = {"Tiempo total": "total_ms", "Tiempo medio": "mean_ms", "p95": "p95_ms", "Ejecuciones": "count", "Filas": "rows", "Bytes": "bytes"}
+c1, c2, c3 = st.columns([2, 1, 1])
+with c1:
+    orden = st.selectbox("Ordenar por", list(ORDEN.keys()))
+with c2:
+    n = st.selectbox("Top", [10, 20, 50], index=1)
+with c3:
+    st.write("")
+    if st.button("🧹 Reiniciar métricas"):
+        metrics.reset()
+        st.rerun()
+
+rows = metrics.top(n, by=ORDEN[orden])
+if rows:
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+else:
+    st.info("Aún no hay sentencias registradas.")
+
+# --- Consultas lentas ---
+st.subheader("Consultas lentas recientes")
+lentas = metrics.slow_log()
+if not lentas:
+    st.info("Sin consultas por encima del umbral.")
+for s in lentas:
+    with st.expander(f"{s['ts']} · {s['ms']} ms · {s['page']} · {s['sql'][:80]}"):
+        st.code(s["sql"], language="sql")
+        if s["plan"]:
+            st.code(s["plan"], language="text")
@@ -0,0 +1,78 @@
+import streamlit as st
+from app.lib.auth import require_login
+from app.lib.sp_wrappers import socio_360, socio_dentro
+from app.lib.ui import load_base_css, badge, socio_picker
+
+st.set_page_config(page_title="Perfil de socio", page_icon="🪪", layout="wide")
+load_base_css()
+st.title("🪪 Perfil de socio")
+
+require_login()
+
+def fecha(v, hora=True):
+    # las fechas llegan del JSON como texto ISO
+    if not v:
+        return "—"
+    return v[:16].replace("T", " ") if hora else v[:10]
+
+sel = socio_picker("Socio", key="perfil_socio")
+if not sel:
+    st.info("Busca un socio por DNI, nombre, email o teléfono.")
+    st.stop()
+
+perfil = socio_360(sel["id"])
+if perfil is None:
+    st.warning("El socio ya no existe.")
+    st.stop()
+
+s, m, v = perfil["socio"], perfil["membresia"], perfil["visitas"]
+
+c1, c2 = st.columns([3, 1])
+with c1:
+    st.subheader(s["nombre"])
+    st.caption(f"DNI {s['dni'] or '—'} · {s['email'] or 's/ email'} · {s['telefono'] or 's/ teléfono'} · "
+               f"alta {fecha(s['fecha_alta'], hora=False)}")
+with c2:
+    badge(s["estado"], "green" if s["estado"] == "activo" else "red")
+    if socio_dentro(s["id"]):
+        badge("En el gimnasio", "amber")
+
+# --- Membresía y visitas ---
+c1, c2, c3, c4, c5 = st.columns(5)
+if m:
+    c1.metric("Membresía", m["plan"], m["estado"], delta_color="off")
+    c2.metric("Vence", fecha(m["fecha_fin"], hora=False),
+              f"{m['dias_restantes']} días" if m["estado"] == "activa" else None,
+              delta_color="normal" if (m["dias_restantes"] or 0) > 7 else "inverse")
+else:
+    c1.metric("Membresía", "Sin membresía")
+    c2.metric("Vence", "—")
+c3.metric("Última visita", fecha(v["ultima"]))
+c4.metric("Visitas 30 / 90 días", f"{v['dias_30']} / {v['dias_90']}")
+c5.metric("Total pagado (S/)", f"{perfil['total_pagado']:,.2f}")
+
+st.divider()
+c1, c2 = st.columns(2)
+with c1:
+    st.subheader("Últimos pagos")
+    if perfil["pagos"]:
+        st.dataframe([{**p, "fecha": fecha(p["fecha"])} for p in perfil["pagos"]],
+                     use_container_width=True, hide_index=True,
+                     column_order=["id", "fecha", "concepto", "medio", "monto"])
+    else:
+        st.caption("Sin pagos.")
+with c2:
+    st.subheader("Próximas reservas")
+    if perfil["reservas"]:
+        st.dataframe([{**r, "fecha_hora": fecha(r["fecha_hora"])} for r in perfil["reservas"]],
+                     use_container_width=True, hide_index=True,
+                     column_order=["id", "fecha_hora", "clase", "sede", "estado"])
+    else:
+        st.caption("Sin reservas próximas.")
+
+st.subheader("Últimas compras")
+if perfil["compras"]:
+    st.dataframe([{**c, "fecha": fecha(c["fecha"])} for c in perfil["compras"]],
+                 use_container_width=True, hide_index=True, column_order=["id", "fecha", "items", "total"])
+else:
+    st.caption("Sin compras.")
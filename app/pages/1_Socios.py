@@ -1,8 +1,10 @@
 import streamlit as st
 from app.lib.auth import require_login
-from app.lib.db import query, execute
+from app.lib.db import query, query_df, execute
 from app.lib.sp_wrappers import alta_socio
-from app.lib.ui import load_base_css, badge
+from app.lib.importer import importar_socios
+from app.lib.pagination import paginar
+from app.lib.ui import load_base_css, badge, socio_picker
 
 st.set_page_config(page_title="Socios", page_icon="👤", layout="wide")
 load_base_css()
@@ -10,25 +12,18 @@ st.title("👤 Socios")
 
 require_login()
 
-tab_listar, tab_crear, tab_editar = st.tabs(["📋 Listar / Buscar", "➕ Crear", "✏️ Editar / Eliminar"])
+tab_listar, tab_crear, tab_editar, tab_importar = st.tabs(["📋 Listar / Buscar", "➕ Crear", "✏️ Editar / Eliminar", "📥 Importar"])
 
 with tab_listar:
-    c1, c2 = st.columns([2,1])
-    with c1:
-        q = st.text_input("🔎 Buscar por nombre o email", "")
-    with c2:
-        limit = st.selectbox("Límite", [50, 100, 200, 500], index=1)
+    q = st.text_input("🔎 Buscar por nombre, email, DNI o teléfono", "")
 
-    params = ()
-    sql = "SELECT id, dni, nombre, email, telefono, estado, fecha_alta FROM socio "
     if q.strip():
-        sql += "WHERE nombre ILIKE %s OR email ILIKE %s "
-        params = (f"%{q}%", f"%{q}%")
-    sql += "ORDER BY id DESC LIMIT %s"
-    params = params + (limit,)
-
-    rows = query(sql, params)
-    st.dataframe(rows, use_container_width=True)
+        # los 100 más relevantes (ver sp_buscar_socio)
+        df = query_df("SELECT id, dni, nombre, email, telefono, estado, fecha_alta FROM sp_buscar_socio(%s, %s)",
+                      (q, 100))
+    else:
+        df = paginar("socios", "SELECT id, dni, nombre, email, telefono, estado, fecha_alta FROM socio")
+    st.dataframe(df, use_container_width=True)
     st.caption("Tip: usa el buscador para filtrar.")
 
 with tab_crear:
@@ -57,34 +52,53 @@ with tab_crear:
 
 with tab_editar:
     st.subheader("Editar / Eliminar")
-    socios = query("SELECT id, nombre, email FROM socio ORDER BY id DESC LIMIT 300")
-    if not socios:
-        st.info("No hay socios aún.")
-    else:
-        sel = st.selectbox("Selecciona un socio", socios, format_func=lambda x: f"{x['id']} - {x['nombre']} ({x['email'] or 's/ email'})")
-        if sel:
-            data = query("SELECT id, dni, nombre, email, telefono, estado FROM socio WHERE id=%s", (sel["id"],))
-            s = data[0]
-            with st.form("f_edit"):
-                c1, c2 = st.columns(2)
-                with c1:
-                    dni = st.text_input("DNI", s["dni"] or "")
-                    nombre = st.text_input("Nombre *", s["nombre"] or "")
-                    email = st.text_input("Email", s["email"] or "")
-                with c2:
-                    telefono = st.text_input("Teléfono", s["telefono"] or "")
-                    estado = st.selectbox("Estado", ["activo","inactivo"], index=0 if (s["estado"]=="activo") else 1)
-                c3, c4, c5 = st.columns([1,1,2])
-                upd = c3.form_submit_button("💾 Guardar")
-                delb = c4.form_submit_button("🗑️ Eliminar", type="primary")
-            if upd:
-                execute(
-                    "UPDATE socio SET dni=%s, nombre=%s, email=%s, telefono=%s, estado=%s WHERE id=%s",
-                    (dni or None, nombre.strip(), email or None, telefono or None, estado, s["id"])
-                )
-                st.success("Actualizado")
-                st.rerun()
-            if delb:
-                execute("DELETE FROM socio WHERE id=%s", (s["id"],))
-                st.success("Eliminado")
-                st.rerun()
+    sel = socio_picker("Socio", key="editar_socio")
+    if sel:
+        data = query("SELECT id, dni, nombre, email, telefono, estado FROM socio WHERE id=%s", (sel["id"],))
+        s = data[0]
+        with st.form("f_edit"):
+            c1, c2 = st.columns(2)
+            with c1:
+                dni = st.text_input("DNI", s["dni"] or "")
+                nombre = st.text_input("Nombre *", s["nombre"] or "")
+                email = st.text_input("Email", s["email"] or "")
+            with c2:
+                telefono = st.text_input("Teléfono", s["telefono"] or "")
+                estado = st.selectbox("Estado", ["activo","inactivo"], index=0 if (s["estado"]=="activo") else 1)
+            c3, c4, c5 = st.columns([1,1,2])
+            upd = c3.form_submit_button("💾 Guardar")
+            delb = c4.form_submit_button("🗑️ Eliminar", type="primary")
+        if upd:
+            execute(
+                "UPDATE socio SET dni=%s, nombre=%s, email=%s, telefono=%s, estado=%s WHERE id=%s",
+                (dni or None, nombre.strip(), email or None, telefono or None, estado, s["id"])
+            )
+            st.success("Actualizado")
+            st.rerun()
+        if delb:
+            execute("DELETE FROM socio WHERE id=%s", (s["id"],))
+            st.success("Eliminado")
+            st.rerun()
+
+with tab_importar:
+    st.subheader("Importar socios desde CSV")
+    st.caption("Cabecera requerida: nombre. Opcionales: dni, email, telefono. Los duplicados (en el archivo o ya registrados) se rechazan.")
+    archivo = st.file_uploader("Archivo CSV", type=["csv", "txt"])
+    c1, c2 = st.columns(2)
+    with c1:
+        sep = st.selectbox("Separador", [",", ";", "|", "Tab"])
+    with c2:
+        enc = st.selectbox("Codificación", ["utf-8", "latin-1"], help="Excel en Windows suele guardar en latin-1")
+    if archivo and st.button("📥 Importar"):
+        try:
+            with st.spinner("Importando..."):
+                res = importar_socios(archivo, delimiter="\t" if sep == "Tab" else sep, encoding=enc)
+        except Exception as e:
+            st.error(f"No se pudo importar: {e}")
+        else:
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Filas", res["total"])
+            c2.metric("Insertadas", res["insertados"])
+            c3.metric("Rechazadas", len(res["rechazados"]))
+            if res["rechazados"]:
+                st.dataframe(res["rechazados"], use_container_width=True, hide_index=True)
@@ -1,9 +1,9 @@
 import streamlit as st
 from datetime import date
 from app.lib.auth import require_login
-from app.lib.db import query, execute
+from app.lib.db import query_df, cached_query, execute
 from app.lib.sp_wrappers import crear_membresia, registrar_pago
-from app.lib.ui import load_base_css, badge
+from app.lib.ui import load_base_css, badge, socio_picker
 
 st.set_page_config(page_title="Membresías", page_icon="💳", layout="wide")
 load_base_css()
@@ -37,7 +37,7 @@ with tab_planes:
             except Exception as e:
                 st.error(f"No se pudo crear: {e}")
 
-    planes = query("SELECT id, nombre, precio_mensual, duracion_dias, max_congelamiento FROM membresia_plan ORDER BY id DESC")
+    planes = cached_query("SELECT id, nombre, precio_mensual, duracion_dias, max_congelamiento FROM membresia_plan ORDER BY id DESC")
     st.dataframe(planes, use_container_width=True)
 
     st.markdown("### ✏️ Editar / Eliminar plan")
@@ -71,25 +71,24 @@ with tab_planes:
 # --- Asignación de Membresías ---
 with tab_asignar:
     st.subheader("Asignar miembros a un plan")
-    socios = query("SELECT id, nombre FROM socio ORDER BY id DESC LIMIT 400")
-    planes = query("SELECT id, nombre, precio_mensual FROM membresia_plan ORDER BY nombre")
-    if socios and planes:
+    planes = cached_query("SELECT id, nombre, precio_mensual FROM membresia_plan ORDER BY nombre")
+    if planes:
         c1, c2 = st.columns(2)
         with c1:
-            socio = st.selectbox("Socio", socios, format_func=lambda s: f"{s['id']} - {s['nombre']}")
+            socio = socio_picker("Socio", key="memb_socio")
         with c2:
             plan = st.selectbox("Plan", planes, format_func=lambda p: f"{p['nombre']} (S/{p['precio_mensual']})")
         f_ini = st.date_input("Fecha inicio", value=date.today())
-        if st.button("Crear membresía"):
+        if st.button("Crear membresía", disabled=socio is None):
             r = crear_membresia(socio["id"], plan["id"], f_ini.isoformat())[0]
             st.success(f"Membresía ID {r.get('membresia_id')}" if r.get("status")=="OK" else r.get("message"))
     else:
-        st.info("Necesitas al menos 1 socio y 1 plan.")
+        st.info("Necesitas al menos 1 plan.")
 
 # --- Listado y gestión rápida ---
 with tab_listado:
     st.subheader("Membresías activas")
-    mem = query("""
+    mem = query_df("""
       SELECT m.id, s.nombre AS socio, p.nombre AS plan, m.fecha_inicio, m.fecha_fin, m.estado
       FROM membresia m
       JOIN socio s ON s.id = m.socio_id
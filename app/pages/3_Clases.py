@@ -1,9 +1,9 @@
 import streamlit as st
 from datetime import datetime, time as dtime
 from app.lib.auth import require_login
-from app.lib.db import query, execute
-from app.lib.sp_wrappers import publicar_clase, reservar_clase, checkin_clase
-from app.lib.ui import load_base_css, badge
+from app.lib.db import query, query_batch, cached_query, execute
+from app.lib.sp_wrappers import publicar_clase, reservar_clases, checkin_clases, cancelar_reserva
+from app.lib.ui import load_base_css, badge, socio_picker
 
 st.set_page_config(page_title="Clases", page_icon="📆", layout="wide")
 load_base_css()
@@ -15,7 +15,7 @@ tab_publicar, tab_listar, tab_reservas = st.tabs(["➕ Publicar", "🗂️ Lista
 
 with tab_publicar:
     st.subheader("Crear nueva clase")
-    sedes = query("SELECT id, nombre FROM sede ORDER BY id")
+    sedes = cached_query("SELECT id, nombre FROM sede ORDER BY id")
     if not sedes:
         st.warning("Crea sedes primero (seed).")
     else:
@@ -34,7 +34,7 @@ with tab_listar:
     q = st.text_input("Buscar por nombre de clase")
     params = ()
     sql = """
-      SELECT c.id, c.nombre, s.nombre AS sede, c.fecha_hora, c.capacidad, c.estado
+      SELECT c.id, c.nombre, s.nombre AS sede, c.fecha_hora, c.capacidad, c.reservadas, c.estado
       FROM clase c JOIN sede s ON s.id=c.sede_id
     """
     if q.strip():
@@ -59,6 +59,7 @@ with tab_listar:
                 upd = c4.form_submit_button("💾 Guardar")
                 delb = c5.form_submit_button("🗑️ Eliminar", type="primary")
             if upd:
+                # si sube la capacidad, el trigger trg_clase_capacidad confirma a la lista de espera
                 execute("UPDATE clase SET nombre=%s, capacidad=%s, estado=%s WHERE id=%s", (nombre, cap, estado, sel["id"]))
                 st.success("Clase actualizada")
                 st.rerun()
@@ -69,32 +70,58 @@ with tab_listar:
 
 with tab_reservas:
     st.subheader("Reservar / Check-in")
-    clases = query("SELECT id, nombre, fecha_hora FROM clase WHERE estado='programada' ORDER BY fecha_hora DESC LIMIT 200")
-    socios = query("SELECT id, nombre FROM socio ORDER BY id DESC LIMIT 300")
-    if clases and socios:
+    clases, resv = query_batch([
+        "SELECT id, nombre, fecha_hora, capacidad, reservadas FROM clase WHERE estado='programada' ORDER BY fecha_hora DESC LIMIT 200",
+        """
+          SELECT r.id, r.clase_id, r.socio_id, r.estado, c.nombre as clase
+          FROM reserva r JOIN clase c ON c.id=r.clase_id
+          WHERE r.estado IN ('confirmada', 'waitlist')
+          ORDER BY r.id DESC LIMIT 200
+        """,
+    ])
+    confirmadas = [r for r in resv if r["estado"] == "confirmada"]
+    if clases:
         c1, c2 = st.columns(2)
         with c1:
-            cl = st.selectbox("Clase", clases, format_func=lambda x: f"{x['id']} - {x['nombre']} @ {x['fecha_hora']}")
+            cl = st.selectbox("Clase", clases, format_func=lambda x: f"{x['id']} - {x['nombre']} @ {x['fecha_hora']} ({x['reservadas']}/{x['capacidad']})")
         with c2:
-            sc = st.selectbox("Socio", socios, format_func=lambda x: f"{x['id']} - {x['nombre']}")
-        if st.button("Reservar clase"):
-            r = reservar_clase(sc["id"], cl["id"])[0]
-            st.success(f"Reserva ID {r.get('reserva_id')}" if r.get("status")=="OK" else r.get("message"))
+            scs = socio_picker("Socios", key="reserva_socios", multiple=True)
+        if st.button("Reservar clase", disabled=not scs):
+            # todo el grupo en una sola llamada; un resultado por socio
+            for sc, r in zip(scs, reservar_clases([s["id"] for s in scs], cl["id"])):
+                if r["status"] == "OK":
+                    st.success(f"{sc['nombre']}: reserva ID {r['reserva_id']}")
+                elif r["status"] == "WAITLIST":
+                    st.warning(f"{sc['nombre']}: {r['message']} (reserva ID {r['reserva_id']})")
+                else:
+                    st.error(f"{sc['nombre']}: {r['message']}")
     else:
-        st.info("Se necesitan clases programadas y socios.")
+        st.info("Se necesitan clases programadas.")
 
     st.divider()
     st.subheader("Pendientes de asistencia")
-    resv = query("""
-      SELECT r.id, r.clase_id, r.socio_id, r.estado, c.nombre as clase
-      FROM reserva r JOIN clase c ON c.id=r.clase_id
-      WHERE r.estado='confirmada'
-      ORDER BY r.id DESC LIMIT 200
-    """)
-    if resv:
-        sel = st.selectbox("Reserva", resv, format_func=lambda x: f"Res {x['id']} ({x['clase']}, socio {x['socio_id']})")
-        if st.button("Marcar asistencia"):
-            r = checkin_clase(sel["id"])[0]
-            st.success("Asistencia registrada" if r.get("status")=="OK" else r.get("message"))
+    if confirmadas:
+        sels = st.multiselect("Reservas", confirmadas, format_func=lambda x: f"Res {x['id']} ({x['clase']}, socio {x['socio_id']})")
+        if st.button("Marcar asistencia", disabled=not sels):
+            res = checkin_clases([r["id"] for r in sels])
+            ok = sum(r["status"] == "OK" for r in res)
+            st.success(f"Asistencia registrada: {ok} de {len(res)}")
+            for r in res:
+                if r["status"] != "OK":
+                    st.error(f"Res {r['reserva_id']}: {r['message']}")
     else:
         st.info("No hay reservas confirmadas recientes.")
+
+    st.divider()
+    st.subheader("Cancelar reserva")
+    if resv:
+        rc = st.selectbox("Reserva a cancelar", resv, format_func=lambda x: f"Res {x['id']} ({x['clase']}, socio {x['socio_id']}, {x['estado']})")
+        if st.button("Cancelar reserva"):
+            # libera el cupo y lo pasa al primero de la lista de espera
+            r = cancelar_reserva(rc["id"])[0]
+            if r["status"] == "OK":
+                st.success(r["message"])
+            else:
+                st.error(r["message"])
+    else:
+        st.info("No hay reservas activas.")
@@ -1,8 +1,10 @@
+import os
 import streamlit as st
+from app.lib import live
 from app.lib.auth import require_login
-from app.lib.db import query
-from app.lib.sp_wrappers import registrar_acceso, registrar_salida, aforo_actual
-from app.lib.ui import load_base_css
+from app.lib.db import query_batch, cached_query
+from app.lib.sp_wrappers import registrar_accesos, registrar_salida
+from app.lib.ui import load_base_css, socio_picker
 
 st.set_page_config(page_title="Accesos y Aforo", page_icon="🚪", layout="wide")
 load_base_css()
@@ -10,37 +12,55 @@ st.title("🚪 Accesos y Aforo")
 
 require_login()
 
-sedes = query("SELECT id, nombre FROM sede ORDER BY id")
+sedes = cached_query("SELECT id, nombre FROM sede ORDER BY id")
 if not sedes:
     st.warning("Crea sedes (seed).")
     st.stop()
 
 sede = st.selectbox("Sede", sedes, format_func=lambda x: f"{x['id']} - {x['nombre']}")
 
-c1, c2 = st.columns(2)
-with c1:
-    st.subheader("Aforo actual")
-    st.metric("Personas dentro", aforo_actual(sede["id"]))
-with c2:
-    st.subheader("Accesos abiertos")
-    abiertos = query(
-        "SELECT id, socio_id, fecha_entrada FROM acceso WHERE sede_id=%s AND fecha_salida IS NULL ORDER BY id DESC LIMIT 100",
-        (sede["id"],)
-    )
-    st.dataframe(abiertos, use_container_width=True)
+LIVE_REFRESH = os.getenv("LIVE_REFRESH", "2s")  # cada cuánto se revisa la versión de la sede
+
+def leer_aforo(sede_id):
+    """Aforo y accesos abiertos en un solo viaje a la BD."""
+    # del primario: el NOTIFY viene de ahí y la réplica puede no tener aún el cambio
+    # (lo leído queda guardado con la versión nueva hasta el próximo aviso)
+    return query_batch([
+        ("sp_aforo_actual", (sede_id,)),
+        ("SELECT id, socio_id, fecha_entrada FROM acceso WHERE sede_id=%s AND fecha_salida IS NULL ORDER BY id DESC LIMIT 100",
+         (sede_id,)),
+    ], readonly=False)
+
+def aforo_sede(sede_id):
+    # solo va a la BD si llegó un NOTIFY de esta sede desde la última lectura
+    return live.load(st.session_state, f"live_aforo_{sede_id}", sede_id, lambda: leer_aforo(sede_id))
+
+@st.experimental_fragment(run_every=LIVE_REFRESH)
+def panel_aforo(sede_id):
+    aforo, abiertos = aforo_sede(sede_id)
+    c1, c2 = st.columns(2)
+    with c1:
+        st.subheader("Aforo actual")
+        st.metric("Personas dentro", aforo[0]["sp_aforo_actual"] if aforo else 0)
+    with c2:
+        st.subheader("Accesos abiertos")
+        st.dataframe(abiertos, use_container_width=True)
+
+panel_aforo(sede["id"])
 
 st.divider()
 st.subheader("➕ Registrar acceso de socio")
-socios = query("SELECT id, nombre FROM socio ORDER BY id DESC LIMIT 300")
-if socios:
-    sc = st.selectbox("Socio", socios, format_func=lambda x: f"{x['id']} - {x['nombre']}")
-    if st.button("Entrada"):
-        r = registrar_acceso(sc["id"], sede["id"])[0]
-        st.success(f"Acceso ID {r.get('acceso_id')}" if r.get("status")=="OK" else r.get("message"))
-else:
-    st.info("No hay socios registrados.")
+scs = socio_picker("Socio(s)", key="acceso_socios", multiple=True)
+if st.button("Entrada", disabled=not scs):
+    # varios ingresos (p. ej. grupo en el torniquete) en una sola llamada
+    for sc, r in zip(scs, registrar_accesos([s["id"] for s in scs], sede["id"])):
+        if r["status"] == "OK":
+            st.success(f"{sc['nombre']}: acceso ID {r['acceso_id']}")
+        else:
+            st.error(f"{sc['nombre']}: {r['message']}")
 
 st.subheader("Registrar salida")
+abiertos = aforo_sede(sede["id"])[1]
 if abiertos:
     sel = st.selectbox("Acceso", abiertos, format_func=lambda x: f"{x['id']} - socio {x['socio_id']} @ {x['fecha_entrada']}")
     if st.button("Salida"):
@@ -1,7 +1,11 @@
-import streamlit as st, pandas as pd, plotly.express as px
+import streamlit as st
 from app.lib.auth import require_login
-from app.lib.db import query
-from app.lib.ui import load_base_css
+from app.lib import adb
+from app.lib.lazy import lazy_import
+from app.lib.export import export_csv, export_parquet, parquet_available
+from app.lib.ui import load_base_css, boton_descarga
+
+px = lazy_import("plotly.express")  # solo se carga si hay pagos que graficar
 
 st.set_page_config(page_title="Reportes", page_icon="📊", layout="wide")
 load_base_css()
@@ -10,17 +14,44 @@ st.title("📊 Reportes")
 require_login()
 
 st.subheader("Ingresos por día (últimos 60)")
-rows = query("SELECT date(fecha) as dia, sum(monto) as ingresos FROM pago GROUP BY 1 ORDER BY 1 DESC LIMIT 60")
-df = pd.DataFrame(rows)
-if not df.empty:
-    fig = px.line(df.sort_values("dia"), x="dia", y="ingresos", markers=True, title="Ingresos diarios")
-    st.plotly_chart(fig, use_container_width=True)
-    st.dataframe(df.sort_values("dia", ascending=False), use_container_width=True)
-else:
-    st.info("No hay pagos registrados.")
+ph_ingresos = st.empty()
 
 st.subheader("Exportar socios")
-socios = query("SELECT id, dni, nombre, email, telefono, estado, fecha_alta FROM socio ORDER BY id DESC")
-df2 = pd.DataFrame(socios)
-st.download_button("Descargar CSV", data=df2.to_csv(index=False), file_name="socios.csv", mime="text/csv")
-st.dataframe(df2.head(200), use_container_width=True)
+SOCIOS_SQL = "SELECT id, dni, nombre, email, telefono, estado, fecha_alta FROM socio ORDER BY id DESC"
+
+# El archivo se genera en disco por lotes (cursor del servidor) solo cuando se pide
+formatos = ["CSV", "Parquet"] if parquet_available() else ["CSV"]
+c1, c2 = st.columns([1, 3])
+with c1:
+    formato = st.selectbox("Formato", formatos)
+with c2:
+    st.write("")
+    if st.button("Preparar exportación"):
+        with st.spinner("Generando archivo..."):
+            path = export_parquet(SOCIOS_SQL) if formato == "Parquet" else export_csv(SOCIOS_SQL)
+        st.session_state["export_socios"] = (formato, path)
+
+if formato == "Parquet":
+    boton_descarga("export_socios", formato, "Descargar Parquet", "socios.parquet", "application/octet-stream")
+else:
+    boton_descarga("export_socios", formato, "Descargar CSV", "socios.csv", "text/csv")
+
+ph_socios = st.empty()
+
+# Las dos lecturas corren a la vez; cada panel se pinta al llegar su resultado
+panels = {
+    "ingresos": adb.aquery_df("SELECT date(fecha) as dia, sum(monto) as ingresos FROM pago GROUP BY 1 ORDER BY 1 DESC LIMIT 60"),
+    "socios": adb.aquery_df(SOCIOS_SQL + " LIMIT 200"),
+}
+for nombre, df, error in adb.run_panels(panels):
+    if error is not None:
+        st.error(f"Error obteniendo {nombre}: {error}")
+    elif nombre == "socios":
+        ph_socios.dataframe(df, use_container_width=True)
+    elif df.empty:
+        ph_ingresos.info("No hay pagos registrados.")
+    else:
+        with ph_ingresos.container():
+            fig = px.line(df.sort_values("dia"), x="dia", y="ingresos", markers=True, title="Ingresos diarios")
+            st.plotly_chart(fig, use_container_width=True)
+            st.dataframe(df.sort_values("dia", ascending=False), use_container_width=True)
@@ -1,6 +1,6 @@
 import streamlit as st, hashlib
 from app.lib.auth import require_role
-from app.lib.db import query, execute
+from app.lib.db import query, cached_query, execute
 from app.lib.ui import load_base_css
 
 st.set_page_config(page_title="Usuarios", page_icon="👥", layout="wide")
@@ -12,7 +12,7 @@ def sha256(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
 roles = ["admin", "recepcion", "entrenador", "finanzas"]
-sedes = query("SELECT id, nombre FROM sede ORDER BY id")
+sedes = cached_query("SELECT id, nombre FROM sede ORDER BY id")
 sede_opts = {s["nombre"]: s["id"] for s in sedes} if sedes else {}
 
 tab_crear, tab_listar = st.tabs(["➕ Crear", "📋 Listar / Editar / Eliminar"])
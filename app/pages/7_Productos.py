@@ -1,6 +1,7 @@
 import streamlit as st
 from app.lib.auth import require_perm, has_permission
-from app.lib.db import query, execute
+from app.lib.db import query, cached_query, execute
+from app.lib.pagination import paginar
 from app.lib.ui import load_base_css
 
 st.set_page_config(page_title="Productos", page_icon="🛒", layout="wide")
@@ -12,22 +13,16 @@ require_perm("products_manage")
 tab_listar, tab_crear, tab_editar = st.tabs(["📋 Listar/Buscar", "➕ Crear", "✏️ Editar/Eliminar"])
 
 with tab_listar:
-    c1, c2 = st.columns([2,1])
-    with c1:
-        q = st.text_input("🔎 Buscar por nombre", "")
-    with c2:
-        limit = st.selectbox("Límite", [50, 100, 200, 500], index=1)
+    q = st.text_input("🔎 Buscar por nombre", "")
 
     params = ()
-    sql = "SELECT id, nombre, precio, stock, activo FROM producto "
+    sql = "SELECT id, nombre, precio, stock, activo FROM producto"
     if q.strip():
-        sql += "WHERE nombre ILIKE %s "
+        sql += " WHERE nombre ILIKE %s"
         params = (f"%{q}%",)
-    sql += "ORDER BY id DESC LIMIT %s"
-    params = params + (limit,)
 
-    rows = query(sql, params)
-    st.dataframe(rows, use_container_width=True)
+    df = paginar("productos", sql, params)
+    st.dataframe(df, use_container_width=True)
 
 with tab_crear:
     st.subheader("Crear producto")
@@ -54,7 +49,7 @@ with tab_crear:
 
 with tab_editar:
     st.subheader("Editar/Eliminar")
-    prods = query("SELECT id, nombre FROM producto ORDER BY id DESC LIMIT 300")
+    prods = cached_query("SELECT id, nombre FROM producto ORDER BY id DESC LIMIT 300")
     if not prods:
         st.info("No hay productos.")
     else:
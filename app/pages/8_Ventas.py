@@ -2,9 +2,9 @@
 import streamlit as st
 from datetime import datetime, date
 
-from app.lib.auth import require_login, has_permission, require_perm
-from app.lib.db import query, db_cursor
-from app.lib.ui import load_base_css
+from app.lib.auth import require_login, has_permission, require_perm, audit
+from app.lib.db import query, cached_query, db_cursor, register_statement, execute_prepared
+from app.lib.ui import load_base_css, socio_picker
 
 st.set_page_config(page_title="Ventas", page_icon="💵", layout="wide")
 load_base_css()
@@ -15,12 +15,7 @@ require_login()
 # ---------------------------------------
 # Helpers
 # ---------------------------------------
-def add_item_with_stock_guard(cur, venta_id, it):
-    """
-    Descuenta stock e inserta el ítem SOLO si alcanza el stock (op. atómica).
-    Castea a numeric para que ROUND funcione con 2 argumentos.
-    """
-    sql = """
+register_statement("venta_item", """
     WITH upd AS (
         UPDATE producto
         SET stock = stock - %s
@@ -39,7 +34,14 @@ def add_item_with_stock_guard(cur, venta_id, it):
         FROM upd
         RETURNING id
     )
-    SELECT id FROM ins;
+    SELECT id FROM ins
+""")
+
+def add_item_with_stock_guard(cur, venta_id, it):
+    """
+    Descuenta stock e inserta el ítem SOLO si alcanza el stock (op. atómica).
+    Castea a numeric para que ROUND funcione con 2 argumentos.
+    Se ejecuta como sentencia preparada (una por ítem en cada venta).
     """
     params = (
         it["cantidad"], it["producto_id"], it["cantidad"],     # upd
@@ -47,7 +49,7 @@ def add_item_with_stock_guard(cur, venta_id, it):
         it["precio"], it["precio"],                            # precio y precio_unitario
         it["precio"], it["cantidad"]                           # subtotal (precio * cantidad)
     )
-    cur.execute(sql, params)
+    execute_prepared(cur, "venta_item", params)
     row = cur.fetchone()
     if not row:
         raise Exception(f"Stock insuficiente para '{it['nombre']}' (id {it['producto_id']}).")
@@ -301,17 +303,14 @@ with tab_nueva:
             mostrar_recibo_interactivo(st.session_state['ultima_venta']['venta'], 
                                       st.session_state['ultima_venta']['items'])
         else:
-            # Consultar socios y productos (con filtro activo y stock > 0 para mejor UX)
-            socios = query("SELECT id, nombre FROM socio ORDER BY id DESC LIMIT 300")
+            # Productos activos con stock > 0 para mejor UX; el socio se busca en el servidor
             # CAMBIO: Filtrar productos con stock > 0 para evitar confusión
-            prods = query("SELECT id, nombre, precio, stock FROM producto WHERE activo IS TRUE AND stock > 0 ORDER BY nombre")
+            prods = cached_query("SELECT id, nombre, precio, stock FROM producto WHERE activo IS TRUE AND stock > 0 ORDER BY nombre")
 
-            if not socios:
-                st.warning("Necesitas al menos 1 socio registrado.")
-            elif not prods:
+            if not prods:
                 st.warning("No hay productos activos con stock disponible.")
             else:
-                socio = st.selectbox("Socio", socios, format_func=lambda s: f"{s['id']} - {s['nombre']}")
+                socio = socio_picker("Socio", key="venta_socio")
 
                 st.markdown("### Ítems")
                 # Inicializar carrito en session_state
@@ -395,7 +394,7 @@ with tab_nueva:
                     # Controles de venta
                     col_confirmar, col_limpiar, col_fecha = st.columns([1,1,2])
                     with col_confirmar:
-                        confirmar = st.button("💾 Confirmar venta", type="primary")
+                        confirmar = st.button("💾 Confirmar venta", type="primary", disabled=socio is None)
                     with col_limpiar:
                         limpiar = st.button("🧹 Limpiar carrito")
                     with col_fecha:
@@ -432,6 +431,7 @@ with tab_nueva:
                                     RETURNING total
                                 """, (venta_id,))
                                 total_final = cur.fetchone()["total"]
+                            audit("crear_venta", "venta", venta_id, {"socio_id": socio["id"], "total": total_final, "items": len(items)})
 
                             # 4) Obtener datos para el recibo
                             venta_completa = query("""
@@ -581,7 +581,8 @@ with tab_listado:
                                 # 2) Eliminar registros
                                 cur.execute("DELETE FROM venta_item WHERE venta_id = %s", (sel["id"],))
                                 cur.execute("DELETE FROM venta WHERE id = %s", (sel["id"],))
-                                
+                            audit("anular_venta", "venta", sel["id"], {"total": sel["total"]})
+
                             st.success(f"✅ Venta #{sel['id']} anulada correctamente. Stock devuelto.")
                             st.rerun()
                             
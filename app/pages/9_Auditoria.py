@@ -1,7 +1,7 @@
 import streamlit as st
 from datetime import date, timedelta
 from app.lib.auth import require_perm
-from app.lib.db import query
+from app.lib.pagination import paginar
 from app.lib.ui import load_base_css
 
 st.set_page_config(page_title="Auditoría", page_icon="📑", layout="wide")
@@ -20,14 +20,12 @@ with c3:
 with c4:
     tabla = st.text_input("Tabla (contiene)")
 
-limit = st.selectbox("Límite", [50, 100, 200, 500], index=1)
-
 sql = """
 SELECT id, fecha, actor, accion, tabla, detalle
 FROM auditoria_v
-WHERE fecha::date BETWEEN %s AND %s
+WHERE fecha >= %s AND fecha < %s
 """
-params = [desde, hasta]
+params = [desde, hasta + timedelta(days=1)]
 
 if actor.strip():
     sql += " AND actor ILIKE %s"
@@ -36,8 +34,5 @@ if tabla.strip():
     sql += " AND tabla ILIKE %s"
     params.append(f"%{tabla}%")
 
-sql += " ORDER BY fecha DESC, id DESC LIMIT %s"
-params.append(limit)
-
-rows = query(sql, tuple(params))
-st.dataframe(rows, use_container_width=True)
+df = paginar("auditoria", sql, tuple(params), claves=("fecha", "id"))
+st.dataframe(df, use_container_width=True)
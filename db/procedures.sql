@@ -58,22 +58,102 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- Reservar clase (valida capacidad)
+-- Reservar clase. El cupo se toma con un UPDATE condicional sobre clase.reservadas
+-- (sin contar reservas); si no queda, la reserva va a lista de espera (WAITLIST, 202).
 CREATE OR REPLACE FUNCTION sp_reservar_clase(p_socio_id BIGINT, p_clase_id BIGINT)
 RETURNS TABLE(status TEXT, code INT, message TEXT, reserva_id BIGINT) AS $$
-DECLARE v_cap INT; v_tomadas INT; v_id BIGINT;
+DECLARE v_estado TEXT := 'confirmada'; v_libres INT; v_id BIGINT;
 BEGIN
-  SELECT capacidad INTO v_cap FROM clase WHERE id = p_clase_id AND estado='programada';
-  IF v_cap IS NULL THEN
-    status := 'ERROR'; code := 404; message := 'Clase no disponible'; reserva_id := NULL; RETURN;
+  IF EXISTS (SELECT 1 FROM reserva r WHERE r.clase_id = p_clase_id AND r.socio_id = p_socio_id
+             AND r.estado <> 'cancelada') THEN
+    status := 'ERROR'; code := 409; message := 'Ya tiene reserva'; RETURN NEXT; RETURN;
   END IF;
-  SELECT COUNT(*) INTO v_tomadas FROM reserva WHERE clase_id = p_clase_id AND estado='confirmada';
-  IF v_tomadas >= v_cap THEN
-    status := 'ERROR'; code := 409; message := 'Cupo lleno'; reserva_id := NULL; RETURN;
+
+  UPDATE clase SET reservadas = reservadas + 1
+   WHERE id = p_clase_id AND estado = 'programada' AND reservadas < capacidad;
+  IF NOT FOUND THEN
+    -- llena (o no existe): se bloquea la clase para no encolar justo tras una cancelación
+    SELECT capacidad - reservadas INTO v_libres FROM clase
+     WHERE id = p_clase_id AND estado = 'programada' FOR UPDATE;
+    IF v_libres IS NULL THEN
+      status := 'ERROR'; code := 404; message := 'Clase no disponible'; RETURN NEXT; RETURN;
+    ELSIF v_libres > 0 THEN
+      UPDATE clase SET reservadas = reservadas + 1 WHERE id = p_clase_id;
+    ELSE
+      v_estado := 'waitlist';
+    END IF;
   END IF;
-  INSERT INTO reserva(clase_id, socio_id, estado) VALUES (p_clase_id, p_socio_id, 'confirmada')
+
+  -- una reserva cancelada del mismo socio se reutiliza (UNIQUE clase_id, socio_id)
+  INSERT INTO reserva(clase_id, socio_id, estado) VALUES (p_clase_id, p_socio_id, v_estado)
+  ON CONFLICT (clase_id, socio_id) DO UPDATE SET estado = EXCLUDED.estado, fecha_reserva = now()
+    WHERE reserva.estado = 'cancelada'
   RETURNING id INTO v_id;
-  status := 'OK'; code := 0; message := 'Reserva confirmada'; reserva_id := v_id; RETURN;
+  IF v_id IS NULL THEN  -- otra petición del mismo socio llegó antes
+    IF v_estado = 'confirmada' THEN
+      UPDATE clase SET reservadas = reservadas - 1 WHERE id = p_clase_id;
+    END IF;
+    status := 'ERROR'; code := 409; message := 'Ya tiene reserva'; RETURN NEXT; RETURN;
+  END IF;
+
+  IF v_estado = 'waitlist' THEN
+    status := 'WAITLIST'; code := 202; reserva_id := v_id;
+    message := 'Cupo lleno: en lista de espera (puesto '
+      || (SELECT COUNT(*) FROM reserva w WHERE w.clase_id = p_clase_id AND w.estado = 'waitlist'
+            AND (w.fecha_reserva, w.id) <= (SELECT x.fecha_reserva, x.id FROM reserva x WHERE x.id = v_id)) || ')';
+  ELSE
+    status := 'OK'; code := 0; message := 'Reserva confirmada'; reserva_id := v_id;
+  END IF;
+  RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Pasa a confirmada la lista de espera (orden de llegada) mientras haya cupo.
+-- Se usa al cancelar y cuando sube la capacidad; devuelve las reservas promovidas.
+CREATE OR REPLACE FUNCTION sp_promover_waitlist(p_clase_id BIGINT)
+RETURNS TABLE(reserva_id BIGINT, socio_id BIGINT) AS $$
+#variable_conflict use_column
+DECLARE v_libres INT;
+BEGIN
+  SELECT capacidad - reservadas INTO v_libres FROM clase
+   WHERE id = p_clase_id AND estado = 'programada' FOR UPDATE;
+  IF v_libres IS NULL OR v_libres <= 0 THEN
+    RETURN;
+  END IF;
+  RETURN QUERY
+  WITH prom AS (
+    UPDATE reserva r SET estado = 'confirmada'
+    WHERE r.id IN (SELECT w.id FROM reserva w WHERE w.clase_id = p_clase_id AND w.estado = 'waitlist'
+                   ORDER BY w.fecha_reserva, w.id LIMIT v_libres)
+    RETURNING r.id, r.socio_id
+  ), cnt AS (
+    UPDATE clase SET reservadas = reservadas + (SELECT COUNT(*) FROM prom) WHERE id = p_clase_id
+  )
+  SELECT id, socio_id FROM prom;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cancelar reserva: libera el cupo y lo pasa al primero de la lista de espera
+CREATE OR REPLACE FUNCTION sp_cancelar_reserva(p_reserva_id BIGINT)
+RETURNS TABLE(status TEXT, code INT, message TEXT, promovida_id BIGINT) AS $$
+DECLARE v_clase BIGINT; v_estado TEXT;
+BEGIN
+  SELECT r.clase_id INTO v_clase FROM reserva r WHERE r.id = p_reserva_id;
+  -- mismo orden de bloqueo que reservar: primero la clase, luego la reserva
+  PERFORM 1 FROM clase WHERE id = v_clase FOR UPDATE;
+  SELECT r.estado INTO v_estado FROM reserva r WHERE r.id = p_reserva_id FOR UPDATE;
+  IF v_estado IS NULL OR v_estado NOT IN ('confirmada', 'waitlist') THEN
+    status := 'ERROR'; code := 404; message := 'Reserva no válida'; RETURN NEXT; RETURN;
+  END IF;
+  UPDATE reserva SET estado = 'cancelada' WHERE id = p_reserva_id;
+  IF v_estado = 'confirmada' THEN
+    UPDATE clase SET reservadas = reservadas - 1 WHERE id = v_clase;
+    SELECT w.reserva_id INTO promovida_id FROM sp_promover_waitlist(v_clase) w LIMIT 1;
+  END IF;
+  status := 'OK'; code := 0;
+  message := CASE WHEN promovida_id IS NULL THEN 'Reserva cancelada'
+                  ELSE 'Reserva cancelada; cupo asignado a la reserva ' || promovida_id END;
+  RETURN NEXT;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -83,24 +163,24 @@ RETURNS TABLE(status TEXT, code INT, message TEXT) AS $$
 BEGIN
   UPDATE reserva SET estado='asistio' WHERE id = p_reserva_id AND estado='confirmada';
   IF NOT FOUND THEN
-    status := 'ERROR'; code := 404; message := 'Reserva no válida'; RETURN;
+    status := 'ERROR'; code := 404; message := 'Reserva no válida'; RETURN NEXT; RETURN;
   END IF;
-  status := 'OK'; code := 0; message := 'Asistencia registrada'; RETURN;
+  status := 'OK'; code := 0; message := 'Asistencia registrada'; RETURN NEXT;
 END;
 $$ LANGUAGE plpgsql;
 
--- Registrar acceso (aforo)
+-- Registrar acceso (aforo). La vigencia se lee de socio.acceso_valido_hasta (por PK),
+-- no de membresia: no depende de cuántas membresías acumuló el socio.
 CREATE OR REPLACE FUNCTION sp_registrar_acceso(p_socio_id BIGINT, p_sede_id BIGINT)
 RETURNS TABLE(status TEXT, code INT, message TEXT, acceso_id BIGINT) AS $$
-DECLARE v_activo INT; v_id BIGINT;
+DECLARE v_hasta DATE; v_id BIGINT;
 BEGIN
-  SELECT COUNT(*) INTO v_activo FROM membresia
-    WHERE socio_id = p_socio_id AND estado='activa' AND fecha_fin >= CURRENT_DATE;
-  IF v_activo = 0 THEN
-    status := 'ERROR'; code := 403; message := 'Membresía no activa'; acceso_id := NULL; RETURN;
+  SELECT acceso_valido_hasta INTO v_hasta FROM socio WHERE id = p_socio_id;
+  IF v_hasta IS NULL OR v_hasta < CURRENT_DATE THEN
+    status := 'ERROR'; code := 403; message := 'Membresía no activa'; acceso_id := NULL; RETURN NEXT; RETURN;
   END IF;
   INSERT INTO acceso(socio_id, sede_id) VALUES (p_socio_id, p_sede_id) RETURNING id INTO v_id;
-  status := 'OK'; code := 0; message := 'Acceso registrado'; acceso_id := v_id; RETURN;
+  status := 'OK'; code := 0; message := 'Acceso registrado'; acceso_id := v_id; RETURN NEXT;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -110,29 +190,932 @@ RETURNS TABLE(status TEXT, code INT, message TEXT) AS $$
 BEGIN
   UPDATE acceso SET fecha_salida = now() WHERE id = p_acceso_id AND fecha_salida IS NULL;
   IF NOT FOUND THEN
-    status := 'ERROR'; code := 404; message := 'Acceso no encontrado/ya cerrado'; RETURN;
+    status := 'ERROR'; code := 404; message := 'Acceso no encontrado/ya cerrado'; RETURN NEXT; RETURN;
   END IF;
-  status := 'OK'; code := 0; message := 'Salida registrada'; RETURN;
+  status := 'OK'; code := 0; message := 'Salida registrada'; RETURN NEXT;
 END;
 $$ LANGUAGE plpgsql;
 
--- Aforo actual por sede
+-- Aforo actual por sede (contador sede_aforo, O(1))
 CREATE OR REPLACE FUNCTION sp_aforo_actual(p_sede_id BIGINT)
 RETURNS INT AS $$
 DECLARE v_aforo INT;
 BEGIN
-  SELECT COUNT(*) INTO v_aforo FROM acceso WHERE sede_id = p_sede_id AND fecha_salida IS NULL;
-  RETURN v_aforo;
+  SELECT dentro INTO v_aforo FROM sede_aforo WHERE sede_id = p_sede_id;
+  RETURN COALESCE(v_aforo, 0);
 END;
-$$ LANGUAGE plpgsql;
+$$ LANGUAGE plpgsql STABLE;
 
--- KPIs simples (socios, membresías activas, accesos hoy)
-CREATE OR REPLACE FUNCTION sp_kpis()
+-- KPIs (socios, membresías activas, accesos hoy) leídos de kpi_snapshot; el día se mira sin
+-- bloquear y solo si cambió se pasa por sp_kpis_refrescar.
+-- Con p_sede_id, accesos_hoy es el de esa sede; socios y membresías son globales.
+DROP FUNCTION IF EXISTS sp_kpis();
+CREATE OR REPLACE FUNCTION sp_kpis(p_sede_id BIGINT DEFAULT NULL)
 RETURNS TABLE(socios INT, membresias_activas INT, accesos_hoy INT) AS $$
+#variable_conflict use_column
+DECLARE v_dia DATE;
+BEGIN
+  SELECT dia INTO v_dia FROM kpi_snapshot WHERE sede_id = 0;
+  IF v_dia IS DISTINCT FROM CURRENT_DATE THEN
+    IF pg_is_in_recovery() THEN
+      -- réplica: no se puede refrescar, se cuenta al vuelo
+      socios := (SELECT COUNT(*) FROM socio);
+      membresias_activas := (SELECT COUNT(*) FROM membresia WHERE estado='activa' AND fecha_fin >= CURRENT_DATE);
+      accesos_hoy := (SELECT COUNT(*) FROM acceso
+                      WHERE fecha_entrada >= CURRENT_DATE AND fecha_entrada < CURRENT_DATE + 1
+                        AND (p_sede_id IS NULL OR sede_id = p_sede_id));
+      RETURN NEXT;
+      RETURN;
+    END IF;
+    PERFORM sp_kpis_refrescar(FALSE);  -- primer uso del día (solo una sesión recalcula)
+  END IF;
+  RETURN QUERY
+  SELECT SUM(k.socios) FILTER (WHERE k.sede_id <= 0)::int,
+         SUM(k.membresias_activas) FILTER (WHERE k.sede_id <= 0)::int,
+         COALESCE(SUM(k.accesos_hoy) FILTER (WHERE k.sede_id > 0 AND (p_sede_id IS NULL OR k.sede_id = p_sede_id)), 0)::int
+  FROM kpi_snapshot k;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Dashboard de Home en una llamada. Fila total (sede_id NULL) y una fila por sede.
+-- Con p_sede_id, el total se limita a esa sede en lo que tiene sede (accesos, aforo, clases);
+-- socios, membresías, ventas y vencimientos son globales y en las filas de sede van NULL.
+-- Fechas con rangos [hoy, mañana) para que usen ix_acceso_entrada, ix_venta_fecha e ix_clase_fecha.
+CREATE OR REPLACE FUNCTION sp_dashboard(p_sede_id BIGINT DEFAULT NULL)
+RETURNS TABLE(sede_id BIGINT, sede TEXT, socios INT, membresias_activas INT, accesos_hoy INT,
+              aforo_actual INT, ventas_hoy NUMERIC, clases_hoy INT, vencen_7d INT) AS $$
+#variable_conflict use_column
+DECLARE g RECORD;
+BEGIN
+  SELECT * INTO g FROM sp_kpis();  -- deja kpi_snapshot al día
+  RETURN QUERY
+  WITH s AS (
+    SELECT s.id, s.nombre,
+           CASE WHEN k.dia = CURRENT_DATE THEN k.accesos_hoy ELSE 0 END AS accesos_hoy,
+           COALESCE(a.dentro, 0) AS aforo,
+           (SELECT COUNT(*) FROM clase c
+             WHERE c.sede_id = s.id AND c.estado = 'programada'
+               AND c.fecha_hora >= CURRENT_DATE AND c.fecha_hora < CURRENT_DATE + 1)::int AS clases
+    FROM sede s
+    LEFT JOIN kpi_snapshot k ON k.sede_id = s.id
+    LEFT JOIN sede_aforo a ON a.sede_id = s.id
+    WHERE p_sede_id IS NULL OR s.id = p_sede_id
+  )
+  SELECT NULL::bigint, 'Total'::text, g.socios, g.membresias_activas,
+         CASE WHEN p_sede_id IS NULL THEN g.accesos_hoy ELSE (SELECT SUM(accesos_hoy) FROM s)::int END,
+         (SELECT SUM(aforo) FROM s)::int,
+         (SELECT COALESCE(SUM(v.total), 0) FROM venta v
+           WHERE v.fecha >= CURRENT_DATE AND v.fecha < CURRENT_DATE + 1)::numeric(10,2),
+         (SELECT SUM(clases) FROM s)::int,
+         (SELECT COUNT(*) FROM membresia m
+           WHERE m.estado = 'activa' AND m.fecha_fin BETWEEN CURRENT_DATE AND CURRENT_DATE + 7)::int
+  UNION ALL
+  SELECT id, nombre, NULL, NULL, accesos_hoy, aforo, NULL, clases, NULL FROM (SELECT * FROM s ORDER BY nombre) o;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Búsqueda de socios ordenada por relevancia.
+-- DNI exacto: devuelve solo ese socio (ux_socio_dni). Si no, combina prefijo de nombre
+-- (más peso), prefijo de dni/email/teléfono, full-text con cada palabra como prefijo y,
+-- si pg_trgm está instalada, subcadena y similitud (tolera errores de tipeo).
+CREATE OR REPLACE FUNCTION sp_buscar_socio(p_q TEXT, p_limite INT DEFAULT 20)
+RETURNS TABLE(id BIGINT, dni TEXT, nombre TEXT, email TEXT, telefono TEXT, estado TEXT,
+              fecha_alta DATE, rank REAL) AS $$
+DECLARE
+  v_q TEXT := btrim(coalesce(p_q, ''));
+  v_like TEXT;
+  v_ts tsquery;
+  v_trgm BOOLEAN := EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm');
+BEGIN
+  IF v_q = '' THEN
+    RETURN;
+  END IF;
+
+  RETURN QUERY
+  SELECT s.id, s.dni, s.nombre, s.email, s.telefono, s.estado, s.fecha_alta, 100::real
+  FROM socio s WHERE s.dni = v_q;
+  IF FOUND THEN
+    RETURN;
+  END IF;
+
+  v_like := replace(replace(replace(v_q, '\', '\\'), '%', '\%'), '_', '\_');
+  SELECT to_tsquery('simple', string_agg(quote_literal(w) || ':*', ' & '))
+    INTO v_ts FROM regexp_split_to_table(lower(v_q), '[^[:alnum:]]+') AS w WHERE w <> '';
+  -- sin palabras (p. ej. "@" o "-") v_ts es NULL: se omite la parte full-text, si no el rank
+  -- sería NULL para todos
+
+  RETURN QUERY EXECUTE format($sql$
+    SELECT s.id, s.dni, s.nombre, s.email, s.telefono, s.estado, s.fecha_alta,
+           ( CASE WHEN lower(s.nombre) LIKE $2 THEN 3 ELSE 0 END
+           + CASE WHEN s.dni LIKE $3 OR lower(s.email) LIKE $2 OR s.telefono LIKE $3 THEN 2 ELSE 0 END
+           %s
+           %s )::real AS rank
+    FROM socio s
+    WHERE %s lower(s.nombre) LIKE $2 OR lower(s.email) LIKE $2
+       OR s.dni LIKE $3 OR s.telefono LIKE $3
+       %s
+    ORDER BY rank DESC, s.nombre
+    LIMIT $4
+  $sql$,
+    CASE WHEN v_ts IS NOT NULL THEN '+ ts_rank(s.busqueda, $1)' ELSE '' END,
+    CASE WHEN v_trgm THEN '+ similarity(s.nombre, $5)' ELSE '' END,
+    CASE WHEN v_ts IS NOT NULL THEN 's.busqueda @@ $1 OR' ELSE '' END,
+    CASE WHEN v_trgm THEN 'OR s.nombre ILIKE $6 OR s.email ILIKE $6 OR s.nombre % $5' ELSE '' END)
+  USING v_ts, lower(v_like) || '%', v_like || '%', p_limite, v_q, '%' || v_like || '%';
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Perfil 360 de un socio en un solo viaje: membresía vigente (o la última), últimos
+-- p_n pagos y compras, estadísticas de visitas y próximas reservas. NULL si no existe.
+-- La app lo cachea por socio; lo invalidan los avisos 'socio:<id>' de fn_notificar_socio.
+-- Si está dentro del gimnasio no va aquí: cambia con cada salida y la app lo lee aparte.
+CREATE OR REPLACE FUNCTION sp_socio_360(p_socio_id BIGINT, p_n INT DEFAULT 10)
+RETURNS JSONB AS $$
+  SELECT jsonb_build_object(
+    'socio', to_jsonb(s) - 'busqueda',
+    'membresia', (
+      SELECT to_jsonb(x) FROM (
+        SELECT m.id, p.nombre AS plan, m.fecha_inicio, m.fecha_fin, m.estado,
+               m.fecha_fin - current_date AS dias_restantes
+        FROM membresia m JOIN membresia_plan p ON p.id = m.plan_id
+        WHERE m.socio_id = s.id
+        ORDER BY (m.estado = 'activa' AND current_date BETWEEN m.fecha_inicio AND m.fecha_fin) DESC,
+                 m.fecha_fin DESC, m.id DESC
+        LIMIT 1) x),
+    'pagos', COALESCE((
+      SELECT jsonb_agg(to_jsonb(x) ORDER BY x.fecha DESC, x.id DESC) FROM (
+        SELECT id, fecha, concepto, medio, monto FROM pago
+        WHERE socio_id = s.id ORDER BY fecha DESC, id DESC LIMIT p_n) x), '[]'),
+    'total_pagado', (SELECT COALESCE(SUM(monto), 0) FROM pago WHERE socio_id = s.id),
+    'visitas', (
+      SELECT jsonb_build_object(
+        'ultima', (SELECT MAX(fecha_entrada) FROM acceso WHERE socio_id = s.id),
+        'dias_30', COUNT(*) FILTER (WHERE a.fecha_entrada >= now() - interval '30 days'),
+        'dias_90', COUNT(*))
+      FROM acceso a WHERE a.socio_id = s.id AND a.fecha_entrada >= now() - interval '90 days'),
+    'reservas', COALESCE((
+      SELECT jsonb_agg(to_jsonb(x) ORDER BY x.fecha_hora, x.id) FROM (
+        SELECT r.id, c.nombre AS clase, se.nombre AS sede, c.fecha_hora, r.estado
+        FROM reserva r
+        JOIN clase c ON c.id = r.clase_id
+        JOIN sede se ON se.id = c.sede_id
+        WHERE r.socio_id = s.id AND r.estado IN ('confirmada', 'waitlist')
+          AND c.estado = 'programada' AND c.fecha_hora >= now()
+        ORDER BY c.fecha_hora, r.id LIMIT p_n) x), '[]'),
+    'compras', COALESCE((
+      SELECT jsonb_agg(to_jsonb(x) ORDER BY x.fecha DESC, x.id DESC) FROM (
+        SELECT v.id, v.fecha, v.total,
+               (SELECT COALESCE(SUM(i.cantidad), 0) FROM venta_item i WHERE i.venta_id = v.id) AS items
+        FROM venta v WHERE v.socio_id = s.id ORDER BY v.fecha DESC, v.id DESC LIMIT p_n) x), '[]')
+  )
+  FROM socio s WHERE s.id = p_socio_id;
+$$ LANGUAGE sql STABLE;
+
+-- ===== Contador de aforo (sede_aforo) =====
+-- Triggers por sentencia con tablas de transición: un lote de N accesos hace un solo
+-- UPSERT por sede. Suma los accesos abiertos (fecha_salida IS NULL) que entran y
+-- resta los que se cierran o borran. Publica las sedes cambiadas en el canal
+-- 'acceso_cambio' (payload "1,3"; "*" = todas).
+CREATE OR REPLACE FUNCTION fn_aforo_aplicar(p_delta JSONB)
+RETURNS VOID AS $$
+  INSERT INTO sede_aforo AS a (sede_id, dentro)
+  SELECT key::bigint, value::int FROM jsonb_each_text(p_delta) WHERE value::int <> 0
+  ON CONFLICT (sede_id) DO UPDATE SET dentro = a.dentro + EXCLUDED.dentro, actualizado = now();
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION fn_aforo_acceso()
+RETURNS trigger AS $$
+DECLARE v_delta JSONB;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT jsonb_object_agg(sede_id, n) INTO v_delta
+    FROM (SELECT sede_id, COUNT(*) AS n FROM nuevos WHERE fecha_salida IS NULL GROUP BY sede_id) x;
+  ELSIF TG_OP = 'UPDATE' THEN
+    SELECT jsonb_object_agg(sede_id, n) INTO v_delta
+    FROM (SELECT sede_id, SUM(d) AS n FROM (
+            SELECT sede_id, 1 AS d FROM nuevos WHERE fecha_salida IS NULL
+            UNION ALL
+            SELECT sede_id, -1 FROM viejos WHERE fecha_salida IS NULL) u
+          GROUP BY sede_id) x;
+  ELSE
+    SELECT jsonb_object_agg(sede_id, -n) INTO v_delta
+    FROM (SELECT sede_id, COUNT(*) AS n FROM viejos WHERE fecha_salida IS NULL GROUP BY sede_id) x;
+  END IF;
+  IF v_delta IS NOT NULL THEN
+    PERFORM fn_aforo_aplicar(v_delta);
+    -- sedes afectadas, para los paneles en vivo (app/lib/live.py); llega al hacer commit
+    PERFORM pg_notify('acceso_cambio', string_agg(key, ',')) FROM jsonb_each_text(v_delta) WHERE value::int <> 0
+      HAVING COUNT(*) > 0;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION fn_aforo_truncate()
+RETURNS trigger AS $$
+BEGIN
+  UPDATE sede_aforo SET dentro = 0, actualizado = now();
+  PERFORM pg_notify('acceso_cambio', '*');
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_acceso_aforo_ins ON acceso;
+CREATE TRIGGER trg_acceso_aforo_ins AFTER INSERT ON acceso
+  REFERENCING NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION fn_aforo_acceso();
+DROP TRIGGER IF EXISTS trg_acceso_aforo_upd ON acceso;
+CREATE TRIGGER trg_acceso_aforo_upd AFTER UPDATE ON acceso
+  REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION fn_aforo_acceso();
+DROP TRIGGER IF EXISTS trg_acceso_aforo_del ON acceso;
+CREATE TRIGGER trg_acceso_aforo_del AFTER DELETE ON acceso
+  REFERENCING OLD TABLE AS viejos FOR EACH STATEMENT EXECUTE FUNCTION fn_aforo_acceso();
+DROP TRIGGER IF EXISTS trg_acceso_aforo_trunc ON acceso;
+CREATE TRIGGER trg_acceso_aforo_trunc AFTER TRUNCATE ON acceso
+  FOR EACH STATEMENT EXECUTE FUNCTION fn_aforo_truncate();
+
+-- Reconciliación: recalcula desde acceso y reporta la deriva (p_corregir=false solo reporta).
+-- Bloquea sede_aforo para que ningún acceso concurrente cambie el contador mientras se cuenta.
+CREATE OR REPLACE FUNCTION sp_reconciliar_aforo(p_corregir BOOLEAN DEFAULT TRUE)
+RETURNS TABLE(sede_id BIGINT, contador INT, calculado INT, deriva INT) AS $$
+#variable_conflict use_column
+BEGIN
+  LOCK TABLE sede_aforo IN SHARE ROW EXCLUSIVE MODE;
+  CREATE TEMP TABLE IF NOT EXISTS tmp_aforo (sede_id BIGINT, contador INT, calculado INT) ON COMMIT DROP;
+  TRUNCATE tmp_aforo;
+  INSERT INTO tmp_aforo
+  SELECT s.id, COALESCE(a.dentro, 0),
+         (SELECT COUNT(*) FROM acceso x WHERE x.sede_id = s.id AND x.fecha_salida IS NULL)
+  FROM sede s LEFT JOIN sede_aforo a ON a.sede_id = s.id;
+  IF p_corregir THEN
+    INSERT INTO sede_aforo AS a (sede_id, dentro)
+    SELECT t.sede_id, t.calculado FROM tmp_aforo t WHERE t.calculado <> t.contador
+       OR NOT EXISTS (SELECT 1 FROM sede_aforo z WHERE z.sede_id = t.sede_id)
+    ON CONFLICT (sede_id) DO UPDATE SET dentro = EXCLUDED.dentro, actualizado = now();
+  END IF;
+  RETURN QUERY SELECT t.sede_id, t.contador, t.calculado, t.calculado - t.contador FROM tmp_aforo t ORDER BY t.sede_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Inicializa los contadores con lo que haya abierto al instalar
+SELECT * FROM sp_reconciliar_aforo();
+
+-- ===== KPIs incrementales (kpi_snapshot) =====
+-- Fila global (sede_id 0): socios y membresías activas al recalcular. Los incrementos de socio y
+-- membresía van a filas de reparto (sede_id -1..-8, según el backend) y el valor es la suma de la
+-- fila 0 y las de reparto: así las altas concurrentes no hacen fila por el lock de una misma fila.
+-- Filas por sede: accesos de hoy (el total es su suma, así un acceso solo toca la fila de su sede).
+-- Los triggers aplican el incremento con x = x + n, sin bloquear antes nada más. Si la foto es de
+-- otro día no aplican nada: la primera lectura del día (o el job) la recalcula entera.
+-- Coordinación con el recálculo: los triggers toman un advisory lock compartido (no se estorban
+-- entre sí) y sp_kpis_refrescar lo toma exclusivo, así espera a las escrituras en curso y ningún
+-- incremento queda fuera de la foto ni se cuenta dos veces.
+
+-- Recalcula desde las tablas base con rangos indexables. Devuelve la fila global (con el total
+-- de accesos). p_forzar=FALSE: solo si la foto es de otro día, comprobado de nuevo con el lock
+-- tomado, así de las sesiones que llegan a medianoche solo la primera recalcula.
+DROP FUNCTION IF EXISTS sp_kpis_refrescar();
+CREATE OR REPLACE FUNCTION sp_kpis_refrescar(p_forzar BOOLEAN DEFAULT TRUE)
+RETURNS SETOF kpi_snapshot AS $$
+BEGIN
+  PERFORM pg_advisory_xact_lock('kpi_snapshot'::regclass::oid::bigint);
+  INSERT INTO kpi_snapshot (sede_id, dia) VALUES (0, '-infinity') ON CONFLICT (sede_id) DO NOTHING;
+  IF p_forzar OR (SELECT dia FROM kpi_snapshot WHERE sede_id = 0) IS DISTINCT FROM CURRENT_DATE THEN
+    INSERT INTO kpi_snapshot AS k (sede_id, dia, socios, membresias_activas, accesos_hoy)
+    SELECT 0, CURRENT_DATE,
+           (SELECT COUNT(*) FROM socio),
+           (SELECT COUNT(*) FROM membresia WHERE estado='activa' AND fecha_fin >= CURRENT_DATE),
+           0
+    UNION ALL
+    SELECT s.id, CURRENT_DATE, 0, 0, COALESCE(a.n, 0)
+    FROM sede s
+    LEFT JOIN (SELECT sede_id, COUNT(*) AS n FROM acceso
+               WHERE fecha_entrada >= CURRENT_DATE AND fecha_entrada < CURRENT_DATE + 1
+               GROUP BY sede_id) a ON a.sede_id = s.id
+    ON CONFLICT (sede_id) DO UPDATE
+      SET dia = EXCLUDED.dia, socios = EXCLUDED.socios, membresias_activas = EXCLUDED.membresias_activas,
+          accesos_hoy = EXCLUDED.accesos_hoy, actualizado = now();
+    -- las filas de reparto ya están contadas en la 0
+    DELETE FROM kpi_snapshot k
+    WHERE k.sede_id < 0 OR (k.sede_id > 0 AND NOT EXISTS (SELECT 1 FROM sede s WHERE s.id = k.sede_id));
+  END IF;
+  RETURN QUERY
+  SELECT g.sede_id, g.dia,
+         (SELECT SUM(k.socios) FROM kpi_snapshot k WHERE k.sede_id <= 0)::int,
+         (SELECT SUM(k.membresias_activas) FROM kpi_snapshot k WHERE k.sede_id <= 0)::int,
+         (SELECT COALESCE(SUM(k.accesos_hoy), 0)::int FROM kpi_snapshot k WHERE k.sede_id > 0),
+         g.actualizado
+  FROM kpi_snapshot g WHERE g.sede_id = 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Para los triggers: TRUE si la foto es de hoy y hay que aplicar el incremento. Sin bloqueo de filas.
+CREATE OR REPLACE FUNCTION fn_kpi_al_dia()
+RETURNS BOOLEAN AS $$
+BEGIN
+  PERFORM pg_advisory_xact_lock_shared('kpi_snapshot'::regclass::oid::bigint);
+  RETURN COALESCE((SELECT dia FROM kpi_snapshot WHERE sede_id = 0) = CURRENT_DATE, FALSE);
+END;
+$$ LANGUAGE plpgsql;
+
+-- TRUNCATE: se marca la foto como vieja y la siguiente lectura la recalcula.
+CREATE OR REPLACE FUNCTION fn_kpi_invalidar()
+RETURNS VOID AS $$
 BEGIN
-  socios := (SELECT COUNT(*) FROM socio);
-  membresias_activas := (SELECT COUNT(*) FROM membresia WHERE estado='activa' AND fecha_fin >= CURRENT_DATE);
-  accesos_hoy := (SELECT COUNT(*) FROM acceso WHERE fecha_entrada::date = CURRENT_DATE);
+  PERFORM pg_advisory_xact_lock_shared('kpi_snapshot'::regclass::oid::bigint);
+  UPDATE kpi_snapshot SET dia = '-infinity' WHERE sede_id = 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Suma el incremento en la fila de reparto del backend (ver arriba).
+CREATE OR REPLACE FUNCTION fn_kpi_sumar(p_socios INT, p_membresias INT)
+RETURNS VOID AS $$
+BEGIN
+  INSERT INTO kpi_snapshot AS k (sede_id, socios, membresias_activas)
+  VALUES (-1 - pg_backend_pid() % 8, p_socios, p_membresias)
+  ON CONFLICT (sede_id) DO UPDATE
+    SET socios = k.socios + EXCLUDED.socios,
+        membresias_activas = k.membresias_activas + EXCLUDED.membresias_activas, actualizado = now();
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION fn_kpi_socio()
+RETURNS trigger AS $$
+DECLARE v_n INT;
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    PERFORM fn_kpi_invalidar();
+    RETURN NULL;
+  ELSIF NOT fn_kpi_al_dia() THEN
+    RETURN NULL;
+  END IF;
+  IF TG_OP = 'INSERT' THEN
+    SELECT COUNT(*) INTO v_n FROM nuevos;
+  ELSE
+    SELECT -COUNT(*) INTO v_n FROM viejos;
+  END IF;
+  IF v_n <> 0 THEN
+    PERFORM fn_kpi_sumar(v_n, 0);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION fn_kpi_membresia()
+RETURNS trigger AS $$
+DECLARE v_n INT := 0;
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    PERFORM fn_kpi_invalidar();
+    RETURN NULL;
+  ELSIF NOT fn_kpi_al_dia() THEN
+    RETURN NULL;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    v_n := v_n + (SELECT COUNT(*) FROM nuevos WHERE estado='activa' AND fecha_fin >= CURRENT_DATE);
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    v_n := v_n - (SELECT COUNT(*) FROM viejos WHERE estado='activa' AND fecha_fin >= CURRENT_DATE);
+  END IF;
+  IF v_n <> 0 THEN
+    PERFORM fn_kpi_sumar(0, v_n);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION fn_kpi_acceso()
+RETURNS trigger AS $$
+DECLARE v_delta JSONB;
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    PERFORM fn_kpi_invalidar();
+    RETURN NULL;
+  ELSIF NOT fn_kpi_al_dia() THEN
+    RETURN NULL;
+  END IF;
+  -- accesos de hoy que entran (+) o salen (-) de la tabla, por sede
+  IF TG_OP = 'INSERT' THEN
+    SELECT jsonb_object_agg(sede_id, n) INTO v_delta
+    FROM (SELECT sede_id, COUNT(*) AS n FROM nuevos
+          WHERE fecha_entrada >= CURRENT_DATE AND fecha_entrada < CURRENT_DATE + 1 GROUP BY sede_id) x;
+  ELSIF TG_OP = 'UPDATE' THEN
+    SELECT jsonb_object_agg(sede_id, n) INTO v_delta
+    FROM (SELECT sede_id, SUM(d) AS n FROM (
+            SELECT sede_id, 1 AS d FROM nuevos
+            WHERE fecha_entrada >= CURRENT_DATE AND fecha_entrada < CURRENT_DATE + 1
+            UNION ALL
+            SELECT sede_id, -1 FROM viejos
+            WHERE fecha_entrada >= CURRENT_DATE AND fecha_entrada < CURRENT_DATE + 1) u
+          GROUP BY sede_id) x;
+  ELSE
+    SELECT jsonb_object_agg(sede_id, -n) INTO v_delta
+    FROM (SELECT sede_id, COUNT(*) AS n FROM viejos
+          WHERE fecha_entrada >= CURRENT_DATE AND fecha_entrada < CURRENT_DATE + 1 GROUP BY sede_id) x;
+  END IF;
+  IF v_delta IS NOT NULL THEN
+    INSERT INTO kpi_snapshot AS k (sede_id, accesos_hoy)
+    SELECT key::bigint, value::int FROM jsonb_each_text(v_delta) WHERE value::int <> 0
+    ON CONFLICT (sede_id) DO UPDATE SET accesos_hoy = k.accesos_hoy + EXCLUDED.accesos_hoy, actualizado = now();
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_socio_kpi_ins ON socio;
+CREATE TRIGGER trg_socio_kpi_ins AFTER INSERT ON socio
+  REFERENCING NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_socio();
+DROP TRIGGER IF EXISTS trg_socio_kpi_del ON socio;
+CREATE TRIGGER trg_socio_kpi_del AFTER DELETE ON socio
+  REFERENCING OLD TABLE AS viejos FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_socio();
+DROP TRIGGER IF EXISTS trg_socio_kpi_trunc ON socio;
+CREATE TRIGGER trg_socio_kpi_trunc AFTER TRUNCATE ON socio
+  FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_socio();
+
+DROP TRIGGER IF EXISTS trg_membresia_kpi_ins ON membresia;
+CREATE TRIGGER trg_membresia_kpi_ins AFTER INSERT ON membresia
+  REFERENCING NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_membresia();
+DROP TRIGGER IF EXISTS trg_membresia_kpi_upd ON membresia;
+CREATE TRIGGER trg_membresia_kpi_upd AFTER UPDATE ON membresia
+  REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_membresia();
+DROP TRIGGER IF EXISTS trg_membresia_kpi_del ON membresia;
+CREATE TRIGGER trg_membresia_kpi_del AFTER DELETE ON membresia
+  REFERENCING OLD TABLE AS viejos FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_membresia();
+DROP TRIGGER IF EXISTS trg_membresia_kpi_trunc ON membresia;
+CREATE TRIGGER trg_membresia_kpi_trunc AFTER TRUNCATE ON membresia
+  FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_membresia();
+
+DROP TRIGGER IF EXISTS trg_acceso_kpi_ins ON acceso;
+CREATE TRIGGER trg_acceso_kpi_ins AFTER INSERT ON acceso
+  REFERENCING NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_acceso();
+DROP TRIGGER IF EXISTS trg_acceso_kpi_upd ON acceso;
+CREATE TRIGGER trg_acceso_kpi_upd AFTER UPDATE ON acceso
+  REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_acceso();
+DROP TRIGGER IF EXISTS trg_acceso_kpi_del ON acceso;
+CREATE TRIGGER trg_acceso_kpi_del AFTER DELETE ON acceso
+  REFERENCING OLD TABLE AS viejos FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_acceso();
+DROP TRIGGER IF EXISTS trg_acceso_kpi_trunc ON acceso;
+CREATE TRIGGER trg_acceso_kpi_trunc AFTER TRUNCATE ON acceso
+  FOR EACH STATEMENT EXECUTE FUNCTION fn_kpi_acceso();
+
+SELECT * FROM sp_kpis_refrescar();
+
+-- ===== Vigencia de acceso (socio.acceso_valido_hasta) =====
+-- Se recalcula para los socios tocados por cada sentencia sobre membresia.
+CREATE OR REPLACE FUNCTION fn_socio_vigencia()
+RETURNS trigger AS $$
+DECLARE v_ids BIGINT[];
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT array_agg(DISTINCT socio_id) INTO v_ids FROM nuevos;
+  ELSIF TG_OP = 'UPDATE' THEN
+    SELECT array_agg(socio_id) INTO v_ids FROM (SELECT socio_id FROM nuevos UNION SELECT socio_id FROM viejos) x;
+  ELSE
+    SELECT array_agg(DISTINCT socio_id) INTO v_ids FROM viejos;
+  END IF;
+  UPDATE socio s SET acceso_valido_hasta = v.hasta
+  FROM (SELECT t.id, (SELECT MAX(m.fecha_fin) FROM membresia m WHERE m.socio_id = t.id AND m.estado = 'activa') AS hasta
+        FROM unnest(v_ids) AS t(id)) v
+  WHERE s.id = v.id AND s.acceso_valido_hasta IS DISTINCT FROM v.hasta;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_membresia_vigencia_ins ON membresia;
+CREATE TRIGGER trg_membresia_vigencia_ins AFTER INSERT ON membresia
+  REFERENCING NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION fn_socio_vigencia();
+DROP TRIGGER IF EXISTS trg_membresia_vigencia_upd ON membresia;
+CREATE TRIGGER trg_membresia_vigencia_upd AFTER UPDATE ON membresia
+  REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION fn_socio_vigencia();
+DROP TRIGGER IF EXISTS trg_membresia_vigencia_del ON membresia;
+CREATE TRIGGER trg_membresia_vigencia_del AFTER DELETE ON membresia
+  REFERENCING OLD TABLE AS viejos FOR EACH STATEMENT EXECUTE FUNCTION fn_socio_vigencia();
+
+-- Job nocturno: pasa a 'vencida' las membresías activas ya terminadas (usa ix_membresia_vigentes).
+-- Los triggers de arriba recalculan la vigencia de los socios afectados.
+CREATE OR REPLACE FUNCTION sp_expirar_membresias()
+RETURNS TABLE(vencidas INT, socios INT) AS $$
+BEGIN
+  WITH v AS (
+    UPDATE membresia SET estado = 'vencida'
+    WHERE estado = 'activa' AND fecha_fin < CURRENT_DATE
+    RETURNING socio_id
+  )
+  SELECT COUNT(*), COUNT(DISTINCT socio_id) INTO vencidas, socios FROM v;
   RETURN NEXT;
 END;
 $$ LANGUAGE plpgsql;
+
+-- Inicializa la vigencia con las membresías existentes
+UPDATE socio s SET acceso_valido_hasta = x.hasta
+FROM (SELECT s2.id, MAX(m.fecha_fin) FILTER (WHERE m.estado = 'activa') AS hasta
+      FROM socio s2 LEFT JOIN membresia m ON m.socio_id = s2.id GROUP BY s2.id) x
+WHERE s.id = x.id AND s.acceso_valido_hasta IS DISTINCT FROM x.hasta;
+
+-- ===== Versiones por lote (entrada JSONB, un resultado por elemento) =====
+-- idx = posición (1..n) del elemento en el arreglo de entrada. Los ids se toman de la
+-- secuencia antes de insertar para poder devolver cada uno junto a su idx.
+
+-- Accesos: [{"socio_id": .., "sede_id": ..}, ...]
+CREATE OR REPLACE FUNCTION sp_registrar_acceso_lote(p_items JSONB)
+RETURNS TABLE(idx INT, status TEXT, code INT, message TEXT, acceso_id BIGINT) AS $$
+#variable_conflict use_column
+BEGIN
+  RETURN QUERY
+  WITH req AS (
+    SELECT t.ord::int AS idx, (t.e->>'socio_id')::bigint AS socio_id, (t.e->>'sede_id')::bigint AS sede_id
+    FROM jsonb_array_elements(p_items) WITH ORDINALITY AS t(e, ord)
+  ), dec AS MATERIALIZED (
+    SELECT r.*, CASE WHEN v.ok THEN nextval(pg_get_serial_sequence('acceso', 'id')) END AS new_id
+    FROM req r
+    LEFT JOIN LATERAL (
+      SELECT s.acceso_valido_hasta >= CURRENT_DATE AS ok FROM socio s WHERE s.id = r.socio_id
+    ) v ON true
+  ), ins AS (
+    INSERT INTO acceso(id, socio_id, sede_id)
+    SELECT new_id, socio_id, sede_id FROM dec WHERE new_id IS NOT NULL
+  )
+  SELECT d.idx,
+         CASE WHEN d.new_id IS NULL THEN 'ERROR' ELSE 'OK' END,
+         CASE WHEN d.new_id IS NULL THEN 403 ELSE 0 END,
+         CASE WHEN d.new_id IS NULL THEN 'Membresía no activa' ELSE 'Acceso registrado' END,
+         d.new_id
+  FROM dec d ORDER BY d.idx;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Check-in: [reserva_id, ...]
+CREATE OR REPLACE FUNCTION sp_checkin_clase_lote(p_reserva_ids JSONB)
+RETURNS TABLE(idx INT, reserva_id BIGINT, status TEXT, code INT, message TEXT) AS $$
+#variable_conflict use_column
+BEGIN
+  RETURN QUERY
+  WITH req AS (
+    SELECT t.ord::int AS idx, t.v::bigint AS reserva_id
+    FROM jsonb_array_elements_text(p_reserva_ids) WITH ORDINALITY AS t(v, ord)
+  ), upd AS (
+    UPDATE reserva r SET estado = 'asistio'
+    FROM (SELECT DISTINCT reserva_id FROM req) q
+    WHERE r.id = q.reserva_id AND r.estado = 'confirmada'
+    RETURNING r.id
+  )
+  SELECT q.idx, q.reserva_id,
+         CASE WHEN u.id IS NULL THEN 'ERROR' ELSE 'OK' END,
+         CASE WHEN u.id IS NULL THEN 404 ELSE 0 END,
+         CASE WHEN u.id IS NULL THEN 'Reserva no válida' ELSE 'Asistencia registrada' END
+  FROM req q LEFT JOIN upd u ON u.id = q.reserva_id
+  ORDER BY q.idx;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Membresías: [{"socio_id": .., "plan_id": .., "fecha_inicio": "YYYY-MM-DD"}, ...]
+CREATE OR REPLACE FUNCTION sp_crear_membresia_lote(p_items JSONB)
+RETURNS TABLE(idx INT, status TEXT, code INT, message TEXT, membresia_id BIGINT) AS $$
+#variable_conflict use_column
+BEGIN
+  RETURN QUERY
+  WITH req AS (
+    SELECT t.ord::int AS idx, (t.e->>'socio_id')::bigint AS socio_id, (t.e->>'plan_id')::bigint AS plan_id,
+           COALESCE((t.e->>'fecha_inicio')::date, CURRENT_DATE) AS fecha_inicio
+    FROM jsonb_array_elements(p_items) WITH ORDINALITY AS t(e, ord)
+  ), dec AS MATERIALIZED (
+    SELECT r.*, p.duracion_dias,
+           CASE WHEN p.id IS NULL THEN 404 WHEN s.id IS NULL THEN 422 ELSE 0 END AS code
+    FROM req r
+    LEFT JOIN membresia_plan p ON p.id = r.plan_id
+    LEFT JOIN socio s ON s.id = r.socio_id
+  ), ids AS MATERIALIZED (
+    SELECT d.*, CASE WHEN d.code = 0 THEN nextval(pg_get_serial_sequence('membresia', 'id')) END AS new_id
+    FROM dec d
+  ), ins AS (
+    INSERT INTO membresia(id, socio_id, plan_id, fecha_inicio, fecha_fin, estado)
+    SELECT new_id, socio_id, plan_id, fecha_inicio, fecha_inicio + duracion_dias, 'activa'
+    FROM ids WHERE new_id IS NOT NULL
+  )
+  SELECT i.idx,
+         CASE WHEN i.code = 0 THEN 'OK' ELSE 'ERROR' END,
+         i.code,
+         CASE i.code WHEN 0 THEN 'Membresía creada' WHEN 404 THEN 'Plan no existe' ELSE 'Socio no existe' END,
+         i.new_id
+  FROM ids i ORDER BY i.idx;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Pagos: [{"socio_id": .., "concepto": .., "monto": .., "medio": .., "ref": ..}, ...]
+CREATE OR REPLACE FUNCTION sp_registrar_pago_lote(p_items JSONB)
+RETURNS TABLE(idx INT, status TEXT, code INT, message TEXT, pago_id BIGINT) AS $$
+#variable_conflict use_column
+BEGIN
+  RETURN QUERY
+  WITH req AS (
+    SELECT t.ord::int AS idx, (t.e->>'socio_id')::bigint AS socio_id, t.e->>'concepto' AS concepto,
+           (t.e->>'monto')::numeric AS monto, t.e->>'medio' AS medio, t.e->>'ref' AS ref
+    FROM jsonb_array_elements(p_items) WITH ORDINALITY AS t(e, ord)
+  ), dec AS MATERIALIZED (
+    SELECT r.*,
+           CASE WHEN s.id IS NULL THEN 422
+                WHEN r.concepto IS NULL OR r.monto IS NULL OR r.medio IS NULL THEN 400
+                ELSE 0 END AS code
+    FROM req r LEFT JOIN socio s ON s.id = r.socio_id
+  ), ids AS MATERIALIZED (
+    SELECT d.*, CASE WHEN d.code = 0 THEN nextval(pg_get_serial_sequence('pago', 'id')) END AS new_id
+    FROM dec d
+  ), ins AS (
+    INSERT INTO pago(id, socio_id, concepto, monto, medio, ref_externa)
+    SELECT new_id, socio_id, concepto, monto, medio, ref FROM ids WHERE new_id IS NOT NULL
+  )
+  SELECT i.idx,
+         CASE WHEN i.code = 0 THEN 'OK' ELSE 'ERROR' END,
+         i.code,
+         CASE i.code WHEN 0 THEN 'Pago registrado' WHEN 422 THEN 'Socio no existe' ELSE 'Datos incompletos' END,
+         i.new_id
+  FROM ids i ORDER BY i.idx;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reservas: [{"socio_id": .., "clase_id": ..}, ...]; el cupo se asigna en orden de idx
+-- y el resto queda en lista de espera (WAITLIST, 202)
+CREATE OR REPLACE FUNCTION sp_reservar_clase_lote(p_items JSONB)
+RETURNS TABLE(idx INT, status TEXT, code INT, message TEXT, reserva_id BIGINT) AS $$
+#variable_conflict use_column
+BEGIN
+  -- bloquea las clases involucradas: reservadas no cambia hasta el commit
+  PERFORM 1 FROM clase
+   WHERE id IN (SELECT (e->>'clase_id')::bigint FROM jsonb_array_elements(p_items) e)
+   ORDER BY id FOR UPDATE;
+
+  RETURN QUERY
+  WITH req AS (
+    SELECT t.ord::int AS idx, (t.e->>'socio_id')::bigint AS socio_id, (t.e->>'clase_id')::bigint AS clase_id
+    FROM jsonb_array_elements(p_items) WITH ORDINALITY AS t(e, ord)
+  ), base AS (
+    SELECT r.*, c.capacidad - c.reservadas AS libres,
+           EXISTS (SELECT 1 FROM reserva x WHERE x.clase_id = r.clase_id AND x.socio_id = r.socio_id
+                   AND x.estado <> 'cancelada') AS ya,
+           row_number() OVER (PARTITION BY r.clase_id, r.socio_id ORDER BY r.idx) AS rep
+    FROM req r LEFT JOIN clase c ON c.id = r.clase_id AND c.estado = 'programada'
+  ), cand AS (
+    SELECT b.idx, row_number() OVER (PARTITION BY b.clase_id ORDER BY b.idx) AS puesto
+    FROM base b WHERE b.libres IS NOT NULL AND NOT b.ya AND b.rep = 1
+  ), dec AS MATERIALIZED (
+    SELECT b.*,
+           CASE WHEN b.libres IS NULL THEN 404
+                WHEN b.ya OR b.rep > 1 THEN 409
+                WHEN c.puesto > b.libres THEN 202
+                ELSE 0 END AS code
+    FROM base b LEFT JOIN cand c ON c.idx = b.idx
+  ), ins AS (
+    INSERT INTO reserva(clase_id, socio_id, estado)
+    SELECT clase_id, socio_id, CASE code WHEN 0 THEN 'confirmada' ELSE 'waitlist' END
+    FROM dec WHERE code IN (0, 202)
+    ON CONFLICT (clase_id, socio_id) DO UPDATE SET estado = EXCLUDED.estado, fecha_reserva = now()
+      WHERE reserva.estado = 'cancelada'
+    RETURNING id, clase_id, socio_id
+  ), cnt AS (
+    UPDATE clase c SET reservadas = c.reservadas + n.n
+    FROM (SELECT clase_id, COUNT(*) AS n FROM dec WHERE code = 0 GROUP BY clase_id) n
+    WHERE c.id = n.clase_id
+  )
+  SELECT d.idx,
+         CASE d.code WHEN 0 THEN 'OK' WHEN 202 THEN 'WAITLIST' ELSE 'ERROR' END,
+         d.code,
+         CASE d.code WHEN 0 THEN 'Reserva confirmada' WHEN 202 THEN 'Cupo lleno: en lista de espera'
+                     WHEN 404 THEN 'Clase no disponible'
+                     ELSE CASE WHEN d.ya THEN 'Ya tiene reserva' ELSE 'Repetido en el lote' END END,
+         i.id
+  FROM dec d LEFT JOIN ins i ON i.clase_id = d.clase_id AND i.socio_id = d.socio_id AND d.code IN (0, 202)
+  ORDER BY d.idx;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ===== Cupos de clase (clase.reservadas) =====
+-- Los SP de reserva mantienen el contador; aquí se cubre lo que pasa por fuera:
+-- borrados de reservas (p. ej. al eliminar un socio) y subidas de capacidad.
+CREATE OR REPLACE FUNCTION fn_reserva_borrada()
+RETURNS trigger AS $$
+DECLARE v_clase BIGINT;
+BEGIN
+  FOR v_clase IN
+    WITH d AS (
+      SELECT clase_id, COUNT(*) AS n FROM viejos WHERE estado IN ('confirmada', 'asistio') GROUP BY clase_id
+    )
+    UPDATE clase c SET reservadas = GREATEST(c.reservadas - d.n, 0)
+    FROM d WHERE c.id = d.clase_id RETURNING c.id
+  LOOP
+    PERFORM sp_promover_waitlist(v_clase);
+  END LOOP;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_reserva_cupo_del ON reserva;
+CREATE TRIGGER trg_reserva_cupo_del AFTER DELETE ON reserva
+  REFERENCING OLD TABLE AS viejos FOR EACH STATEMENT EXECUTE FUNCTION fn_reserva_borrada();
+
+CREATE OR REPLACE FUNCTION fn_clase_capacidad()
+RETURNS trigger AS $$
+BEGIN
+  PERFORM sp_promover_waitlist(NEW.id);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_clase_capacidad ON clase;
+CREATE TRIGGER trg_clase_capacidad AFTER UPDATE OF capacidad, estado ON clase
+  FOR EACH ROW WHEN (NEW.capacidad > OLD.capacidad OR (NEW.estado = 'programada' AND OLD.estado <> 'programada'))
+  EXECUTE FUNCTION fn_clase_capacidad();
+
+-- Inicializa el contador con las reservas existentes
+UPDATE clase c SET reservadas = COALESCE(x.n, 0)
+FROM clase c2
+LEFT JOIN (SELECT clase_id, COUNT(*) AS n FROM reserva WHERE estado IN ('confirmada', 'asistio') GROUP BY clase_id) x
+  ON x.clase_id = c2.id
+WHERE c.id = c2.id AND c.reservadas IS DISTINCT FROM COALESCE(x.n, 0);
+
+-- ===== Login =====
+-- Verifica la contraseña (bcrypt o SHA-256 heredado), migra los SHA-256 a bcrypt
+-- y devuelve usuario, roles y permisos efectivos en una sola llamada.
+-- Sin tablas RBAC: roles = {rol} y permisos NULL (la app usa su mapa por rol).
+CREATE OR REPLACE FUNCTION sp_login(p_email TEXT, p_password TEXT)
+RETURNS TABLE(status TEXT, code INT, message TEXT, user_id BIGINT, email TEXT, rol TEXT,
+              sede_id BIGINT, roles TEXT[], permisos TEXT[]) AS $$
+DECLARE
+  u app_user%ROWTYPE;
+  v_ok BOOLEAN;
+  v_pgcrypto BOOLEAN := EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pgcrypto');
+BEGIN
+  SELECT * INTO u FROM app_user a WHERE a.email = p_email;
+  IF NOT FOUND THEN
+    status := 'ERROR'; code := 401; message := 'Credenciales inválidas'; RETURN NEXT; RETURN;
+  END IF;
+
+  -- '$<algoritmo>$...' (bcrypt, md5-crypt...) lo verifica crypt(); SHA-256 hex es el formato
+  -- anterior y se migra a bcrypt al ingresar. Cualquier otro formato no se acepta.
+  IF u.password_hash LIKE '$%' THEN
+    v_ok := v_pgcrypto AND u.password_hash = crypt(p_password, u.password_hash);
+  ELSIF u.password_hash ~ '^[0-9a-f]{64}$' THEN
+    v_ok := u.password_hash = encode(sha256(convert_to(p_password, 'UTF8')), 'hex');
+    IF v_ok AND v_pgcrypto THEN
+      UPDATE app_user SET password_hash = crypt(p_password, gen_salt('bf', 10)) WHERE id = u.id;
+    END IF;
+  ELSE
+    v_ok := false;
+  END IF;
+  IF NOT v_ok THEN
+    status := 'ERROR'; code := 401; message := 'Credenciales inválidas'; RETURN NEXT; RETURN;
+  END IF;
+
+  status := 'OK'; code := 0; message := 'Ingreso correcto';
+  user_id := u.id; email := u.email; rol := u.rol; sede_id := u.sede_id;
+  roles := ARRAY[u.rol];
+  IF to_regclass('user_role') IS NOT NULL AND to_regclass('role') IS NOT NULL THEN
+    EXECUTE 'SELECT COALESCE(array_agg(r.name ORDER BY r.name), ''{}'')
+             FROM user_role ur JOIN role r ON r.id = ur.role_id WHERE ur.user_id = $1'
+      INTO roles USING u.id;
+  END IF;
+  IF to_regclass('v_user_permissions') IS NOT NULL THEN
+    EXECUTE 'SELECT COALESCE(array_agg(DISTINCT perm), ''{}'') FROM v_user_permissions WHERE user_id = $1'
+      INTO permisos USING u.id;
+  END IF;
+  RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ===== Notificación de cambios (LISTEN/NOTIFY) =====
+-- Cada escritura en tablas cacheadas por la app publica el nombre de la tabla en el canal
+-- 'tabla_cambio'; todas las instancias invalidan su caché de resultados al recibirlo.
+-- Solo si la sentencia tocó filas: un UPDATE/DELETE sin coincidencias no vacía cachés ajenas.
+CREATE OR REPLACE FUNCTION fn_notificar_cambio()
+RETURNS trigger AS $$
+BEGIN
+  -- cada tabla de transición solo existe en su operación: consultarla en ramas separadas
+  IF TG_OP = 'INSERT' THEN
+    IF NOT EXISTS (SELECT 1 FROM nuevos) THEN RETURN NULL; END IF;
+  ELSIF TG_LEVEL = 'STATEMENT' AND TG_OP IN ('UPDATE', 'DELETE') THEN
+    IF NOT EXISTS (SELECT 1 FROM viejos) THEN RETURN NULL; END IF;
+  END IF;
+  PERFORM pg_notify('tabla_cambio', TG_TABLE_NAME);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Crea los triggers de aviso de una tabla (con tablas de transición para saber si hubo filas).
+-- p_update = false: el UPDATE lo cubre otro trigger (ver clase).
+CREATE OR REPLACE FUNCTION fn_crear_triggers_notificar(p_tabla TEXT, p_update BOOLEAN DEFAULT true)
+RETURNS void AS $$
+BEGIN
+  EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_notificar ON %I', p_tabla, p_tabla);
+  EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_notificar_ins ON %I', p_tabla, p_tabla);
+  EXECUTE format('CREATE TRIGGER trg_%s_notificar_ins AFTER INSERT ON %I REFERENCING NEW TABLE AS nuevos
+                  FOR EACH STATEMENT EXECUTE FUNCTION fn_notificar_cambio()', p_tabla, p_tabla);
+  EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_notificar_upd ON %I', p_tabla, p_tabla);
+  IF p_update THEN
+    EXECUTE format('CREATE TRIGGER trg_%s_notificar_upd AFTER UPDATE ON %I REFERENCING OLD TABLE AS viejos
+                    FOR EACH STATEMENT EXECUTE FUNCTION fn_notificar_cambio()', p_tabla, p_tabla);
+  END IF;
+  EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_notificar_del ON %I', p_tabla, p_tabla);
+  EXECUTE format('CREATE TRIGGER trg_%s_notificar_del AFTER DELETE ON %I REFERENCING OLD TABLE AS viejos
+                  FOR EACH STATEMENT EXECUTE FUNCTION fn_notificar_cambio()', p_tabla, p_tabla);
+  EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_notificar_trunc ON %I', p_tabla, p_tabla);
+  EXECUTE format('CREATE TRIGGER trg_%s_notificar_trunc AFTER TRUNCATE ON %I
+                  FOR EACH STATEMENT EXECUTE FUNCTION fn_notificar_cambio()', p_tabla, p_tabla);
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+  PERFORM fn_crear_triggers_notificar(t)
+  FROM unnest(ARRAY['sede','socio','membresia_plan','membresia','reserva','producto','app_user','pago']) AS t;
+  PERFORM fn_crear_triggers_notificar('clase', false);
+END $$;
+
+-- clase: solo los cambios visibles. El contador de cupos (reservadas) cambia con cada reserva y
+-- se lee sin caché; avisarlo vaciaría la caché de clases en cada instancia y pondría cada reserva
+-- en fila por el lock global de NOTIFY al hacer commit. Las tablas de transición no admiten lista
+-- de columnas, así que el UPDATE va por fila con WHEN (NOTIFY descarta los avisos repetidos).
+CREATE TRIGGER trg_clase_notificar_upd
+  AFTER UPDATE OF sede_id, nombre, fecha_hora, capacidad, estado ON clase FOR EACH ROW
+  WHEN ((OLD.sede_id, OLD.nombre, OLD.fecha_hora, OLD.capacidad, OLD.estado)
+        IS DISTINCT FROM (NEW.sede_id, NEW.nombre, NEW.fecha_hora, NEW.capacidad, NEW.estado))
+  EXECUTE FUNCTION fn_notificar_cambio();
+
+-- Tablas RBAC (opcionales): invalidan la caché de permisos de la app
+DO $$
+BEGIN
+  PERFORM fn_crear_triggers_notificar(t)
+  FROM unnest(ARRAY['role','user_role','permission','role_permission','user_permission']) AS t
+  WHERE to_regclass(t) IS NOT NULL;
+END $$;
+
+-- Avisos por socio para el perfil 360: publica 'socio:<id>,<id>...' en 'tabla_cambio' con los
+-- socios tocados, un aviso por sentencia (más de 200 socios, o TRUNCATE -> 'socio:*').
+-- TG_ARGV[0] = columna con el id del socio; TG_ARGV[1] = columnas que muestra el perfil: un UPDATE
+-- que no cambia ninguna (p. ej. la salida de un acceso) no avisa.
+CREATE OR REPLACE FUNCTION fn_notificar_socio()
+RETURNS trigger AS $$
+DECLARE
+  v_col TEXT := TG_ARGV[0];
+  v_ids BIGINT[];
+  v_lista TEXT;
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    v_lista := '*';
+  ELSIF TG_LEVEL = 'ROW' THEN
+    -- clase (por fila, solo si cambió algo visible): los socios con reserva vigente en ella
+    SELECT array_agg(DISTINCT r.socio_id) INTO v_ids
+    FROM reserva r WHERE r.clase_id = NEW.id AND r.estado IN ('confirmada', 'waitlist');
+  ELSIF TG_OP = 'UPDATE' THEN
+    EXECUTE format('SELECT array_agg(DISTINCT x) FROM nuevos n JOIN viejos o ON o.id = n.id,
+                           unnest(ARRAY[n.%1$I, o.%1$I]) x
+                    WHERE x IS NOT NULL AND (%2$s) IS DISTINCT FROM (%3$s)', v_col,
+      (SELECT string_agg(format('n.%I', c), ', ') FROM unnest(string_to_array(TG_ARGV[1], ',')) c),
+      (SELECT string_agg(format('o.%I', c), ', ') FROM unnest(string_to_array(TG_ARGV[1], ',')) c))
+      INTO v_ids;
+  ELSE
+    EXECUTE format('SELECT array_agg(DISTINCT %1$I) FROM %2$I WHERE %1$I IS NOT NULL', v_col,
+      CASE TG_OP WHEN 'INSERT' THEN 'nuevos' ELSE 'viejos' END) INTO v_ids;
+  END IF;
+  IF v_lista IS NULL THEN
+    IF v_ids IS NULL THEN
+      RETURN NULL;
+    END IF;
+    v_lista := CASE WHEN cardinality(v_ids) > 200 THEN '*' ELSE array_to_string(v_ids, ',') END;
+  END IF;
+  PERFORM pg_notify('tabla_cambio', 'socio:' || v_lista);
+  -- la instancia que escribe lo lee antes del commit e invalida su caché en el acto
+  PERFORM set_config('gym.socios', COALESCE(current_setting('gym.socios', true), '') || ',' || v_lista, true);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  t TEXT;
+  col TEXT;
+  vis TEXT;
+BEGIN
+  FOR t, col, vis IN VALUES
+      ('socio', 'id', 'dni,nombre,email,telefono,fecha_alta,estado,foto_url,acceso_valido_hasta'),
+      ('membresia', 'socio_id', 'socio_id,plan_id,fecha_inicio,fecha_fin,estado'),
+      ('pago', 'socio_id', 'socio_id,fecha,concepto,medio,monto'),
+      ('acceso', 'socio_id', 'socio_id,fecha_entrada'),
+      ('reserva', 'socio_id', 'socio_id,clase_id,estado'),
+      ('venta', 'socio_id', 'socio_id,fecha,total') LOOP
+    EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_socio_ins ON %I', t, t);
+    EXECUTE format('CREATE TRIGGER trg_%s_socio_ins AFTER INSERT ON %I REFERENCING NEW TABLE AS nuevos
+                    FOR EACH STATEMENT EXECUTE FUNCTION fn_notificar_socio(%L)', t, t, col);
+    EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_socio_upd ON %I', t, t);
+    EXECUTE format('CREATE TRIGGER trg_%s_socio_upd AFTER UPDATE ON %I REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+                    FOR EACH STATEMENT EXECUTE FUNCTION fn_notificar_socio(%L, %L)', t, t, col, vis);
+    EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_socio_del ON %I', t, t);
+    EXECUTE format('CREATE TRIGGER trg_%s_socio_del AFTER DELETE ON %I REFERENCING OLD TABLE AS viejos
+                    FOR EACH STATEMENT EXECUTE FUNCTION fn_notificar_socio(%L)', t, t, col);
+    EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_socio_trunc ON %I', t, t);
+    EXECUTE format('CREATE TRIGGER trg_%s_socio_trunc AFTER TRUNCATE ON %I
+                    FOR EACH STATEMENT EXECUTE FUNCTION fn_notificar_socio(%L)', t, t, col);
+  END LOOP;
+END $$;
+
+-- clase: por fila y solo si cambió algo que se ve en las reservas del perfil (no el contador de cupos)
+DROP TRIGGER IF EXISTS trg_clase_socio_upd ON clase;
+CREATE TRIGGER trg_clase_socio_upd
+  AFTER UPDATE OF nombre, fecha_hora, estado, sede_id ON clase FOR EACH ROW
+  WHEN ((OLD.nombre, OLD.fecha_hora, OLD.estado, OLD.sede_id) IS DISTINCT FROM (NEW.nombre, NEW.fecha_hora, NEW.estado, NEW.sede_id))
+  EXECUTE FUNCTION fn_notificar_socio('id');
@@ -1,4 +1,11 @@
 CREATE EXTENSION IF NOT EXISTS pgcrypto;
+-- Búsqueda por subcadena/similitud (opcional: sin pg_trgm la búsqueda usa prefijos y full-text)
+DO $$
+BEGIN
+  CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN OTHERS THEN
+  RAISE NOTICE 'pg_trgm no disponible: %', SQLERRM;
+END $$;
 
 -- Sedes
 CREATE TABLE IF NOT EXISTS sede (
@@ -25,10 +32,21 @@ CREATE TABLE IF NOT EXISTS socio (
   telefono TEXT,
   fecha_alta DATE DEFAULT CURRENT_DATE,
   estado TEXT NOT NULL DEFAULT 'activo', -- activo, inactivo
-  foto_url TEXT
+  foto_url TEXT,
+  acceso_valido_hasta DATE, -- mayor fecha_fin de sus membresías activas (triggers de membresia)
+  busqueda TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', coalesce(nombre, '') || ' ' || coalesce(email, ''))) STORED
 );
+ALTER TABLE socio ADD COLUMN IF NOT EXISTS acceso_valido_hasta DATE;
+ALTER TABLE socio ADD COLUMN IF NOT EXISTS busqueda TSVECTOR
+  GENERATED ALWAYS AS (to_tsvector('simple', coalesce(nombre, '') || ' ' || coalesce(email, ''))) STORED;
 CREATE UNIQUE INDEX IF NOT EXISTS ux_socio_dni ON socio(dni) WHERE dni IS NOT NULL;
 CREATE UNIQUE INDEX IF NOT EXISTS ux_socio_email ON socio(email) WHERE email IS NOT NULL;
+-- Búsqueda de socios (sp_buscar_socio): palabras por prefijo y prefijos de cada campo
+CREATE INDEX IF NOT EXISTS ix_socio_fts ON socio USING gin (busqueda);
+CREATE INDEX IF NOT EXISTS ix_socio_nombre_prefijo ON socio (lower(nombre) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ix_socio_email_prefijo ON socio (lower(email) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ix_socio_dni_prefijo ON socio (dni text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ix_socio_telefono_prefijo ON socio (telefono text_pattern_ops);
 
 -- Planes de membresía
 CREATE TABLE IF NOT EXISTS membresia_plan (
@@ -50,6 +68,8 @@ CREATE TABLE IF NOT EXISTS membresia (
 );
 CREATE INDEX IF NOT EXISTS ix_membresia_socio ON membresia(socio_id);
 CREATE INDEX IF NOT EXISTS ix_membresia_estado ON membresia(estado);
+-- Vigentes por vencimiento (job de expiración, alertas de vencimiento)
+CREATE INDEX IF NOT EXISTS ix_membresia_vigentes ON membresia(fecha_fin) WHERE estado = 'activa';
 
 -- Pagos
 CREATE TABLE IF NOT EXISTS pago (
@@ -61,8 +81,12 @@ CREATE TABLE IF NOT EXISTS pago (
   ref_externa TEXT,
   fecha TIMESTAMPTZ NOT NULL DEFAULT now()
 );
-CREATE INDEX IF NOT EXISTS ix_pago_socio ON pago(socio_id);
-CREATE INDEX IF NOT EXISTS ix_pago_fecha ON pago(fecha);
+-- Pagos de un socio por fecha (perfil 360); cubre también las búsquedas solo por socio
+DROP INDEX IF EXISTS ix_pago_socio;
+CREATE INDEX IF NOT EXISTS ix_pago_socio_fecha ON pago(socio_id, fecha);
+-- Listado paginado por (fecha, id) y rangos de fecha
+DROP INDEX IF EXISTS ix_pago_fecha;
+CREATE INDEX IF NOT EXISTS ix_pago_fecha_id ON pago(fecha DESC, id DESC);
 
 -- Clases
 CREATE TABLE IF NOT EXISTS clase (
@@ -71,8 +95,10 @@ CREATE TABLE IF NOT EXISTS clase (
   nombre TEXT NOT NULL,
   fecha_hora TIMESTAMPTZ NOT NULL,
   capacidad INT NOT NULL DEFAULT 10,
+  reservadas INT NOT NULL DEFAULT 0 CHECK (reservadas >= 0), -- cupos tomados (confirmada/asistio), lo mantienen los SP
   estado TEXT NOT NULL DEFAULT 'programada' -- programada, cancelada, realizada
 );
+ALTER TABLE clase ADD COLUMN IF NOT EXISTS reservadas INT NOT NULL DEFAULT 0 CHECK (reservadas >= 0);
 CREATE INDEX IF NOT EXISTS ix_clase_fecha ON clase(fecha_hora);
 
 -- Reservas
@@ -85,6 +111,9 @@ CREATE TABLE IF NOT EXISTS reserva (
   UNIQUE (clase_id, socio_id)
 );
 CREATE INDEX IF NOT EXISTS ix_reserva_estado ON reserva(estado);
+CREATE INDEX IF NOT EXISTS ix_reserva_socio ON reserva(socio_id);
+-- Lista de espera en orden de llegada
+CREATE INDEX IF NOT EXISTS ix_reserva_waitlist ON reserva(clase_id, fecha_reserva, id) WHERE estado = 'waitlist';
 
 -- Accesos (aforo)
 CREATE TABLE IF NOT EXISTS acceso (
@@ -96,6 +125,27 @@ CREATE TABLE IF NOT EXISTS acceso (
 );
 CREATE INDEX IF NOT EXISTS ix_acceso_sede ON acceso(sede_id);
 CREATE INDEX IF NOT EXISTS ix_acceso_abiertos ON acceso(sede_id, fecha_salida);
+CREATE INDEX IF NOT EXISTS ix_acceso_entrada ON acceso(fecha_entrada);
+CREATE INDEX IF NOT EXISTS ix_acceso_socio ON acceso(socio_id, fecha_entrada);
+
+-- Aforo por sede: contador mantenido por triggers sobre acceso (ver procedures.sql)
+CREATE TABLE IF NOT EXISTS sede_aforo (
+  sede_id BIGINT PRIMARY KEY REFERENCES sede(id) ON DELETE CASCADE,
+  dentro INT NOT NULL DEFAULT 0,
+  actualizado TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- KPIs del dashboard: fila 0 = global, filas negativas = incrementos globales repartidos
+-- (se suman a la 0), una fila por sede (solo accesos_hoy).
+-- La mantienen los triggers de socio/membresia/acceso; `dia` indica a qué fecha corresponde.
+CREATE TABLE IF NOT EXISTS kpi_snapshot (
+  sede_id BIGINT PRIMARY KEY,
+  dia DATE NOT NULL DEFAULT CURRENT_DATE,
+  socios INT NOT NULL DEFAULT 0,
+  membresias_activas INT NOT NULL DEFAULT 0,
+  accesos_hoy INT NOT NULL DEFAULT 0,
+  actualizado TIMESTAMPTZ NOT NULL DEFAULT now()
+);
 
 -- Productos / Ventas (simplificado)
 CREATE TABLE IF NOT EXISTS producto (
@@ -111,6 +161,8 @@ CREATE TABLE IF NOT EXISTS venta (
   fecha TIMESTAMPTZ NOT NULL DEFAULT now(),
   total NUMERIC(10,2) NOT NULL DEFAULT 0
 );
+CREATE INDEX IF NOT EXISTS ix_venta_fecha ON venta(fecha);
+CREATE INDEX IF NOT EXISTS ix_venta_socio ON venta(socio_id, fecha);
 
 CREATE TABLE IF NOT EXISTS venta_item (
   id BIGSERIAL PRIMARY KEY,
@@ -130,3 +182,16 @@ CREATE TABLE IF NOT EXISTS auditoria (
   detalle JSONB,
   ts TIMESTAMPTZ NOT NULL DEFAULT now()
 );
+-- Listado paginado por (fecha, id) en Auditoría
+CREATE INDEX IF NOT EXISTS ix_auditoria_ts_id ON auditoria(ts DESC, id DESC);
+
+-- Índices trigram (ILIKE '%texto%' y similitud) si pg_trgm está instalada
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+    CREATE INDEX IF NOT EXISTS ix_socio_nombre_trgm ON socio USING gin (nombre gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS ix_socio_email_trgm ON socio USING gin (email gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS ix_clase_nombre_trgm ON clase USING gin (nombre gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS ix_producto_nombre_trgm ON producto USING gin (nombre gin_trgm_ops);
+  END IF;
+END $$;